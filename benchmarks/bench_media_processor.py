@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+MediaProcessor 微基准测试
+
+在合成的消息对象上测量 process_media 的单条消息耗时，不需要 Telegram 会话。
+
+用法: python benchmarks/bench_media_processor.py [--messages 100000] [--repeat 5]
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pyrogram.enums import MessageMediaType
+
+from src.media_processor import MediaProcessor, MEDIA_KINDS
+
+
+class SyntheticThumb:
+    __slots__ = ('file_id', 'file_unique_id', 'file_size', 'width', 'height')
+
+    def __init__(self, file_id: str, file_unique_id: str, file_size: int):
+        self.file_id = file_id
+        self.file_unique_id = file_unique_id
+        self.file_size = file_size
+        self.width = 320
+        self.height = 180
+
+
+class SyntheticMedia:
+    __slots__ = ('file_id', 'file_unique_id', 'file_name', 'mime_type', 'file_size',
+                 'width', 'height', 'duration', 'thumbs')
+
+    def __init__(self, index: int, kind: str, file_index: int):
+        self.file_id = f"BQACAgUAAxkBAAI{index:012d}{kind}"
+        self.file_unique_id = f"AgAD{file_index:08d}"
+        self.file_name = f"file_{index}.pdf" if kind == 'document' else None
+        self.mime_type = {'video': "video/mp4", 'audio': "audio/mpeg", 'voice': "audio/ogg",
+                          'document': "application/pdf", 'animation': "video/mp4"}.get(kind)
+        self.file_size = 1024 * (index % 4096)
+        self.width = 1280
+        self.height = 720
+        self.duration = index % 600
+        self.thumbs = None if kind == 'photo' else [
+            SyntheticThumb(f"thumb_s_{index}", f"AQAD{file_index:08d}s", 1000),
+            SyntheticThumb(f"thumb_m_{index}", f"AQAD{file_index:08d}m", 4000),
+        ]
+
+
+class SyntheticMessage:
+    __slots__ = ('id', 'media') + tuple(MEDIA_KINDS)
+
+    def __init__(self, index: int, kind: str = None, media_enum: bool = True, file_index: int = None):
+        self.id = index
+        # 不设置 media 时访问该槽位会抛出 AttributeError，模拟没有 media 枚举字段的消息
+        if media_enum:
+            self.media = MessageMediaType(kind) if kind else None
+        for attr in MEDIA_KINDS:
+            setattr(self, attr, None)
+        if kind:
+            setattr(self, kind, SyntheticMedia(index, kind, index if file_index is None else file_index))
+
+
+class SyntheticClient:
+    def guess_extension(self, mime_type: str):
+        return {"video/mp4": ".mp4", "audio/mpeg": ".mp3", "audio/ogg": ".ogg"}.get(mime_type)
+
+
+# 媒体类型分布：约 40% 纯文本，30% 图片，其余为各类文件
+MIX = [(None, 40), ('photo', 30), ('video', 10), ('document', 6), ('sticker', 4),
+       ('voice', 4), ('audio', 3), ('animation', 2), ('video_note', 1)]
+
+
+def build_messages(count: int, seed: int, kinds=None, media_enum: bool = True, unique_files: int = None):
+    """
+    :param unique_files: 不同文件的数量，设置后消息会反复引用同一批文件（如常用贴纸）
+    """
+    rng = random.Random(seed)
+    population = [kind for kind, _ in (kinds or MIX)]
+    weights = [weight for _, weight in (kinds or MIX)]
+    return [
+        SyntheticMessage(
+            i, rng.choices(population, weights)[0], media_enum,
+            file_index=rng.randrange(unique_files) if unique_files else None
+        )
+        for i in range(1, count + 1)
+    ]
+
+
+def measure(domain_prefix: str, messages, repeat: int):
+    """返回最佳一轮的单条消息耗时（纳秒）和该轮的缓存命中率"""
+    client = SyntheticClient()
+    best = float('inf')
+    hit_rate = 0.0
+    for _ in range(repeat):
+        # 每轮使用新的处理器，避免上一轮的缓存影响结果
+        processor = MediaProcessor(domain_prefix)
+        start = time.perf_counter()
+        for msg in messages:
+            processor.process_media(msg, client)
+        elapsed = time.perf_counter() - start
+        if elapsed < best:
+            best = elapsed
+            hit_rate = processor.cache.hit_rate
+    return best / len(messages) * 1e9, hit_rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MediaProcessor 微基准测试")
+    parser.add_argument("--messages", type=int, default=100000, help="每个场景的消息数")
+    parser.add_argument("--repeat", type=int, default=5, help="重复轮数（取最佳）")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    domain_prefix = "https://cdn.example.com/tg"
+    scenarios = [
+        ("混合频道", build_messages(args.messages, args.seed)),
+        ("纯文本", build_messages(args.messages, args.seed, kinds=[(None, 1)])),
+        ("纯图片", build_messages(args.messages, args.seed, kinds=[('photo', 1)])),
+        ("带缩略图的视频", build_messages(args.messages, args.seed, kinds=[('video', 1)])),
+        ("混合频道（无 media 字段）", build_messages(args.messages, args.seed, media_enum=False)),
+        ("重复贴纸（200 个文件）", build_messages(args.messages, args.seed, kinds=[('sticker', 1)], unique_files=200)),
+    ]
+
+    print(f"{'场景':<24}{'ns/消息':>12}{'消息/秒':>14}{'缓存命中率':>12}")
+    for name, messages in scenarios:
+        ns, hit_rate = measure(domain_prefix, messages, args.repeat)
+        print(f"{name:<24}{ns:>12.0f}{1e9 / ns:>14,.0f}{hit_rate:>12.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""
+离线的 Pyrogram 客户端替身
+
+在可复现的合成频道上实现 get_messages、get_media_group、get_chat、get_chat_history、stream_media 和 guess_extension，
+用于在没有 Telegram 会话的情况下对 MessageProcessor、MediaProcessor 和生成器做性能测试。
+频道布局在构造时以紧凑数组预先生成，消息对象在请求时按需构造，百万级频道也只占用数 MB 内存。
+"""
+
+import asyncio
+import mimetypes
+import random
+from array import array
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from pyrogram.enums import ChatType, MessageMediaType
+from pyrogram.errors import FloodWait
+
+# 媒体类型编码（0 表示纯文本）
+MEDIA_CODES = ['', 'photo', 'video', 'audio', 'voice', 'document', 'sticker', 'animation', 'video_note']
+MIME_TYPES = {
+    'video': "video/mp4", 'audio': "audio/mpeg", 'voice': "audio/ogg", 'document': "application/pdf",
+    'sticker': "image/webp", 'animation': "video/mp4", 'video_note': "video/mp4",
+}
+WORDS = ("telegram backup channel archive python async export media photo video update "
+         "频道 备份 消息 图片 视频 更新 永久 链接 测试 性能").split()
+
+
+@dataclass
+class ChannelSpec:
+    """合成频道参数"""
+    size: int = 10000                   # 最大消息ID
+    seed: int = 42
+    # 各媒体类型的权重，键为 MEDIA_CODES 中的名称，"" 表示纯文本
+    media_mix: Dict[str, float] = field(default_factory=lambda: {
+        '': 45, 'photo': 30, 'video': 10, 'document': 5, 'sticker': 4,
+        'voice': 2, 'audio': 2, 'animation': 1.5, 'video_note': 0.5,
+    })
+    media_group_density: float = 0.05   # 某条图片消息开启媒体组的概率
+    max_group_size: int = 10
+    reply_density: float = 0.1          # 回复之前消息的比例
+    deleted_density: float = 0.05       # 单个ID被删除的概率
+    gap_density: float = 0.0005         # 开始一大段连续删除的概率
+    max_gap: int = 2000
+    sticker_pool: int = 200             # 贴纸反复使用的不同文件数
+    flood_wait_rate: float = 0.0        # 每次 get_messages 触发 FloodWait 的概率
+    flood_wait_seconds: int = 1
+    latency: float = 0.0                # 每次请求的模拟网络延迟（秒）
+
+
+class FakeChat:
+    __slots__ = ('id', 'title', 'username', 'description', 'members_count', 'type')
+
+    def __init__(self, chat_id: int, spec: ChannelSpec):
+        self.id = chat_id
+        self.title = f"Synthetic Channel ({spec.size} ids)"
+        self.username = "synthetic_channel"
+        self.description = f"seed={spec.seed}"
+        self.members_count = 1000
+        self.type = ChatType.CHANNEL
+
+
+class FakeThumb:
+    __slots__ = ('file_id', 'file_unique_id', 'file_size', 'width', 'height')
+
+    def __init__(self, file_key: str):
+        self.file_id = f"thumb-{file_key}-session"
+        self.file_unique_id = f"thumb-{file_key}"
+        self.file_size = 4096
+        self.width = 320
+        self.height = 180
+
+
+class FakeMedia:
+    __slots__ = ('file_id', 'file_unique_id', 'file_name', 'mime_type', 'file_size',
+                 'width', 'height', 'duration', 'thumbs')
+
+    def __init__(self, kind: str, file_key: str, rng: random.Random):
+        # file_id 带有会话成分，file_unique_id 只与文件有关
+        self.file_id = f"{kind}-{file_key}-session"
+        self.file_unique_id = f"{kind}-{file_key}"
+        self.file_name = f"{file_key}.pdf" if kind == 'document' else None
+        self.mime_type = MIME_TYPES.get(kind)
+        self.file_size = rng.randrange(10_000, 50_000_000)
+        self.width = 1280
+        self.height = 720
+        self.duration = rng.randrange(1, 600) if kind in ('video', 'audio', 'voice', 'animation', 'video_note') else None
+        self.thumbs = None if kind in ('photo', 'voice', 'audio') else [FakeThumb(file_key)]
+
+
+class FakeMessage:
+    __slots__ = ('id', 'date', 'text', 'caption', 'views', 'forwards', 'media_group_id',
+                 'reply_to_message_id', 'author_signature', 'forward_from', 'forward_from_chat',
+                 'forward_sender_name', 'media', 'empty') + tuple(MEDIA_CODES[1:])
+
+    def __init__(self, message_id: int):
+        self.id = message_id
+        self.empty = False
+        self.date = None
+        self.text = None
+        self.caption = None
+        self.views = None
+        self.forwards = None
+        self.media_group_id = None
+        self.reply_to_message_id = None
+        self.author_signature = None
+        self.forward_from = None
+        self.forward_from_chat = None
+        self.forward_sender_name = None
+        self.media = None
+        for kind in MEDIA_CODES[1:]:
+            setattr(self, kind, None)
+
+
+class EmptyMessage:
+    """已删除或不存在的消息（对应 Pyrogram 的 empty=True 消息）"""
+    __slots__ = ('id', 'empty')
+
+    def __init__(self, message_id: int):
+        self.id = message_id
+        self.empty = True
+
+
+class SyntheticChannel:
+    """按 ChannelSpec 预先生成的频道布局"""
+
+    EPOCH = datetime(2020, 1, 1)
+
+    def __init__(self, spec: ChannelSpec):
+        self.spec = spec
+        size = spec.size
+        rng = random.Random(spec.seed)
+
+        # 下标 0 不使用，消息ID从 1 开始
+        self.media = array('b', bytes(size + 1))     # 媒体类型编码，-1 表示已删除
+        self.group = array('l', [0]) * (size + 1)    # 媒体组首条消息ID，0 表示不在媒体组中
+        self.reply = array('l', [0]) * (size + 1)    # 被回复的消息ID
+
+        kinds = [MEDIA_CODES.index(kind) for kind in spec.media_mix]
+        weights = list(spec.media_mix.values())
+        photo = MEDIA_CODES.index('photo')
+        self.media[0] = -1
+
+        message_id = 1
+        while message_id <= size:
+            if rng.random() < spec.gap_density:
+                gap = rng.randrange(1, spec.max_gap + 1)
+                for i in range(message_id, min(size, message_id + gap - 1) + 1):
+                    self.media[i] = -1
+                message_id += gap
+                continue
+
+            if rng.random() < spec.deleted_density and message_id < size:
+                self.media[message_id] = -1
+                message_id += 1
+                continue
+
+            kind = rng.choices(kinds, weights)[0]
+            if kind == photo and rng.random() < spec.media_group_density:
+                # 媒体组成员的ID连续
+                members = min(rng.randrange(2, spec.max_group_size + 1), size - message_id + 1)
+                for i in range(message_id, message_id + members):
+                    self.media[i] = photo
+                    self.group[i] = message_id
+                message_id += members
+                continue
+
+            self.media[message_id] = kind
+            if message_id > 1 and rng.random() < spec.reply_density:
+                self.reply[message_id] = rng.randrange(max(1, message_id - 500), message_id)
+            message_id += 1
+
+        # 最后一条消息始终存在，方便范围探测
+        if self.media[size] == -1:
+            self.media[size] = 0
+
+        # 模拟频道中后来发生的编辑：消息ID → 新文本
+        self.edits: Dict[int, str] = {}
+
+    def edit(self, message_id: int, text: str):
+        """修改消息文本（媒体消息修改说明文字）"""
+        self.edits[message_id] = text
+
+    def delete(self, message_ids: List[int]):
+        """删除消息"""
+        for message_id in message_ids:
+            self.media[message_id] = -1
+
+    @property
+    def latest_id(self) -> int:
+        return self.spec.size
+
+    def message(self, message_id: int):
+        """按需构造消息对象"""
+        if message_id < 1 or message_id > self.spec.size or self.media[message_id] == -1:
+            return EmptyMessage(message_id)
+
+        rng = random.Random(self.spec.seed * 1_000_003 + message_id)
+        msg = FakeMessage(message_id)
+        msg.date = self.EPOCH + timedelta(minutes=7 * message_id)
+        msg.views = rng.randrange(100, 100_000)
+        msg.forwards = rng.randrange(0, 500)
+
+        group_id = self.group[message_id]
+        if group_id:
+            msg.media_group_id = str(group_id)
+        if self.reply[message_id]:
+            msg.reply_to_message_id = self.reply[message_id]
+
+        text = " ".join(rng.choices(WORDS, k=rng.randrange(3, 40)))
+        text = self.edits.get(message_id, text)
+        kind = MEDIA_CODES[self.media[message_id]]
+        if kind:
+            # 媒体组中只有第一条带说明文字
+            if not group_id or group_id == message_id:
+                msg.caption = text
+            file_key = f"s{rng.randrange(self.spec.sticker_pool)}" if kind == 'sticker' else f"m{message_id}"
+            setattr(msg, kind, FakeMedia(kind, file_key, rng))
+            msg.media = MessageMediaType(kind)
+        else:
+            msg.text = text
+
+        return msg
+
+
+class FakeClient:
+    """实现 MessageProcessor 用到的 Pyrogram 客户端接口"""
+
+    def __init__(self, spec: Optional[ChannelSpec] = None, chat_id: int = -1001234567890):
+        self.spec = spec or ChannelSpec()
+        self.channel = SyntheticChannel(self.spec)
+        self.chat_id = chat_id
+        self.requests = 0
+        self.flood_waits = 0
+        self._rng = random.Random(self.spec.seed + 1)
+
+    async def get_messages(self, chat_id: int, ids: List[int]):
+        self.requests += 1
+        if self.spec.latency:
+            await asyncio.sleep(self.spec.latency)
+        if self.spec.flood_wait_rate and self._rng.random() < self.spec.flood_wait_rate:
+            self.flood_waits += 1
+            raise FloodWait(value=self.spec.flood_wait_seconds)
+        return [self.channel.message(i) for i in ids]
+
+    async def get_media_group(self, chat_id: int, message_id: int):
+        self.requests += 1
+        if self.spec.latency:
+            await asyncio.sleep(self.spec.latency)
+        group_id = self.channel.group[message_id] if 0 < message_id <= self.spec.size else 0
+        if not group_id:
+            raise ValueError(f"消息 {message_id} 不属于媒体组")
+        members = []
+        member_id = group_id
+        while member_id <= self.spec.size and self.channel.group[member_id] == group_id:
+            members.append(self.channel.message(member_id))
+            member_id += 1
+        return members
+
+    async def get_chat(self, chat_id: int) -> FakeChat:
+        self.requests += 1
+        return FakeChat(chat_id, self.spec)
+
+    async def get_chat_history(self, chat_id: int, limit: int = 0):
+        self.requests += 1
+        count = 0
+        for message_id in range(self.channel.latest_id, 0, -1):
+            msg = self.channel.message(message_id)
+            if msg.empty:
+                continue
+            yield msg
+            count += 1
+            if limit and count >= limit:
+                return
+
+    async def stream_media(self, file_id: str, offset: int = 0):
+        """按 1 MB 分块返回由 file_id 确定的合成文件内容（缩略图 4 KB，其余 1.5 MB）"""
+        self.requests += 1
+        size = 4096 if file_id.startswith("thumb-") else 3 * 512 * 1024
+        data = (file_id.encode() * (size // len(file_id) + 1))[:size]
+        chunk_size = 1024 * 1024
+        for start in range(offset * chunk_size, size, chunk_size):
+            if self.spec.latency:
+                await asyncio.sleep(self.spec.latency)
+            yield data[start:start + chunk_size]
+
+    @staticmethod
+    def guess_extension(mime_type: str) -> Optional[str]:
+        return mimetypes.guess_extension(mime_type)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+端到端离线基准测试
+
+使用 FakeClient 提供的合成频道运行完整的导出流程（抓取 → 转换 → 写入帖子存储 → 生成输出），
+报告每个规模的处理速度、峰值内存和输出生成耗时。每个规模在独立子进程中运行，峰值内存互不影响。
+
+用法:
+    python benchmarks/run_benchmarks.py [--sizes 10000 100000 1000000]
+    python benchmarks/run_benchmarks.py --save baseline.json
+    python benchmarks/run_benchmarks.py --baseline baseline.json --tolerance 0.15
+    python benchmarks/run_benchmarks.py --sizes 10000 --metrics-dir reports/
+    python benchmarks/run_benchmarks.py --sizes 10000 --profile profile/
+"""
+
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+DOMAIN_PREFIX = "https://cdn.example.com/tg"
+
+
+def peak_rss_mb() -> float:
+    """当前进程的峰值常驻内存（MB）"""
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 以字节为单位，Linux 以 KB 为单位
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+async def run_export(spec, output_dir: Path, concurrency: int, profile_dir: Path = None) -> dict:
+    """在合成频道上运行一次完整导出，返回测量结果"""
+    from src.profiler import profiler
+    from fake_client import FakeClient
+    from src.blog_generator import BlogGenerator
+    from src.config import RSSConfig
+    from src.media_processor import MediaProcessor
+    from src.message_processor import MessageProcessor
+    from src.post_store import PostStore
+    from src.rate_limiter import TokenBucket
+
+    build_start = time.perf_counter()
+    client = FakeClient(spec)
+    build_seconds = time.perf_counter() - build_start
+
+    if profile_dir:
+        profiler.start(profile_dir)
+    post_store = PostStore(output_dir / "posts.db")
+    # 离线运行不需要限速，只保留 FloodWait 退避逻辑
+    rate_limiter = TokenBucket(rate=1e9, burst=10 ** 9)
+    processor = MessageProcessor(client, MediaProcessor(DOMAIN_PREFIX), post_store, rate_limiter)
+
+    start = time.perf_counter()
+    written = await processor.process_messages(
+        channel_id=client.chat_id,
+        start_id=1,
+        end_id=spec.size,
+        output_path=str(output_dir),
+        concurrency=concurrency
+    )
+    process_seconds = time.perf_counter() - start
+
+    rss = RSSConfig(
+        title="Synthetic Channel", link="https://example.com", description="benchmark",
+        language="zh-CN", image_url="https://example.com/logo.png"
+    )
+    generator = BlogGenerator(str(output_dir), rss)
+    start = time.perf_counter()
+    generator.generate_all(post_store)
+    generate_seconds = time.perf_counter() - start
+    post_store.close()
+    if profile_dir:
+        profiler.stop()
+
+    return {
+        "size": spec.size,
+        "posts": written,
+        "requests": client.requests,
+        "flood_waits": client.flood_waits,
+        "build_seconds": round(build_seconds, 3),
+        "process_seconds": round(process_seconds, 3),
+        "msgs_per_second": round(spec.size / process_seconds, 1) if process_seconds else 0.0,
+        "generate_seconds": round(generate_seconds, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def run_single(args) -> dict:
+    """在当前进程中运行一个规模"""
+    from fake_client import ChannelSpec
+
+    spec = ChannelSpec(
+        size=args.single,
+        seed=args.seed,
+        media_group_density=args.media_group_density,
+        reply_density=args.reply_density,
+        deleted_density=args.deleted_density,
+        flood_wait_rate=args.flood_wait_rate,
+        flood_wait_seconds=args.flood_wait_seconds,
+        latency=args.latency,
+    )
+    if args.metrics_dir:
+        from src.metrics import metrics
+        metrics.configure(
+            True,
+            args.metrics_dir / f"report-{args.single}.json",
+            args.metrics_dir / f"metrics-{args.single}.prom"
+        )
+    with tempfile.TemporaryDirectory(prefix="gbdata-bench-") as tmp:
+        profile_dir = args.profile / str(args.single) if args.profile else None
+        result = asyncio.run(run_export(spec, Path(tmp), args.concurrency, profile_dir))
+    result["spec"] = asdict(spec)
+    if args.metrics_dir:
+        metrics.flush({"result": result})
+    return result
+
+
+def run_isolated(size: int, args) -> dict:
+    """在子进程中运行一个规模，避免峰值内存相互影响"""
+    command = [
+        sys.executable, __file__, "--single", str(size), "--seed", str(args.seed),
+        "--concurrency", str(args.concurrency),
+        "--media-group-density", str(args.media_group_density),
+        "--reply-density", str(args.reply_density),
+        "--deleted-density", str(args.deleted_density),
+        "--flood-wait-rate", str(args.flood_wait_rate),
+        "--flood-wait-seconds", str(args.flood_wait_seconds),
+        "--latency", str(args.latency),
+    ]
+    if args.metrics_dir:
+        command += ["--metrics-dir", str(args.metrics_dir)]
+    if args.profile:
+        command += ["--profile", str(args.profile)]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stdout + completed.stderr)
+        raise RuntimeError(f"规模 {size} 的基准测试失败")
+    # 子进程把处理过程的日志也打印到 stdout，结果在最后一行
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def compare(results: list, baseline_path: Path, tolerance: float) -> bool:
+    """
+    与基准结果对比
+
+    :return: 没有超出容差的性能回退时返回 True
+    """
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {item["size"]: item for item in json.load(f)["results"]}
+
+    ok = True
+    for result in results:
+        base = baseline.get(result["size"])
+        if not base:
+            continue
+        checks = [
+            ("消息/秒", result["msgs_per_second"], base["msgs_per_second"], True),
+            ("生成耗时", result["generate_seconds"], base["generate_seconds"], False),
+            ("峰值内存", result["peak_rss_mb"], base["peak_rss_mb"], False),
+        ]
+        for name, current, previous, higher_is_better in checks:
+            if not previous:
+                continue
+            change = (current - previous) / previous
+            regressed = change < -tolerance if higher_is_better else change > tolerance
+            if regressed:
+                ok = False
+                print(f"⚠️  {result['size']:,} 条: {name} 回退 {change:+.1%} ({previous} → {current})")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端离线基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="频道规模（消息ID数）")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--concurrency", type=int, default=3)
+    parser.add_argument("--media-group-density", type=float, default=0.05)
+    parser.add_argument("--reply-density", type=float, default=0.1)
+    parser.add_argument("--deleted-density", type=float, default=0.05)
+    parser.add_argument("--flood-wait-rate", type=float, default=0.0, help="每次请求触发 FloodWait 的概率")
+    parser.add_argument("--flood-wait-seconds", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="每次请求的模拟网络延迟（秒）")
+    parser.add_argument("--save", type=Path, help="把结果保存为 JSON（可作为之后的基准）")
+    parser.add_argument("--baseline", type=Path, help="与之前保存的结果对比")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="允许的性能回退比例")
+    parser.add_argument("--metrics-dir", type=Path, help="启用运行指标，把每个规模的 JSON 报告和 Prometheus 文件写到这个目录")
+    parser.add_argument("--profile", type=Path, help="剖析每个规模的运行，结果写到这个目录下以规模命名的子目录")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_single(args)))
+        return
+
+    results = []
+    print(f"{'规模':>10}{'帖子':>10}{'请求':>8}{'消息/秒':>12}{'处理(s)':>10}{'生成(s)':>10}{'峰值内存(MB)':>14}")
+    for size in args.sizes:
+        result = run_isolated(size, args)
+        results.append(result)
+        print(f"{size:>10,}{result['posts']:>10,}{result['requests']:>8,}{result['msgs_per_second']:>12,.0f}"
+              f"{result['process_seconds']:>10.2f}{result['generate_seconds']:>10.2f}{result['peak_rss_mb']:>14.1f}")
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({"python": sys.version.split()[0], "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.save}")
+
+    if args.baseline and not compare(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
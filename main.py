@@ -3,107 +3,171 @@
 Telegram 备份工具 - 使用永久链接
 """
 
+import argparse
 import asyncio
+import logging
 import sys
 from pathlib import Path
 
-# 添加src目录到Python路径
-sys.path.insert(0, str(Path(__file__).parent / "src"))
+# 添加项目根目录到Python路径（src 中的模块使用包内相对导入）
+sys.path.insert(0, str(Path(__file__).parent))
 
-from config import load_config, validate_config
-from telegram_client import TelegramClientManager
-from media_processor import MediaProcessor
-from message_processor import MessageProcessor
-from blog_generator import BlogGenerator
+from src.config import load_config, validate_config
+from src.executor import CPUExecutor
+from src.metrics import metrics
+from src.profiler import profiler
+from src.telegram_client import TelegramClientManager
+from src.orchestrator import ExportOrchestrator
+from src.utils import setup_logging
 
+logger = logging.getLogger("main")
 
-async def main():
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Telegram 备份工具 - 使用永久链接")
+    parser.add_argument("--watch", action="store_true", help="导出完成后持续监听频道更新并增量发布")
+    parser.add_argument("--reconcile", action="store_true",
+                        help="重新检查最近 reconcile_days 天内的帖子，同步编辑、浏览数和删除")
+    parser.add_argument("--serve", action="store_true",
+                        help="导出完成后启动永久链接解析服务（[resolver] 配置监听地址和缓存）")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="日志级别，覆盖配置文件中的 metrics.log_level")
+    parser.add_argument("--profile", nargs="?", const="profile", metavar="DIR",
+                        help="剖析本次运行，把各阶段的折叠栈、cProfile 结果和事件循环时间线写到 DIR（默认 ./profile）")
+    return parser.parse_args()
+
+
+async def main(args: argparse.Namespace):
     """主函数"""
-    print("=== Telegram 备份工具 - 永久链接版本 ===\n")
-    
+    setup_logging(args.log_level or "INFO")
+    logger.info("=== Telegram 备份工具 - 永久链接版本 ===")
+    if args.profile:
+        profiler.start(Path(args.profile))
+
+    executor = None
+    client_manager = None
     try:
         # 加载配置
-        print("加载配置文件...")
+        logger.info("加载配置文件...")
         config = load_config()
-        
+
         # 验证配置
         if not validate_config(config):
-            print("配置验证失败，请检查配置文件")
+            logger.error("配置验证失败，请检查配置文件")
             return
-        
-        print("配置加载成功")
-        
-        # 初始化组件
-        print("\n初始化 Telegram 客户端...")
+
+        setup_logging(args.log_level or config.metrics.log_level)
+        metrics.configure(config.metrics.enabled, config.metrics.report_file, config.metrics.prometheus_file)
+        logger.info(f"配置加载成功，共 {len(config.jobs)} 个导出任务")
+
+        # 进程池的子进程在连接 Telegram 的同时启动
+        executor = CPUExecutor(config.scheduler.workers)
+
+        # 初始化组件（所有频道共享一次登录）
+        logger.info("初始化 Telegram 客户端...")
         client_manager = TelegramClientManager(config.telegram)
-        client = await client_manager.initialize()
-        
-        # 测试频道访问
-        print(f"\n测试频道访问...")
-        if not await client_manager.test_channel_access(config.export.source_channel):
-            print("无法访问目标频道，请检查频道ID和权限")
-            await client_manager.disconnect()
+        await client_manager.initialize(updates=args.watch)
+
+        # 测试频道访问，无法访问的频道跳过
+        logger.info("测试频道访问...")
+        jobs = []
+        for job in config.jobs:
+            # 解析频道和获取频道信息共用一次 get_chat，有效期内直接使用磁盘缓存
+            channel_info = await client_manager.open_channel(job.source_channel)
+            if channel_info is None:
+                logger.warning(f"无法访问频道 {job.label}，请检查频道ID和权限，跳过该任务")
+                continue
+            logger.info(f"频道信息: {channel_info['title']} (@{channel_info.get('username') or 'N/A'})")
+            jobs.append(job)
+
+        # 每个会话只处理它能访问的频道，一个频道都无法访问的会话不再占用连接
+        await client_manager.close_unused()
+
+        if not jobs:
+            logger.error("没有可以访问的频道")
             return
-        
-        # 获取频道信息
-        channel_info = await client_manager.get_channel_info(config.export.source_channel)
-        if channel_info:
-            print(f"频道信息: {channel_info['title']} (@{channel_info.get('username', 'N/A')})")
-        
-        # 初始化处理器
-        media_processor = MediaProcessor(config.export.domain_prefix)
-        message_processor = MessageProcessor(client, media_processor)
-        blog_generator = BlogGenerator(config.export.output_path, config.rss)
-        
-        print(f"\n开始处理消息...")
-        print(f"消息范围: {config.export.start_id} - {config.export.end_id}")
-        print(f"批处理大小: {config.export.batch_size}")
-        print(f"输出路径: {config.export.output_path}")
-        print(f"域名前缀: {config.export.domain_prefix}")
-        
-        # 处理消息
-        messages = await message_processor.process_messages(
-            channel_id=config.export.source_channel,
-            start_id=config.export.start_id,
-            end_id=config.export.end_id,
-            batch_size=config.export.batch_size,
-            output_path=config.export.output_path
+
+        # 所有任务共享客户端池，也就共享每个会话的限速预算
+        client_pool = client_manager.create_pool(config.export.rate_limit, config.export.rate_burst)
+        orchestrator = ExportOrchestrator(
+            client_pool,
+            jobs,
+            config.rss,
+            parallel_jobs=config.scheduler.parallel_jobs,
+            progress_interval=config.scheduler.progress_interval,
+            reconcile=args.reconcile,
+            executor=executor
         )
-        
-        # 生成输出文件
-        print(f"\n生成输出文件...")
-        blog_generator.generate_all(messages)
-        
-        print(f"\n✅ 任务完成!")
-        print(f"📁 输出目录: {config.export.output_path}")
-        print(f"📊 处理消息数: {len(messages)}")
-        
-        # 列出生成的文件
-        output_path = Path(config.export.output_path)
-        generated_files = []
-        for file_name in ["posts.json", "index.html", "rss.xml", "atom.xml"]:
-            file_path = output_path / file_name
-            if file_path.exists():
-                size = file_path.stat().st_size
-                generated_files.append(f"  📄 {file_name} ({size} bytes)")
-        
-        if generated_files:
-            print("\n生成的文件:")
-            print("\n".join(generated_files))
-        
-        # 断开连接
-        await client_manager.disconnect()
-        
+
+        logger.info("开始处理消息...")
+        logger.info(f"频道数: {len(jobs)}, 同时导出: {config.scheduler.parallel_jobs}")
+        logger.info(f"会话数: {len(client_pool)}, 限速: {config.export.rate_limit} 请求/秒/会话")
+        for job in jobs:
+            logger.info(f"  [{job.label}] 消息范围: {job.start_id} - {job.end_id}, 输出路径: {job.output_path}")
+
+        # 处理消息并生成输出文件（读取完整归档，而不只是本次新增的消息）
+        results = await orchestrator.run()
+
+        for member in client_pool.stats():
+            logger.info(f"会话 {member['name']}: {member['requests']} 次请求, {member['flood_waits']} 次 FloodWait")
+
+        logger.info("✅ 任务完成!")
+        for label, result in results.items():
+            if result["status"] != "done":
+                logger.error(f"❌ [{label}] 失败: {result.get('error')}")
+                continue
+
+            logger.info(f"📁 [{label}] 输出目录: {result['output_path']}")
+            logger.info(f"📊 本次写入帖子数: {result['written']}，归档帖子总数: {result['total']}，耗时 {result['seconds']} 秒")
+            if "reconcile" in result:
+                reconcile = result["reconcile"]
+                logger.info(f"🔁 对账: 检查 {reconcile['checked']} 条，更新 {reconcile['changed']} 条，删除 {reconcile['deleted']} 条")
+
+            # 列出本次实际改动的文件，内容没有变化的文件不会被重写
+            output_path = Path(result['output_path'])
+            if not result['files']:
+                logger.info("  输出文件没有变化")
+            for file_name in result['files']:
+                size = (output_path / file_name).stat().st_size
+                logger.info(f"  📄 {file_name} ({size} bytes)")
+
+        # 运行报告附带各任务结果和会话统计（未启用指标时不写）
+        metrics.flush({"jobs": results, "sessions": client_pool.stats()})
+
+        # 监听模式和解析服务：先完成上面的补齐导出，再持续运行直到中断
+        # 只在需要时导入监听和解析服务
+        services = []
+        if args.watch:
+            from src.watcher import ChannelWatcher
+            services.append(ChannelWatcher(client_manager.client, client_pool, jobs, config.rss, config.watch, executor).run())
+        if args.serve:
+            from src.resolver import MediaResolver
+            services.append(MediaResolver(client_pool, jobs, config.resolver).serve())
+        if services:
+            try:
+                await asyncio.gather(*services)
+            except asyncio.CancelledError:
+                logger.info("停止监听")
+
     except KeyboardInterrupt:
-        print("\n❌ 用户中断了程序")
+        logger.warning("❌ 用户中断了程序")
     except Exception as e:
-        print(f"\n❌ 发生错误: {e}")
-        import traceback
-        traceback.print_exc()
-    
-    print("\n程序结束")
+        logger.exception(f"❌ 发生错误: {e}")
+    finally:
+        # 无论成功、出错还是中断，都断开连接并关闭进程池
+        if client_manager is not None:
+            try:
+                await client_manager.disconnect()
+            except Exception as e:
+                logger.warning(f"断开连接时出错: {e}")
+        if executor is not None:
+            executor.shutdown()
+
+    if args.profile:
+        logger.info(f"剖析结果已写入 {profiler.stop()}（summary.txt 为汇总）")
+    logger.info("程序结束")
 
 
 if __name__ == "__main__":
     # 运行主程序
-    asyncio.run(main())
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,453 @@
+import json
+import logging
+from dataclasses import asdict
+from datetime import timezone
+from itertools import chain, repeat
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Dict, Any, Iterable, Optional, Tuple
+from .config import RSSConfig
+from .executor import CPUExecutor
+from .metrics import metrics
+from .post_store import PostStore
+from .packed_archive import write_packed_archive
+from .search_index import SearchIndexBuilder
+from .utils import AtomicWriter, content_digest, load_json, save_json, write_if_changed
+
+if TYPE_CHECKING:
+    from feedgen.feed import FeedGenerator
+
+logger = logging.getLogger(__name__)
+
+
+def render_shards(
+    db_path: str,
+    output_dir: str,
+    shards: List[Tuple[str, int, Optional[int], Optional[str]]]
+) -> List[Tuple[int, int, int, str, bool]]:
+    """
+    读取并写出一组帖子分片（只使用普通参数，可以在子进程中执行）
+
+    :param db_path: 帖子存储路径
+    :param output_dir: 输出目录
+    :param shards: [(文件名, 第一个帖子ID, 下一个分片的第一个ID（最后一个分片为 None）, 上次的内容哈希)]
+    :return: 每个分片的 (帖子数, 第一个ID, 最后一个ID, 内容哈希, 是否重写)
+    """
+    post_store = PostStore(Path(db_path), readonly=True)
+    try:
+        results = []
+        for file_name, first_id, end_id, previous_hash in shards:
+            posts = post_store.posts_between(first_id, end_id)
+            data = json.dumps(posts, ensure_ascii=False, separators=(',', ':'))
+            digest, written = write_if_changed(Path(output_dir) / file_name, data, previous_hash)
+            last_id = posts[-1]['id'] if posts else first_id
+            results.append((len(posts), first_id, last_id, digest, written))
+        return results
+    finally:
+        post_store.close()
+
+
+def render_feed_html(posts: List[Dict[str, Any]]) -> List[str]:
+    """
+    将一组帖子渲染为订阅源使用的 HTML（只使用普通参数，可以在子进程中执行）
+
+    :param posts: 帖子列表
+    :return: 与 posts 顺序相同的 HTML
+    """
+    import markdown
+
+    # 构建解析器的开销和转换本身相当，整组帖子共用一个实例，每次转换前 reset
+    md = markdown.Markdown()
+    rendered = []
+    for msg in posts:
+        parts = []
+        if msg.get('text'):
+            parts.append(md.reset().convert(msg['text']))
+
+        media_list = msg.get('images') or msg.get('files') or ([msg['media']] if msg.get('media') else [])
+        for media in media_list:
+            if media.get('media_type') == 'photo':
+                parts.append(f'<img src="{media["permanent_url"]}" />')
+            else:
+                name = media.get('original_name') or media.get('permanent_id')
+                parts.append(f'<p><a href="{media["permanent_url"]}">{name}</a></p>')
+
+        rendered.append("\n".join(parts))
+    return rendered
+
+
+class BlogGenerator:
+    MANIFEST_FILE = "posts-manifest.json"
+    # 年度归档订阅源所在的子目录
+    FEEDS_DIR = "feeds"
+    # 每个渲染任务包含的分片数
+    SHARDS_PER_TASK = 16
+    # 每个 HTML 渲染任务包含的帖子数
+    POSTS_PER_RENDER_TASK = 200
+
+    def __init__(
+        self,
+        output_path: str,
+        rss_config: Optional[RSSConfig] = None,
+        shard_size: int = 100,
+        full_posts_json: bool = True,
+        search_index: bool = True,
+        packed_archive: bool = False,
+        executor: Optional[CPUExecutor] = None
+    ):
+        """
+        初始化博客生成器
+
+        :param output_path: 输出路径
+        :param rss_config: RSS 配置（可选）
+        :param shard_size: 每个帖子分片包含的帖子数
+        :param full_posts_json: 是否同时写出完整的 posts.json
+        :param search_index: 是否生成客户端搜索索引
+        :param packed_archive: 是否同时写出紧凑的二进制归档 posts.bin
+        :param executor: 渲染分片使用的执行层，为空时在当前线程中渲染
+        """
+        self.output_dir = Path(output_path)
+        self.rss_config = rss_config
+        self.shard_size = shard_size
+        self.full_posts_json = full_posts_json
+        self.search_index = search_index
+        self.packed_archive = packed_archive
+        self.executor = executor or CPUExecutor()
+        self.template_path = Path(__file__).parent.parent / "templates" / "tg-blog.html"
+        # 本次生成实际改动的文件（相对输出目录）
+        self.written: List[str] = []
+
+    def generate_all(self, post_store: PostStore, full: bool = True):
+        """
+        根据帖子存储生成全部输出文件
+
+        每个产物在清单中记录输入的摘要和输出的内容哈希：输入未变的产物直接跳过，
+        重新生成后内容相同的文件也不会被替换，静态托管和 CDN 只会看到真正变化的文件。
+
+        :param post_store: 帖子存储
+        :param full: 为 False 时只更新分片和订阅源，跳过需要读取完整归档的搜索索引、posts.json 和 posts.bin
+                     （监听模式下用于快速发布，之后再做一次完整生成）
+        """
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.generate_html()
+
+        manifest = self._load_manifest()
+        store_rev = post_store.current_rev()
+        total = post_store.count()
+        if not manifest or manifest.get('store_rev') != store_rev or manifest.get('total') != total:
+            with metrics.timer("artifact_seconds", artifact="shards"):
+                manifest = self.generate_shards(post_store, manifest, store_rev, total)
+
+        artifacts = manifest.setdefault('artifacts', {})
+        # 旧版本的清单只记录修订号，视为需要重新生成
+        for name, entry in list(artifacts.items()):
+            if not isinstance(entry, dict):
+                artifacts[name] = {}
+
+        # 产物名称 → 输入摘要；订阅源只依赖最新帖子的内容哈希和 RSS 配置，旧帖子变化不影响它
+        inputs = {}
+        if self.rss_config:
+            rss_key = content_digest(json.dumps(asdict(self.rss_config), sort_keys=True))
+            latest = post_store.latest_post_hashes(self.rss_config.entries)
+            inputs['feeds'] = content_digest(json.dumps([latest, rss_key]))
+            # 年度归档要读取整年的帖子，和搜索索引一样只在完整生成时更新
+            if full and self.rss_config.yearly_archives:
+                for year, (rev, count) in post_store.year_summaries().items():
+                    inputs[f'feeds-{year}'] = f"{rss_key}:{rev}:{count}"
+        if full and self.search_index:
+            inputs['search'] = store_rev
+        if full and self.full_posts_json:
+            inputs['posts_json'] = store_rev
+        if full and self.packed_archive:
+            inputs['packed'] = store_rev
+
+        # 年份已没有帖子（或关闭了年度归档）时删除对应的归档订阅源
+        stale = [name for name in artifacts if full and name.startswith('feeds-') and name not in inputs]
+        for name in stale:
+            year = name[len('feeds-'):]
+            for file_name in (f"rss-{year}.xml", f"atom-{year}.xml"):
+                (self.output_dir / self.FEEDS_DIR / file_name).unlink(missing_ok=True)
+            del artifacts[name]
+
+        pending = [name for name, key in inputs.items() if artifacts.get(name, {}).get('input') != key]
+        if not pending and not stale:
+            logger.info("帖子没有变化，跳过订阅源和索引生成")
+            return
+
+        for name in pending:
+            with metrics.timer("artifact_seconds", artifact=self._artifact_kind(name)):
+                output_hash = self._generate_artifact(name, post_store, store_rev, artifacts.get(name, {}))
+            artifacts[name] = {"input": inputs[name], "hash": output_hash}
+        save_json(self.output_dir / self.MANIFEST_FILE, manifest)
+
+    def _generate_artifact(
+        self,
+        name: str,
+        post_store: PostStore,
+        store_rev: int,
+        previous: Dict[str, Any]
+    ) -> str:
+        """
+        重新生成单个产物
+
+        :param name: 产物名称（feeds、feeds-YYYY、search、packed、posts_json）
+        :param post_store: 帖子存储
+        :param store_rev: 帖子存储当前的修订号
+        :param previous: 该产物上次的清单记录
+        :return: 输出的内容哈希
+        """
+        if name == 'feeds':
+            posts = post_store.latest_posts(self.rss_config.entries)
+            return self.generate_feeds(post_store, posts)
+        if name.startswith('feeds-'):
+            year = name[len('feeds-'):]
+            return self.generate_feeds(
+                post_store,
+                post_store.posts_in_year(year),
+                f"{self.FEEDS_DIR}/rss-{year}.xml",
+                f"{self.FEEDS_DIR}/atom-{year}.xml",
+                year
+            )
+        if name == 'search':
+            builder = SearchIndexBuilder(self.output_dir / "search")
+            buckets = builder.build(post_store.iter_posts(), store_rev)
+            self._mark_written(*(f"search/{file_name}" for file_name in builder.written))
+            logger.info(f"已生成搜索索引（{buckets} 个桶，重写 {len(builder.written)} 个）")
+            return content_digest("".join(builder.hashes))
+        if name == 'packed':
+            output_hash, written = write_packed_archive(
+                post_store.iter_posts(), self.output_dir / "posts.bin", previous.get('hash')
+            )
+            if written:
+                self._mark_written("posts.bin")
+            return output_hash
+        return self.generate_json(post_store.iter_posts(), previous.get('hash'))
+
+    def _mark_written(self, *file_names: str):
+        """记录本次实际改动的文件，并按产物类别统计写出的字节数"""
+        self.written.extend(file_names)
+        if metrics.enabled:
+            for file_name in file_names:
+                size = (self.output_dir / file_name).stat().st_size
+                metrics.inc("bytes_written", size, artifact=self._artifact_kind(file_name))
+                metrics.inc("files_written", artifact=self._artifact_kind(file_name))
+
+    @classmethod
+    def _artifact_kind(cls, name: str) -> str:
+        """文件名或产物名称 → 指标中使用的产物类别"""
+        if name.startswith("posts-") and name != cls.MANIFEST_FILE:
+            return "shards"
+        if name.startswith("search"):
+            return "search"
+        if name.startswith((f"{cls.FEEDS_DIR}/", "feeds-")):
+            return "feeds-yearly"
+        if name in ("feeds", "rss.xml", "atom.xml"):
+            return "feeds"
+        if name in ("packed", "posts.bin"):
+            return "packed"
+        if name in ("posts_json", "posts.json"):
+            return "posts_json"
+        return name
+
+    def generate_shards(
+        self,
+        post_store: PostStore,
+        manifest: Optional[Dict[str, Any]],
+        store_rev: int,
+        total: int
+    ) -> Dict[str, Any]:
+        """
+        按固定大小写出帖子分片和清单
+
+        已写满、且不包含变化帖子的分片保持不动，只重写第一个受影响的分片及其之后的分片；
+        新帖子追加在末尾时通常只需要重写最后一个分片。
+        """
+        kept = []
+        if manifest and manifest.get('shard_size') == self.shard_size:
+            dirty_from = post_store.min_id_changed_since(manifest['store_rev'])
+            for shard in manifest['shards']:
+                if shard['count'] != self.shard_size or (dirty_from is not None and shard['last_id'] >= dirty_from):
+                    break
+                kept.append(shard)
+            # 有帖子被删除时无法确定哪些分片仍然有效，全部重写
+            if sum(shard['count'] for shard in kept) > total:
+                kept = []
+
+        shards = list(kept)
+        previous_shards = manifest['shards'] if manifest and manifest.get('shard_size') == self.shard_size else []
+        from_id = kept[-1]['last_id'] + 1 if kept else None
+
+        # 这里只按ID划分分片，分片内容由 render_shards 读取和写出；配置了进程池时多组分片并行渲染，结果按顺序返回
+        starts = post_store.ids_every(self.shard_size, from_id)
+        tasks, previous_entries = [], []
+        for i, first_id in enumerate(starts):
+            index = len(kept) + i + 1
+            previous = previous_shards[index - 1] if index <= len(previous_shards) else {}
+            end_id = starts[i + 1] if i + 1 < len(starts) else None
+            tasks.append((f"posts-{index:04d}.json", first_id, end_id, previous.get('hash')))
+            previous_entries.append(previous)
+        groups = [tasks[i:i + self.SHARDS_PER_TASK] for i in range(0, len(tasks), self.SHARDS_PER_TASK)]
+        results = self.executor.map(render_shards, repeat(str(post_store.path)), repeat(str(self.output_dir)), groups)
+        for task, previous, result in zip(tasks, previous_entries, chain.from_iterable(results)):
+            shards.append(self._shard_entry(task[0], result, store_rev, previous))
+
+        # 删除多余的旧分片
+        if manifest:
+            for shard in manifest['shards'][len(shards):]:
+                (self.output_dir / shard['file']).unlink(missing_ok=True)
+
+        new_manifest = {
+            "version": 1,
+            "shard_size": self.shard_size,
+            "total": total,
+            "store_rev": store_rev,
+            "shards": shards,
+            "artifacts": manifest.get('artifacts', {}) if manifest else {},
+        }
+        save_json(self.output_dir / self.MANIFEST_FILE, new_manifest)
+        rewritten = sum(1 for name in self.written if name.startswith("posts-"))
+        logger.info(f"已写出 {rewritten} 个分片（保留 {len(shards) - rewritten} 个未变化的分片）")
+        return new_manifest
+
+    def generate_json(self, posts: Iterable[Dict[str, Any]], previous_hash: Optional[str] = None) -> str:
+        """
+        流式写出完整的 posts.json
+
+        :param posts: 按ID升序排列的帖子
+        :param previous_hash: 上次写出时的内容哈希，内容相同时保留原文件
+        :return: 内容哈希
+        """
+        with AtomicWriter(self.output_dir / "posts.json", previous_hash) as f:
+            f.write("[")
+            for i, post in enumerate(posts):
+                f.write(("," if i else "") + "\n  " + json.dumps(post, ensure_ascii=False))
+            f.write("\n]\n")
+            digest, written = f.commit()
+        if written:
+            self._mark_written("posts.json")
+        return digest
+
+    def generate_html(self):
+        """写出 index.html（页面按需加载分片，模板不变时不重写）"""
+        html = self.template_path.read_text(encoding='utf-8')
+        if write_if_changed(self.output_dir / "index.html", html)[1]:
+            self._mark_written("index.html")
+
+    def _shard_entry(
+        self,
+        file_name: str,
+        result: Tuple[int, int, int, str, bool],
+        store_rev: int,
+        previous: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """
+        根据 render_shards 的结果生成分片的清单条目
+
+        内容与上次相同时保留原条目（包括修订号），浏览器缓存的分片仍然有效。
+        """
+        count, first_id, last_id, digest, written = result
+        if not written and previous.get('hash') == digest:
+            return previous
+        if written:
+            self._mark_written(file_name)
+        return {
+            "file": file_name,
+            "count": count,
+            "first_id": first_id,
+            "last_id": last_id,
+            "rev": store_rev,
+            "hash": digest,
+        }
+
+    def _load_manifest(self) -> Optional[Dict[str, Any]]:
+        """读取上次生成的分片清单"""
+        try:
+            return load_json(self.output_dir / self.MANIFEST_FILE)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def generate_feeds(
+        self,
+        post_store: PostStore,
+        posts: List[Dict[str, Any]],
+        rss_file: str = "rss.xml",
+        atom_file: str = "atom.xml",
+        year: Optional[str] = None
+    ) -> str:
+        """
+        生成一对 RSS / Atom 订阅源
+
+        条目内容使用按帖子ID缓存的 HTML，只有新帖子和内容变化的帖子需要重新渲染。
+
+        :param post_store: 帖子存储（用于读写 HTML 缓存）
+        :param posts: 按ID升序排列的帖子
+        :param rss_file: RSS 文件路径（相对输出目录）
+        :param atom_file: Atom 文件路径（相对输出目录）
+        :param year: 年度归档的年份，为空时生成主订阅源
+        :return: 两个文件合并的内容哈希
+        """
+        # feedgen（连带 lxml）只在真正生成订阅源时导入，不拖慢程序启动
+        from feedgen.feed import FeedGenerator
+
+        rss = self.rss_config
+        fg = FeedGenerator()
+        fg.id(f"{rss.link.rstrip('/')}/{atom_file}" if year else rss.link)
+        fg.title(f"{rss.title} ({year})" if year else rss.title)
+        fg.link(href=rss.link, rel='alternate')
+        fg.description(rss.description)
+        fg.language(rss.language)
+        if rss.image_url:
+            fg.logo(rss.image_url)
+
+        rendered = self._rendered_html(post_store, posts)
+        # feedgen 会把新加入的条目放在最前面，因此按从旧到新的顺序添加
+        for msg in posts:
+            self._add_feed_entry(fg, msg, rendered[msg['id']])
+
+        # 更新时间取最新帖子的时间而不是当前时间，帖子不变时输出逐字节相同
+        entries = fg.entry()
+        if entries:
+            fg.updated(entries[0].updated())
+
+        digests = []
+        for file_name, content in ((rss_file, fg.rss_str(pretty=True)), (atom_file, fg.atom_str(pretty=True))):
+            (self.output_dir / file_name).parent.mkdir(parents=True, exist_ok=True)
+            digest, written = write_if_changed(self.output_dir / file_name, content)
+            digests.append(digest)
+            if written:
+                self._mark_written(file_name)
+        return content_digest("".join(digests))
+
+    def _rendered_html(self, post_store: PostStore, posts: List[Dict[str, Any]]) -> Dict[int, str]:
+        """帖子ID → 订阅条目 HTML，缓存未命中的帖子渲染后写回缓存"""
+        rendered = post_store.rendered_html([msg['id'] for msg in posts])
+        todo = [msg for msg in posts if msg['id'] not in rendered]
+        # 未命中的帖子分组渲染（配置了进程池时并行），结果按顺序对应回帖子
+        size = self.POSTS_PER_RENDER_TASK
+        groups = [todo[i:i + size] for i in range(0, len(todo), size)]
+        html = chain.from_iterable(self.executor.map(render_feed_html, groups))
+        missing = {msg['id']: item for msg, item in zip(todo, html)}
+        metrics.inc("html_cache_hits", len(posts) - len(missing))
+        metrics.inc("html_cache_misses", len(missing))
+        if missing:
+            post_store.save_rendered_html(missing)
+            rendered.update(missing)
+        return rendered
+
+    def _add_feed_entry(self, fg: "FeedGenerator", msg: Dict[str, Any], html: str):
+        """添加单个订阅条目"""
+        link = f"{self.rss_config.link.rstrip('/')}#{msg['id']}"
+        text = msg.get('text') or ""
+        title = text.strip().splitlines()[0][:50] if text.strip() else f"#{msg['id']}"
+
+        fe = fg.add_entry()
+        fe.id(link)
+        fe.title(title)
+        fe.link(href=link)
+        fe.content(html, type='CDATA')
+        if msg.get('date'):
+            from dateutil import parser as date_parser
+            published = date_parser.isoparse(msg['date'])
+            if published.tzinfo is None:
+                published = published.replace(tzinfo=timezone.utc)
+            fe.published(published)
+            fe.updated(published)
@@ -0,0 +1,227 @@
+import logging
+import os
+import json
+import struct
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Set, Tuple
+from .utils import load_json
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointStore:
+    """
+    已处理消息ID的追加式检查点
+
+    文件格式: 8 字节文件头 + 若干 (start, end) 闭区间记录，每条 16 字节。
+    每个批次只追加该批次折叠后的区间，内存中维护合并后的有序区间表；
+    日志中的冗余记录过多时整体压缩重写（临时文件 + 原子替换）。
+    末尾不完整的记录（写入中途崩溃）在加载时丢弃。
+    """
+
+    MAGIC = b"TGCKPT01"
+    RECORD = struct.Struct("<qq")
+    # 日志记录数超过 max(COMPACT_MIN_RECORDS, 区间数 * COMPACT_RATIO) 时压缩
+    COMPACT_MIN_RECORDS = 4096
+    COMPACT_RATIO = 2
+
+    def __init__(
+        self,
+        path: Path,
+        legacy_json: Optional[Path] = None,
+        fsync: bool = True,
+        stored: Optional[Callable[[List[int]], Set[int]]] = None
+    ):
+        """
+        打开检查点文件，必要时从旧的 JSON 文件迁移
+
+        旧版只把帖子写进 posts.json，帖子存储中没有这些帖子。迁移时只记录已经在帖子存储中的ID，
+        其余ID列在 backfill 中由调用方重新获取；旧文件保留到这些ID都记入检查点为止。
+
+        :param path: 检查点文件路径
+        :param legacy_json: 旧版 processed_ids.json 路径
+        :param fsync: 每次追加后是否 fsync
+        :param stored: 返回给定ID中已写入帖子存储的ID，为空时信任旧文件中的全部ID
+        """
+        self.path = Path(path)
+        self.fsync = fsync
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+        self._log_records = 0
+        self._file = None
+        # 旧版记录过、但还没有补进帖子存储的消息ID（升序）
+        self.backfill: List[int] = []
+
+        legacy_json = Path(legacy_json) if legacy_json is not None else None
+        if not self.path.exists() and legacy_json is not None and legacy_json.exists():
+            self._migrate_legacy(legacy_json, stored)
+        else:
+            self._load()
+
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(self.MAGIC)
+            self._sync()
+
+        if legacy_json is not None and legacy_json.exists():
+            self._load_backfill(legacy_json)
+
+    def __contains__(self, message_id: int) -> bool:
+        i = bisect_right(self._starts, message_id) - 1
+        return i >= 0 and self._ends[i] >= message_id
+
+    def __len__(self) -> int:
+        return sum(end - start + 1 for start, end in zip(self._starts, self._ends))
+
+    def __enter__(self) -> "CheckpointStore":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def ranges(self) -> List[Tuple[int, int]]:
+        """合并后的已处理区间"""
+        return list(zip(self._starts, self._ends))
+
+    @property
+    def max_id(self) -> Optional[int]:
+        """已处理的最大消息ID"""
+        return self._ends[-1] if self._ends else None
+
+    def next_unprocessed(self, message_id: int) -> int:
+        """
+        返回不小于 message_id 的第一个未处理ID，跳过整段已处理区间
+
+        :param message_id: 起始消息ID
+        :return: 未处理的消息ID
+        """
+        i = bisect_right(self._starts, message_id) - 1
+        if i >= 0 and self._ends[i] >= message_id:
+            return self._ends[i] + 1
+        return message_id
+
+    def add_many(self, ids: Iterable[int]):
+        """
+        记录一批已处理的消息ID，只追加本批次的区间
+
+        :param ids: 消息ID
+        """
+        ranges = self._collapse(ids)
+        if not ranges:
+            return
+
+        self._file.write(b"".join(self.RECORD.pack(start, end) for start, end in ranges))
+        self._sync()
+        self._log_records += len(ranges)
+
+        for start, end in ranges:
+            self._insert_range(start, end)
+
+        if self._log_records > max(self.COMPACT_MIN_RECORDS, len(self._starts) * self.COMPACT_RATIO):
+            self.compact()
+
+    def compact(self):
+        """将日志重写为合并后的区间表"""
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(self.MAGIC)
+            f.write(b"".join(self.RECORD.pack(s, e) for s, e in zip(self._starts, self._ends)))
+            f.flush()
+            os.fsync(f.fileno())
+
+        if self._file:
+            self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, 'ab')
+        self._log_records = len(self._starts)
+
+    def close(self):
+        """关闭检查点文件"""
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _load(self):
+        """读取检查点日志"""
+        try:
+            data = self.path.read_bytes()
+        except FileNotFoundError:
+            return
+
+        if not data.startswith(self.MAGIC):
+            raise ValueError(f"无效的检查点文件: {self.path}")
+
+        body = memoryview(data)[len(self.MAGIC):]
+        usable = len(body) - len(body) % self.RECORD.size
+        if usable != len(body):
+            # 丢弃崩溃时写了一半的记录
+            with open(self.path, 'r+b') as f:
+                f.truncate(len(self.MAGIC) + usable)
+
+        records = sorted(self.RECORD.iter_unpack(body[:usable]))
+        self._log_records = len(records)
+        for start, end in records:
+            if self._ends and start <= self._ends[-1] + 1:
+                if end > self._ends[-1]:
+                    self._ends[-1] = end
+            else:
+                self._starts.append(start)
+                self._ends.append(end)
+
+    def _migrate_legacy(self, legacy_json: Path, stored: Optional[Callable[[List[int]], Set[int]]]):
+        """从旧版 processed_ids.json 一次性迁移，只记录已写入帖子存储的ID"""
+        ids = self._read_legacy(legacy_json)
+        kept = ids if stored is None else sorted(stored(ids))
+        for start, end in self._collapse(kept):
+            self._starts.append(start)
+            self._ends.append(end)
+
+        self.compact()
+        logger.info(f"已从 {legacy_json.name} 迁移 {len(self)} 条处理记录")
+
+    def _load_backfill(self, legacy_json: Path):
+        """列出旧版记录中还没有记入检查点的ID，全部补回后把旧文件改名"""
+        self.backfill = [message_id for message_id in self._read_legacy(legacy_json) if message_id not in self]
+        if self.backfill:
+            logger.info(f"{legacy_json.name} 中还有 {len(self.backfill)} 条消息不在帖子存储中，需要重新获取")
+            return
+        legacy_json.rename(legacy_json.with_name(legacy_json.name + ".migrated"))
+        logger.info(f"{legacy_json.name} 中的消息已全部补回帖子存储")
+
+    @staticmethod
+    def _read_legacy(legacy_json: Path) -> List[int]:
+        """读取旧版 processed_ids.json，损坏时视为空"""
+        try:
+            data = load_json(legacy_json) or []
+        except json.JSONDecodeError:
+            data = []
+        return sorted(set(data))
+
+    def _insert_range(self, start: int, end: int):
+        """插入区间并与相邻区间合并"""
+        i = bisect_left(self._ends, start - 1)
+        j = bisect_right(self._starts, end + 1)
+        if i < j:
+            start = min(start, self._starts[i])
+            end = max(end, self._ends[j - 1])
+        self._starts[i:j] = [start]
+        self._ends[i:j] = [end]
+
+    def _sync(self):
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    @staticmethod
+    def _collapse(ids: Iterable[int]) -> List[Tuple[int, int]]:
+        """将ID集合折叠为连续区间"""
+        ranges: List[Tuple[int, int]] = []
+        for message_id in sorted(set(ids)):
+            if ranges and message_id == ranges[-1][1] + 1:
+                ranges[-1] = (ranges[-1][0], message_id)
+            else:
+                ranges.append((message_id, message_id))
+        return ranges
@@ -0,0 +1,221 @@
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from pyrogram import Client
+from pyrogram.errors import FloodWait
+from pyrogram.types import Message
+from .metrics import metrics
+from .rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class PooledClient:
+    """连接池中的一个客户端及其独立的限速器"""
+
+    def __init__(self, client: Client, limiter: TokenBucket, name: str):
+        self.client = client
+        self.limiter = limiter
+        self.name = name
+        self.in_flight = 0
+        self.requests = 0
+        self.flood_waits = 0
+
+
+class ClientPool:
+    """
+    多会话客户端池
+
+    每个会话都有自己的令牌桶，请求总是派发给最快可用的客户端；
+    某个客户端触发 FloodWait 时只暂停它自己，请求立即转交给其他客户端。
+    不是每个会话都能访问所有频道，对某个频道的请求只派发给能访问它的客户端。
+    媒体永久ID只由 file_unique_id 决定，与获取消息的客户端无关；file_id 却只对获取消息的会话有效，
+    下载时要在选中的客户端上重新获取（见 stream_media）。
+    """
+
+    def __init__(
+        self,
+        clients: List[Client],
+        rate: float = 3.0,
+        burst: int = 5,
+        limiters: Optional[List[TokenBucket]] = None,
+        access: Optional[Dict[int, List[Client]]] = None
+    ):
+        """
+        :param clients: 已启动的 Pyrogram 客户端
+        :param rate: 每个客户端每秒请求数上限
+        :param burst: 每个客户端允许的突发请求数
+        :param limiters: 为每个客户端指定的限速器，为空时按 rate/burst 创建
+        :param access: 频道ID → 可以访问该频道的客户端，没有列出的频道可以使用所有客户端
+        """
+        if not clients:
+            raise ValueError("客户端池至少需要一个客户端")
+        if limiters is not None and len(limiters) != len(clients):
+            raise ValueError("限速器数量必须与客户端数量一致")
+
+        self.members = [
+            PooledClient(
+                client,
+                limiters[i] if limiters is not None else TokenBucket(rate, burst),
+                f"#{i + 1}"
+            )
+            for i, client in enumerate(clients)
+        ]
+        # 频道ID → 可以访问该频道的成员
+        self.access: Dict[int, List[PooledClient]] = {}
+        for chat_id, chat_clients in (access or {}).items():
+            self.allow(chat_id, chat_clients)
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    @property
+    def primary(self) -> Client:
+        """第一个客户端，用于不需要分摊的请求"""
+        return self.members[0].client
+
+    def remove(self, client: Client):
+        """从池中移除客户端（例如无法访问任何频道）"""
+        if len(self.members) == 1:
+            raise ValueError("不能移除客户端池中最后一个客户端")
+        self.members = [member for member in self.members if member.client is not client]
+        for chat_id, members in self.access.items():
+            self.access[chat_id] = [member for member in members if member.client is not client]
+
+    def allow(self, chat_id: int, clients: List[Client]):
+        """对指定频道的请求只派发给这些客户端"""
+        self.access[chat_id] = [member for member in self.members if any(member.client is c for c in clients)]
+
+    def available(self, chat_id: Optional[int] = None) -> List[PooledClient]:
+        """可以访问指定频道的成员（没有限定时为所有成员）"""
+        return self.access.get(chat_id) or self.members
+
+    def primary_for(self, chat_id: int) -> Client:
+        """可以访问指定频道的第一个客户端"""
+        return self.available(chat_id)[0].client
+
+    def _pick(self, chat_id: Optional[int] = None) -> PooledClient:
+        """在可以访问该频道的客户端中选择最快可用的，同样可用时选择进行中请求最少的"""
+        return min(self.available(chat_id), key=lambda member: (member.limiter.delay(), member.in_flight))
+
+    async def get_messages(self, chat_id: int, ids: List[int]) -> List[Message]:
+        """
+        按消息ID获取消息
+
+        FloodWait 只会让对应客户端暂停，随后换一个客户端重试，不计入调用方的重试次数；
+        其他错误原样抛出，由调用方决定是否重试。
+        """
+        return await self._request('get_messages', chat_id, ids, label=f"批次 {ids[0]}-{ids[-1]}")
+
+    async def get_media_group(self, chat_id: int, message_id: int) -> List[Message]:
+        """获取消息所在媒体组的全部消息（限速和 FloodWait 处理同 get_messages）"""
+        return await self._request('get_media_group', chat_id, message_id, label=f"媒体组 {message_id}")
+
+    async def _request(self, method: str, chat_id: int, *args, label: str) -> Any:
+        """在可以访问该频道的客户端中最快可用的一个上发起请求，FloodWait 时换客户端重试"""
+        while True:
+            member = self._pick(chat_id)
+            with metrics.timer("rate_limit_wait_seconds", client=member.name):
+                await member.limiter.acquire()
+            member.in_flight += 1
+            member.requests += 1
+            metrics.inc("requests", method=method, client=member.name)
+            try:
+                with metrics.timer("request_seconds", method=method):
+                    result = await getattr(member.client, method)(chat_id, *args)
+            except FloodWait as e:
+                self._on_flood_wait(member, e.value)
+                logger.warning(f"客户端 {member.name} 触发 FloodWait（{e.value} 秒），"
+                               f"{label} 交给最快可用的客户端重试")
+                continue
+            finally:
+                member.in_flight -= 1
+
+            member.limiter.on_success()
+            return result
+
+    async def stream_media(
+        self,
+        file_id: str,
+        offset: int = 0,
+        chat_id: Optional[int] = None,
+        refetch: Optional[Callable[[Client], Awaitable[Optional[str]]]] = None
+    ):
+        """
+        在可以访问该频道的客户端中最快可用的一个上分块（1 MB）下载文件，从第 offset 块开始
+
+        file_id 与获取消息的会话绑定，换一个会话不一定能用。能访问该频道的会话不止一个时，
+        先用 refetch 在选中的客户端上重新获取文件所在的消息，换成该客户端自己的 file_id
+        （找不到时仍使用原来的 file_id）；只有一个会话时直接下载。
+        FloodWait 时暂停对应客户端后原样抛出，调用方从已写入的位置续传。
+
+        :param file_id: 文件ID
+        :param offset: 起始块
+        :param chat_id: 文件所在的频道
+        :param refetch: 在指定客户端上重新获取 file_id 的函数
+        """
+        member = self._pick(chat_id)
+        member.in_flight += 1
+        try:
+            if refetch is not None and len(self.available(chat_id)) > 1:
+                with metrics.timer("rate_limit_wait_seconds", client=member.name):
+                    await member.limiter.acquire()
+                member.requests += 1
+                metrics.inc("requests", method="get_messages", client=member.name)
+                file_id = await refetch(member.client) or file_id
+            with metrics.timer("rate_limit_wait_seconds", client=member.name):
+                await member.limiter.acquire()
+            member.requests += 1
+            metrics.inc("requests", method="stream_media", client=member.name)
+            async for chunk in member.client.stream_media(file_id, offset=offset):
+                metrics.inc("download_bytes", len(chunk))
+                yield chunk
+        except FloodWait as e:
+            self._on_flood_wait(member, e.value)
+            logger.warning(f"客户端 {member.name} 下载文件时触发 FloodWait（{e.value} 秒）")
+            raise
+        finally:
+            member.in_flight -= 1
+        member.limiter.on_success()
+
+    async def get_chat_history(self, chat_id: int, limit: int = 0):
+        """在可以访问该频道的第一个客户端上读取聊天记录"""
+        member = self.available(chat_id)[0]
+        await member.limiter.acquire()
+        member.requests += 1
+        metrics.inc("requests", method="get_chat_history", client=member.name)
+        async for msg in member.client.get_chat_history(chat_id, limit=limit):
+            yield msg
+
+    @staticmethod
+    def _on_flood_wait(member: PooledClient, seconds: float):
+        """暂停触发 FloodWait 的客户端并记录"""
+        member.flood_waits += 1
+        member.limiter.on_flood_wait(seconds)
+        metrics.inc("flood_waits", client=member.name)
+        metrics.inc("flood_wait_seconds", seconds, client=member.name)
+
+    def guess_extension(self, mime_type: str) -> Optional[str]:
+        return self.primary.guess_extension(mime_type)
+
+    @property
+    def flood_wait_total(self) -> float:
+        """所有客户端累计的 FloodWait 秒数"""
+        return sum(member.limiter.flood_wait_total for member in self.members)
+
+    def stats(self) -> List[dict]:
+        """每个客户端的请求统计"""
+        return [
+            {
+                "name": member.name,
+                "requests": member.requests,
+                "flood_waits": member.flood_waits,
+                "rate": round(member.limiter.rate, 2),
+            }
+            for member in self.members
+        ]
+
+    def __getattr__(self, name: str) -> Any:
+        # 其余接口（get_chat 等）直接使用主客户端
+        if name == 'members':
+            raise AttributeError(name)
+        return getattr(self.primary, name)
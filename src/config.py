@@ -1,15 +1,26 @@
+import logging
 import os
 import toml
 from pathlib import Path
-from dataclasses import dataclass
-from typing import Optional
+from dataclasses import dataclass, field
+from typing import List, Optional, Union
+
+logger = logging.getLogger(__name__)
 
 
 @dataclass
 class TelegramConfig:
     api_id: int
     api_hash: str
-    session_string: str
+    session_string: str = ""
+    session_strings: List[str] = field(default_factory=list)  # 额外的会话，用于分摊抓取请求
+    channel_cache: str = "channel_cache.json"  # 频道信息和访问凭据的磁盘缓存，为空时不缓存
+    channel_cache_ttl: float = 86400.0  # 缓存有效期（秒），过期后重新向 Telegram 获取频道信息
+
+    def all_sessions(self) -> List[str]:
+        """所有会话（去重，保持顺序）"""
+        sessions = [self.session_string, *self.session_strings]
+        return list(dict.fromkeys(session for session in sessions if session))
 
 
 @dataclass
@@ -19,7 +30,27 @@ class ExportConfig:
     domain_prefix: str
     batch_size: int = 50
     start_id: int = 1
-    end_id: int = 100000
+    end_id: Union[int, str] = 100000  # "auto" 表示自动探测最新消息ID
+    concurrency: int = 3           # 并发获取的批次数
+    rate_limit: float = 3.0        # 每秒请求数上限
+    rate_burst: int = 5            # 允许的突发请求数
+    max_retries: int = 5           # 批次失败后的最大重试次数
+    shard_size: int = 100          # 每个帖子分片包含的帖子数
+    full_posts_json: bool = True   # 是否同时写出完整的 posts.json
+    search_index: bool = True      # 是否生成客户端搜索索引
+    packed_archive: bool = False   # 是否同时写出紧凑的二进制归档 posts.bin
+    media_cache_size: int = 100000 # 永久ID/扩展名缓存的最大条目数
+    persist_media_cache: bool = True  # 是否把媒体缓存保存到输出目录，跨运行复用
+    reconcile_days: float = 7.0    # 对账（--reconcile）重新检查最近多少天内的帖子
+    mirror_path: str = ""          # 把照片和缩略图下载到这个目录（作为 CDN 源站），为空时不下载
+    mirror_concurrency: int = 4    # 镜像时同时下载的文件数
+    name: str = ""                 # 任务名称，用于日志和默认输出子目录
+    rss: Optional["RSSConfig"] = None  # 任务自己的 RSS 配置，为空时使用全局 [rss]
+
+    @property
+    def label(self) -> str:
+        """日志中显示的任务名称"""
+        return self.name or str(self.source_channel)
 
 
 @dataclass
@@ -29,13 +60,66 @@ class RSSConfig:
     description: str
     language: str
     image_url: str
+    entries: int = 50              # rss.xml / atom.xml 中保留的最新条目数
+    yearly_archives: bool = False  # 是否按年份生成归档订阅源（feeds/rss-2024.xml 等）
+
+
+@dataclass
+class SchedulerConfig:
+    parallel_jobs: int = 4         # 同时导出的频道数
+    progress_interval: float = 30.0  # 汇报各频道进度的间隔（秒），0 表示不汇报
+    workers: int = 0               # 批次转换和输出渲染使用的进程数，0 表示在当前进程中执行
+
+
+@dataclass
+class WatchConfig:
+    debounce: float = 2.0          # 最后一条更新之后等待的静默时间（秒），期间的更新合并为一批
+    max_delay: float = 10.0        # 一批更新最长等待时间（秒），持续有更新时也会按时发布
+    full_interval: float = 600.0   # 完整生成搜索索引和 posts.json 的最短间隔（秒）
+
+
+@dataclass
+class ResolverConfig:
+    host: str = "127.0.0.1"
+    port: int = 8080
+    cache_dir: str = "./resolver_cache"  # 热点文件的磁盘缓存目录
+    cache_size_mb: int = 1024      # 磁盘缓存总大小上限（MB）
+    max_cached_file_mb: int = 50   # 超过这个大小的文件直接从 Telegram 转发，不进入缓存（MB）
+
+
+@dataclass
+class MetricsConfig:
+    enabled: bool = False          # 是否收集运行指标（关闭时几乎没有开销）
+    report_file: str = "run-report.json"  # JSON 运行报告路径
+    prometheus_file: str = ""      # Prometheus 文本格式文件路径（供 node_exporter textfile collector 读取），为空时不写
+    log_level: str = "INFO"        # 日志级别：DEBUG、INFO、WARNING、ERROR
 
 
 @dataclass
 class Config:
     telegram: TelegramConfig
-    export: ExportConfig
+    export: ExportConfig           # 第一个导出任务（只有一个频道时即 [export]）
     rss: Optional[RSSConfig] = None
+    jobs: List[ExportConfig] = field(default_factory=list)  # 所有导出任务
+    scheduler: SchedulerConfig = field(default_factory=SchedulerConfig)
+    watch: WatchConfig = field(default_factory=WatchConfig)
+    resolver: ResolverConfig = field(default_factory=ResolverConfig)
+    metrics: MetricsConfig = field(default_factory=MetricsConfig)
+
+
+def _build_job(defaults: dict, job: dict) -> ExportConfig:
+    """
+    合并 [export] 默认值和单个 [[jobs]] 条目
+
+    没有指定 output_path 的任务输出到 [export].output_path 下以任务名称（或频道ID）命名的子目录。
+    """
+    job = dict(job)
+    rss = job.pop('rss', None)
+    merged = {**defaults, **job}
+    if 'output_path' not in job:
+        subdir = job.get('name') or str(job.get('source_channel', ''))
+        merged['output_path'] = str(Path(defaults.get('output_path', './output')) / subdir)
+    return ExportConfig(**merged, rss=RSSConfig(**rss) if rss else None)
 
 
 def load_config(config_path: str = "config.toml") -> Config:
@@ -55,13 +139,28 @@ def load_config(config_path: str = "config.toml") -> Config:
     
     # 解析配置
     telegram_config = TelegramConfig(**config_data['telegram'])
-    export_config = ExportConfig(**config_data['export'])
     rss_config = RSSConfig(**config_data['rss']) if 'rss' in config_data else None
+    scheduler_config = SchedulerConfig(**config_data.get('scheduler', {}))
+    watch_config = WatchConfig(**config_data.get('watch', {}))
+    resolver_config = ResolverConfig(**config_data.get('resolver', {}))
+    metrics_config = MetricsConfig(**config_data.get('metrics', {}))
+    
+    # [[jobs]] 中的每个条目继承 [export] 的设置；没有 [[jobs]] 时 [export] 就是唯一的任务
+    export_defaults = config_data.get('export', {})
+    if config_data.get('jobs'):
+        jobs = [_build_job(export_defaults, job) for job in config_data['jobs']]
+    else:
+        jobs = [ExportConfig(**export_defaults)]
     
     return Config(
         telegram=telegram_config,
-        export=export_config,
-        rss=rss_config
+        export=jobs[0],
+        rss=rss_config,
+        jobs=jobs,
+        scheduler=scheduler_config,
+        watch=watch_config,
+        resolver=resolver_config,
+        metrics=metrics_config
     )
 
 
@@ -74,23 +173,90 @@ def validate_config(config: Config) -> bool:
     """
     # 验证 Telegram 配置
     if not config.telegram.api_id or not config.telegram.api_hash:
-        print("错误: Telegram API ID 和 API Hash 不能为空")
+        logger.error("Telegram API ID 和 API Hash 不能为空")
         return False
     
-    if not config.telegram.session_string:
-        print("错误: Session String 不能为空")
+    if not config.telegram.all_sessions():
+        logger.error("session_string 和 session_strings 不能同时为空")
+        return False
+    
+    if config.telegram.channel_cache_ttl < 0:
+        logger.error("telegram.channel_cache_ttl 不能小于 0")
+        return False
+    
+    jobs = config.jobs or [config.export]
+    
+    # 每个任务都有自己的检查点和帖子存储，输出目录不能重复
+    output_paths = [Path(job.output_path).resolve() for job in jobs]
+    if len(set(output_paths)) != len(output_paths):
+        logger.error("各导出任务的 output_path 不能相同")
+        return False
+    
+    if config.scheduler.parallel_jobs < 1:
+        logger.error("parallel_jobs 必须大于等于 1")
+        return False
+    
+    if config.scheduler.workers < 0:
+        logger.error("scheduler.workers 不能小于 0")
+        return False
+    
+    if config.watch.debounce < 0 or config.watch.max_delay < config.watch.debounce:
+        logger.error("watch.debounce 不能小于 0，watch.max_delay 不能小于 debounce")
+        return False
+    
+    for rss in [config.rss, *(job.rss for job in jobs)]:
+        if rss and rss.entries < 1:
+            logger.error("rss.entries 必须大于等于 1")
+            return False
+    
+    if config.resolver.cache_size_mb < 1 or config.resolver.max_cached_file_mb < 1:
+        logger.error("resolver.cache_size_mb 和 resolver.max_cached_file_mb 必须大于等于 1")
+        return False
+    
+    if config.metrics.log_level.upper() not in ("DEBUG", "INFO", "WARNING", "ERROR"):
+        logger.error("metrics.log_level 必须是 DEBUG、INFO、WARNING 或 ERROR")
         return False
     
     # 验证导出配置
-    if not config.export.source_channel:
-        print("错误: 源频道 ID 不能为空")
+    for job in jobs:
+        if not validate_export_config(job):
+            return False
+    
+    return True
+
+
+def validate_export_config(export: ExportConfig) -> bool:
+    """
+    验证单个导出任务的配置
+    
+    :param export: 导出配置
+    :return: 是否有效
+    """
+    if not export.source_channel:
+        logger.error("源频道 ID 不能为空")
+        return False
+    
+    if not export.domain_prefix:
+        logger.error(f"任务 {export.label} 的域名前缀不能为空")
+        return False
+    
+    if not isinstance(export.end_id, int) and export.end_id != "auto":
+        logger.error(f"任务 {export.label} 的 end_id 必须是整数或 \"auto\"")
+        return False
+    
+    if export.reconcile_days <= 0:
+        logger.error(f"任务 {export.label} 的 reconcile_days 必须大于 0")
+        return False
+    
+    if export.mirror_path and export.mirror_concurrency < 1:
+        logger.error(f"任务 {export.label} 的 mirror_concurrency 必须大于等于 1")
         return False
     
-    if not config.export.domain_prefix:
-        print("错误: 域名前缀不能为空")
+    if export.concurrency < 1 or export.rate_limit <= 0:
+        logger.error(f"任务 {export.label} 的 concurrency 必须大于等于 1，rate_limit 必须大于 0")
         return False
     
     # 创建输出目录
-    Path(config.export.output_path).mkdir(parents=True, exist_ok=True)
+    Path(export.output_path).mkdir(parents=True, exist_ok=True)
     
     return True
@@ -0,0 +1,62 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CPUExecutor:
+    """
+    CPU 密集工作（批次转换、分片渲染）的执行层
+
+    workers 为 0 时在调用方所在的线程中直接执行；大于 0 时交给进程池，不受 GIL 限制，
+    事件循环在等待结果期间继续抓取。任务函数必须是模块级函数，参数和返回值只包含普通的字典、列表和字符串。
+    结果总是按提交顺序返回，与 workers 无关，输出逐字节相同。
+    """
+
+    def __init__(self, workers: int = 0):
+        """
+        :param workers: 进程数，0 表示不使用进程池
+        """
+        self.workers = max(0, workers)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        if self.workers:
+            # spawn 启动的子进程不继承事件循环、数据库连接和锁，比 fork 安全
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            # 提前启动子进程，启动和导入模块的时间与连接 Telegram 重叠
+            for _ in range(self.workers):
+                self._pool.submit(int)
+            logger.info(f"CPU 密集工作使用 {self.workers} 个进程")
+
+    def __bool__(self) -> bool:
+        return self._pool is not None
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """
+        在事件循环中调用：有进程池时在子进程中执行并等待结果，否则直接执行
+
+        :param fn: 模块级函数
+        :return: fn 的返回值
+        """
+        if self._pool is None:
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+
+    def map(self, fn: Callable[..., Any], *iterables: Iterable[Any]) -> List[Any]:
+        """
+        在线程中调用（例如生成输出时）：并行执行并按输入顺序返回结果
+
+        :param fn: 模块级函数
+        :return: 结果列表
+        """
+        if self._pool is None:
+            return list(map(fn, *iterables))
+        return list(self._pool.map(fn, *iterables))
+
+    def shutdown(self):
+        """等待进行中的任务完成并关闭进程池"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
@@ -0,0 +1,100 @@
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple
+
+
+class MediaCache:
+    """
+    以 file_unique_id 为键的有界 LRU 缓存，记录永久ID、扩展名和永久链接
+
+    file_id 会随会话变化，file_unique_id 对同一文件始终不变，
+    因此同一贴纸或被反复转发的图片只需解析一次，永久链接也保持稳定。
+    可选持久化到磁盘，跨运行复用。
+    """
+
+    def __init__(self, max_entries: int = 100000, path: Optional[Path] = None, domain_prefix: str = ""):
+        """
+        :param max_entries: 最多缓存的条目数
+        :param path: 持久化文件路径，为空时只在内存中缓存
+        :param domain_prefix: 永久链接域名前缀，与持久化文件中的不一致时丢弃旧缓存
+        """
+        self.max_entries = max_entries
+        self.path = Path(path) if path else None
+        self.domain_prefix = domain_prefix
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[str, str, str]]" = OrderedDict()
+        self._dirty = False
+
+        if self.path and self.path.exists():
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, key: str) -> Optional[Tuple[str, str, str]]:
+        """
+        查询缓存
+
+        :param key: file_unique_id
+        :return: (永久ID, 扩展名, 永久链接)，未命中时返回 None
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, permanent_id: str, ext: str, url: str):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        self._entries[key] = (permanent_id, ext, url)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._dirty = True
+
+    def load(self):
+        """从磁盘加载缓存"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+
+        # 永久ID由 file_unique_id 确定性生成，丢弃缓存只影响速度，不影响链接稳定性
+        if data.get("domain_prefix") != self.domain_prefix:
+            return
+
+        for key, permanent_id, ext, url in data.get("entries", [])[-self.max_entries:]:
+            self._entries[key] = (permanent_id, ext, url)
+
+    def save(self):
+        """按 LRU 顺序写回磁盘（临时文件 + 原子替换）"""
+        if not self.path or not self._dirty:
+            return
+
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(
+                {
+                    "version": 1,
+                    "domain_prefix": self.domain_prefix,
+                    "entries": [[key, *value] for key, value in self._entries.items()],
+                },
+                f, ensure_ascii=False, separators=(',', ':')
+            )
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+    def stats(self) -> str:
+        """命中统计"""
+        return f"命中 {self.hits}，未命中 {self.misses}，命中率 {self.hit_rate:.1%}，条目 {len(self)}"
@@ -0,0 +1,251 @@
+import asyncio
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+from pyrogram import Client
+from pyrogram.errors import FileReferenceExpired, FileReferenceInvalid, FloodWait
+from .client_pool import ClientPool
+from .media_processor import MediaDescriptor
+from .metrics import metrics
+from .post_store import PostStore, media_entries
+from .utils import file_digest, load_json, save_json
+
+logger = logging.getLogger(__name__)
+
+# Pyrogram stream_media 的分块大小，续传偏移以块为单位
+CHUNK_SIZE = 1024 * 1024
+
+
+def find_file_id(messages: List[Any], entry: Dict[str, Any]) -> Optional[str]:
+    """
+    在重新获取的消息中按 file_unique_id 找到媒体索引条目对应的文件（或缩略图）
+
+    :param messages: 文件所属帖子的消息
+    :param entry: PostStore.lookup_media 返回的条目
+    :return: 文件ID，找不到时返回 None
+    """
+    for msg in messages:
+        descriptor = MediaDescriptor.from_message(msg) if msg and not getattr(msg, 'empty', False) else None
+        if descriptor is None or descriptor.file_unique_id != entry['file_unique_id']:
+            continue
+        source = descriptor.thumb if entry['thumb'] else descriptor
+        if source is not None:
+            return source.file_id
+    return None
+
+
+def refetcher(
+    chat_id: int,
+    post_store: PostStore,
+    entry: Dict[str, Any]
+) -> Callable[[Client], Awaitable[Optional[str]]]:
+    """
+    生成交给 ClientPool.stream_media 的 refetch 函数：在指定客户端上重新获取文件所属帖子的消息，
+    返回该客户端可以使用的 file_id
+
+    :param chat_id: 频道ID
+    :param post_store: 帖子存储
+    :param entry: PostStore.lookup_media 返回的条目
+    """
+    message_ids = post_store.member_ids(entry['post_id'])
+
+    async def refetch(client: Client) -> Optional[str]:
+        # 旧数据没有 file_unique_id，无法在新消息中认出文件
+        if not entry['file_unique_id']:
+            return None
+        return find_file_id(await client.get_messages(chat_id, message_ids), entry)
+
+    return refetch
+
+
+async def download_file(
+    pool: ClientPool,
+    file_id: str,
+    part_path: Path,
+    max_retries: int = 3,
+    chat_id: Optional[int] = None,
+    refetch: Optional[Callable[[Client], Awaitable[Optional[str]]]] = None
+):
+    """
+    把文件下载到 part_path，从已写入的整块处续传
+
+    FloodWait 由客户端池暂停对应的客户端后立即续传，不计入重试次数；
+    文件引用过期或无效无法靠重试恢复，直接抛出。
+
+    :param pool: 客户端池
+    :param file_id: 文件ID
+    :param part_path: 下载中的文件路径
+    :param max_retries: 其他错误的最大重试次数，耗尽后抛出最后一次的异常
+    :param chat_id: 文件所在的频道，只在能访问它的客户端上下载
+    :param refetch: 在选中的客户端上重新获取 file_id 的函数（见 ClientPool.stream_media）
+    """
+    attempt = 0
+    while True:
+        # 只保留完整的块，从下一块开始续传
+        written = part_path.stat().st_size if part_path.exists() else 0
+        offset = written // CHUNK_SIZE
+        try:
+            with open(part_path, 'ab') as f:
+                f.truncate(offset * CHUNK_SIZE)
+                async for chunk in pool.stream_media(file_id, offset=offset, chat_id=chat_id, refetch=refetch):
+                    f.write(chunk)
+            return
+        except FloodWait:
+            continue
+        except (FileReferenceExpired, FileReferenceInvalid):
+            raise
+        except Exception:
+            attempt += 1
+            if attempt > max_retries:
+                raise
+            await asyncio.sleep(min(2 ** attempt, 60))
+
+
+class MediaMirror:
+    """
+    把页面直接显示的图片（照片和各类媒体的缩略图）下载到本地镜像目录
+
+    文件按永久链接中的文件名（{永久ID}.jpg、{永久ID}_thumb.jpg）保存，镜像目录可直接作为
+    domain_prefix 对应的 CDN 源站。多个文件以有限并发同时下载；中断的下载保留在 .part 文件中，
+    下次从已写入的整块处续传。清单记录每个文件的大小和哈希，已存在且大小一致的文件直接跳过。
+    """
+
+    MANIFEST_FILE = "mirror-manifest.json"
+
+    def __init__(
+        self,
+        pool: ClientPool,
+        mirror_dir: Path,
+        domain_prefix: str,
+        concurrency: int = 4,
+        max_retries: int = 3,
+        chat_id: Optional[int] = None
+    ):
+        """
+        :param pool: 客户端池
+        :param mirror_dir: 镜像目录
+        :param domain_prefix: 永久链接域名前缀，镜像中的文件名即链接的最后一段
+        :param concurrency: 同时下载的文件数
+        :param max_retries: 单个文件失败后的最大重试次数（FloodWait 不计入）
+        :param chat_id: 图片所在的频道，file_id 只对获取消息的会话有效，多会话时据此在下载的客户端上重新获取
+        """
+        self.pool = pool
+        self.mirror_dir = Path(mirror_dir)
+        self.domain_prefix = domain_prefix.rstrip('/')
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.chat_id = chat_id
+
+    async def run(self, post_store: PostStore, label: str = "") -> Dict[str, int]:
+        """
+        镜像上次运行之后新增或变化的帖子中的图片，以及上次失败的文件
+
+        :param post_store: 帖子存储
+        :param label: 日志前缀
+        :return: 统计（downloaded、skipped、failed、bytes）
+        """
+        self.mirror_dir.mkdir(parents=True, exist_ok=True)
+        manifest = self._load_manifest()
+        files: Dict[str, Dict[str, Any]] = manifest['files']
+        store_rev = post_store.current_rev()
+
+        pending = dict(manifest['pending'])
+        for file_name, file_id in self.collect(post_store.posts_changed_since(manifest['store_rev'])):
+            pending[file_name] = file_id
+
+        stats = {"downloaded": 0, "skipped": 0, "failed": 0, "bytes": 0}
+        todo = []
+        for file_name, file_id in pending.items():
+            if self._is_present(file_name, files):
+                stats["skipped"] += 1
+            elif post_store.lookup_media(file_name) is not None:
+                # 上次失败后所属帖子已被删除的文件不再下载
+                todo.append((file_name, file_id))
+
+        failed: Dict[str, str] = {}
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def download(file_name: str, file_id: str):
+            async with slots:
+                entry = await self._download(file_name, file_id, post_store)
+            if entry is None:
+                failed[file_name] = file_id
+                stats["failed"] += 1
+            else:
+                files[file_name] = entry
+                stats["downloaded"] += 1
+                stats["bytes"] += entry["size"]
+
+        try:
+            await asyncio.gather(*(download(file_name, file_id) for file_name, file_id in todo))
+        finally:
+            # 中途被取消时，未完成的文件留到下次继续
+            done = set(files)
+            failed.update((name, file_id) for name, file_id in todo if name not in done and name not in failed)
+            manifest.update(store_rev=store_rev, pending=sorted(failed.items()))
+            save_json(self.mirror_dir / self.MANIFEST_FILE, manifest, indent=None)
+
+        prefix = f"[{label}] " if label else ""
+        logger.info(f"{prefix}媒体镜像: 下载 {stats['downloaded']} 个（{stats['bytes']} 字节），"
+                    f"跳过 {stats['skipped']} 个，失败 {stats['failed']} 个")
+        for key, value in stats.items():
+            metrics.inc(f"mirror_{key}", value, job=label)
+        return stats
+
+    def collect(self, posts: Iterable[Dict[str, Any]]) -> List[Tuple[str, str]]:
+        """
+        列出帖子中页面会显示的图片
+
+        :return: [(镜像文件名, file_id)]
+        """
+        items = []
+        for post in posts:
+            for file_name, media, thumb in media_entries(post):
+                if thumb:
+                    items.append((file_name, media['thumb']['file_id']))
+                elif media.get('media_type') == 'photo':
+                    items.append((file_name, media['file_id']))
+        return items
+
+    def _is_present(self, file_name: str, files: Dict[str, Dict[str, Any]]) -> bool:
+        """文件已存在且与清单记录的大小一致；清单中没有记录的现有文件补记后也视为存在"""
+        path = self.mirror_dir / file_name
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            return False
+        entry = files.get(file_name)
+        if entry is None:
+            files[file_name] = {"size": size, "hash": file_digest(path)}
+            return True
+        return entry["size"] == size
+
+    async def _download(self, file_name: str, file_id: str, post_store: PostStore) -> Optional[Dict[str, Any]]:
+        """
+        下载单个文件，从 .part 文件续传
+
+        :return: 清单条目（size、hash），重试耗尽时返回 None
+        """
+        path = self.mirror_dir / file_name
+        part_path = path.with_name(path.name + ".part")
+        entry = post_store.lookup_media(file_name) if self.chat_id is not None else None
+        refetch = refetcher(self.chat_id, post_store, entry) if entry is not None else None
+        try:
+            await download_file(self.pool, file_id, part_path, self.max_retries, self.chat_id, refetch)
+        except Exception as e:
+            logger.warning(f"镜像 {file_name} 失败: {e}")
+            return None
+        os.replace(part_path, path)
+        return {"size": path.stat().st_size, "hash": file_digest(path)}
+
+    def _load_manifest(self) -> Dict[str, Any]:
+        """读取镜像清单，不存在或损坏时从头开始"""
+        try:
+            manifest = load_json(self.mirror_dir / self.MANIFEST_FILE)
+        except (FileNotFoundError, json.JSONDecodeError):
+            manifest = None
+        if not manifest or manifest.get('domain_prefix') != self.domain_prefix:
+            return {"version": 1, "domain_prefix": self.domain_prefix, "store_rev": 0, "files": {}, "pending": []}
+        return manifest
@@ -1,19 +1,154 @@
 import hashlib
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 from pyrogram import Client
 from pyrogram.types import Message
-from pyrogram.file_id import FileId, FileType
+from .media_cache import MediaCache
+
+# 消息媒体属性 → (媒体类型, 默认扩展名)，顺序即识别优先级
+MEDIA_KINDS = {
+    'photo': ("photo", ".jpg"),
+    'video': ("video_file", ".mp4"),
+    'audio': ("audio_file", ".mp3"),
+    'voice': ("voice_message", ".ogg"),
+    'document': ("document", ".bin"),
+    'sticker': ("sticker", ".webp"),
+    'animation': ("animation", ".mp4"),
+    'video_note': ("video_message", ".mp4"),
+}
+
+_MISSING = object()
+
+
+class MediaDescriptor:
+    """
+    消息媒体的一次性分类结果
+
+    媒体对象只在这里识别一次，扩展名推测、永久ID生成和缩略图处理都复用同一个描述符。
+    """
+
+    __slots__ = ('kind', 'media', 'media_type', 'default_ext', 'file_id', 'file_unique_id',
+                 'file_name', 'mime_type', 'thumb')
+
+    def __init__(self, kind: str, media: Any):
+        self.kind = kind
+        self.media = media
+        self.media_type, self.default_ext = MEDIA_KINDS[kind]
+        self.file_id: str = media.file_id
+        self.file_unique_id: Optional[str] = getattr(media, 'file_unique_id', None)
+        self.file_name: Optional[str] = getattr(media, 'file_name', None)
+        self.mime_type: Optional[str] = getattr(media, 'mime_type', None)
+
+        # 选择最大的缩略图
+        thumbs = getattr(media, 'thumbs', None)
+        self.thumb = max(thumbs, key=lambda x: getattr(x, 'file_size', 0)) if thumbs else None
+
+    @classmethod
+    def from_message(cls, msg: Message) -> Optional["MediaDescriptor"]:
+        """
+        识别消息中的媒体
+
+        优先使用 Pyrogram 的 msg.media 枚举直接定位媒体属性，
+        没有该字段时才按优先级依次探测各个属性。
+        """
+        media_enum = getattr(msg, 'media', _MISSING)
+        if media_enum is not _MISSING:
+            kind = getattr(media_enum, 'value', None)
+            if kind not in MEDIA_KINDS:
+                return None
+            media = getattr(msg, kind, None)
+            return cls(kind, media) if media else None
+
+        for kind in MEDIA_KINDS:
+            media = getattr(msg, kind, None)
+            if media:
+                return cls(kind, media)
+        return None
+
+
+def generate_permanent_id(stable_id: str) -> str:
+    """
+    基于文件的稳定标识生成永久ID
+    优先使用 file_unique_id（file_id 会随会话变化），使用 SHA256 确保唯一性和一致性
+    """
+    hash_obj = hashlib.sha256(stable_id.encode())
+    return hash_obj.hexdigest()[:16]  # 取前16位作为永久ID
+
+
+def build_media_info(
+    fields: Dict[str, Any],
+    domain_prefix: str
+) -> Tuple[Dict[str, Any], List[Tuple[str, str, str, str]]]:
+    """
+    根据 MediaProcessor.describe_media 的结果生成媒体信息
+
+    只使用普通字典，不需要客户端和缓存，可以在子进程中执行。
+
+    :param fields: describe_media 的结果
+    :param domain_prefix: 永久域名前缀（不带末尾的 /）
+    :return: (媒体信息, 新解析的缓存条目 [(file_unique_id, 永久ID, 扩展名, 永久链接)])
+    """
+    resolved = []
+    key = fields['file_unique_id']
+    if fields['resolved'] is not None:
+        permanent_id, file_ext, permanent_url = fields['resolved']
+    else:
+        file_ext = fields['file_ext']
+        permanent_id = generate_permanent_id(key or fields['file_id'])
+        permanent_url = f"{domain_prefix}/{permanent_id}{file_ext}"
+        if key:
+            resolved.append((key, permanent_id, file_ext, permanent_url))
+
+    # 构建媒体信息
+    media_info = {
+        "permanent_url": permanent_url,
+        "permanent_id": permanent_id,
+        "file_id": fields['file_id'],
+        "file_unique_id": key,
+        "file_ext": file_ext,
+        "original_name": fields['file_name'],
+        "mime_type": fields['mime_type'],
+        "file_size": fields['file_size'],
+        "media_type": fields['media_type'],
+        "width": fields['width'],
+        "height": fields['height'],
+        "duration": fields['duration'],
+    }
+
+    # 处理缩略图
+    thumb = fields['thumb']
+    if thumb is not None:
+        if thumb['resolved'] is not None:
+            thumb_id, _, thumb_url = thumb['resolved']
+        else:
+            # 生成缩略图永久链接
+            thumb_key = thumb['file_unique_id']
+            thumb_id = generate_permanent_id(thumb_key or thumb['file_id'])
+            thumb_ext = ".jpg"  # 缩略图通常是 JPEG 格式
+            thumb_url = f"{domain_prefix}/{thumb_id}_thumb{thumb_ext}"
+            if thumb_key:
+                resolved.append((thumb_key, thumb_id, thumb_ext, thumb_url))
+        media_info["thumb"] = {
+            "permanent_url": thumb_url,
+            "permanent_id": thumb_id,
+            "file_id": thumb['file_id'],
+            "width": thumb['width'],
+            "height": thumb['height'],
+        }
+
+    return media_info, resolved
 
 
 class MediaProcessor:
-    def __init__(self, domain_prefix: str):
+    def __init__(self, domain_prefix: str, cache: Optional[MediaCache] = None):
         """
         初始化媒体处理器
         
         :param domain_prefix: 永久域名前缀
+        :param cache: 永久ID/扩展名缓存，为空时使用仅在内存中的缓存
         """
         self.domain_prefix = domain_prefix.rstrip('/')
+        self.cache = cache if cache is not None else MediaCache(domain_prefix=self.domain_prefix)
     
     def process_media(self, msg: Message, client: Client) -> Optional[Dict[str, Any]]:
         """
@@ -23,155 +158,80 @@ class MediaProcessor:
         :param client: Pyrogram 客户端
         :return: 媒体信息字典
         """
-        media = self._get_media(msg)
-        if not media:
+        fields = self.describe_media(msg, client)
+        if fields is None:
             return None
-        
-        # 获取文件信息
-        file_id = media.file_id
-        file_ext = self._guess_extension(client, msg)
-        
-        # 生成永久ID
-        permanent_id = self._generate_permanent_id(file_id)
-        
-        # 构建永久链接
-        permanent_url = f"{self.domain_prefix}/{permanent_id}{file_ext}"
-        
-        # 构建媒体信息
-        media_info = {
-            "permanent_url": permanent_url,
-            "permanent_id": permanent_id,
-            "file_id": file_id,
-            "file_ext": file_ext,
-            "original_name": getattr(media, 'file_name', None),
-            "mime_type": getattr(media, 'mime_type', None),
+        media_info, resolved = build_media_info(fields, self.domain_prefix)
+        self.remember(resolved)
+        return media_info
+
+    def describe_media(self, msg: Message, client: Client) -> Optional[Dict[str, Any]]:
+        """
+        识别消息中的媒体并查询缓存，返回交给 build_media_info 的普通字典
+
+        缓存命中时带上缓存的永久链接，保证链接跨运行稳定；未命中时带上推测的扩展名，
+        永久ID和链接由 build_media_info 计算。
+
+        :param msg: Telegram 消息对象
+        :param client: Pyrogram 客户端（推测扩展名）
+        :return: 媒体字段，没有媒体时返回 None
+        """
+        descriptor = MediaDescriptor.from_message(msg)
+        if descriptor is None:
+            return None
+
+        media = descriptor.media
+        key = descriptor.file_unique_id
+        cached = self.cache.get(key) if key else None
+        fields = {
+            "media_type": descriptor.media_type,
+            "file_id": descriptor.file_id,
+            "file_unique_id": key,
+            "file_name": descriptor.file_name,
+            "mime_type": descriptor.mime_type,
             "file_size": getattr(media, 'file_size', 0),
-            "media_type": self._get_media_type(msg),
             "width": getattr(media, 'width', None),
             "height": getattr(media, 'height', None),
             "duration": getattr(media, 'duration', None),
+            "resolved": cached,
+            "file_ext": None if cached is not None else self._guess_extension(client, descriptor),
+            "thumb": None,
         }
-        
-        # 处理缩略图
-        thumb_info = self._process_thumbnail(msg, client)
-        if thumb_info:
-            media_info["thumb"] = thumb_info
-        
-        return media_info
-    
-    def _get_media(self, msg: Message):
-        """获取消息中的媒体对象"""
-        media_types = ['photo', 'video', 'audio', 'voice', 'document', 
-                      'sticker', 'animation', 'video_note']
-        
-        for media_type in media_types:
-            media = getattr(msg, media_type, None)
-            if media:
-                return media
-        return None
-    
-    def _generate_permanent_id(self, file_id: str) -> str:
+
+        thumb = descriptor.thumb
+        if thumb is not None:
+            thumb_key = getattr(thumb, 'file_unique_id', None)
+            fields["thumb"] = {
+                "file_id": thumb.file_id,
+                "file_unique_id": thumb_key,
+                "width": getattr(thumb, 'width', None),
+                "height": getattr(thumb, 'height', None),
+                "resolved": self.cache.get(thumb_key) if thumb_key else None,
+            }
+        return fields
+
+    def remember(self, resolved: List[Tuple[str, str, str, str]]):
         """
-        基于 file_id 生成永久ID
-        使用 SHA256 确保唯一性和一致性
+        把 build_media_info 新解析的永久链接写入缓存
+
+        :param resolved: [(file_unique_id, 永久ID, 扩展名, 永久链接)]
         """
-        hash_obj = hashlib.sha256(file_id.encode())
-        return hash_obj.hexdigest()[:16]  # 取前16位作为永久ID
+        for key, permanent_id, file_ext, permanent_url in resolved:
+            self.cache.put(key, permanent_id, file_ext, permanent_url)
     
-    def _guess_extension(self, client: Client, msg: Message) -> str:
-        """推测文件扩展名"""
-        media = self._get_media(msg)
-        if not media:
-            return ""
-        
+    def _guess_extension(self, client: Client, descriptor: MediaDescriptor) -> str:
+        """
+        推测文件扩展名
+
+        file_id 中编码的文件类型与媒体属性一一对应，因此直接按描述符的类型推测，
+        不再解码 file_id。
+        """
         # 如果有原始文件名，提取扩展名
-        if hasattr(media, 'file_name') and media.file_name:
-            return Path(media.file_name).suffix
-        
-        # 根据媒体类型推测扩展名
-        try:
-            file_id_obj = FileId.decode(media.file_id)
-            mime_type = getattr(media, 'mime_type', None)
-            return self._guess_ext_by_type(client, file_id_obj.file_type, mime_type)
-        except Exception:
-            return self._guess_ext_by_media_type(msg)
-    
-    def _guess_ext_by_type(self, client: Client, file_type: int, mime_type: str) -> str:
-        """根据文件类型推测扩展名"""
-        guessed = client.guess_extension(mime_type) if mime_type else None
+        if descriptor.file_name:
+            return Path(descriptor.file_name).suffix
         
-        if file_type == FileType.PHOTO:
+        if descriptor.kind == 'photo':
             return ".jpg"
-        elif file_type == FileType.VOICE:
-            return guessed or ".ogg"
-        elif file_type in (FileType.VIDEO, FileType.ANIMATION, FileType.VIDEO_NOTE):
-            return guessed or ".mp4"
-        elif file_type == FileType.DOCUMENT:
-            return guessed or ".bin"
-        elif file_type == FileType.STICKER:
-            return guessed or ".webp"
-        elif file_type == FileType.AUDIO:
-            return guessed or ".mp3"
-        else:
-            return ".unknown"
-    
-    def _guess_ext_by_media_type(self, msg: Message) -> str:
-        """根据消息媒体类型推测扩展名"""
-        if msg.photo:
-            return ".jpg"
-        elif msg.video:
-            return ".mp4"
-        elif msg.audio:
-            return ".mp3"
-        elif msg.voice:
-            return ".ogg"
-        elif msg.sticker:
-            return ".webp"
-        elif msg.animation:
-            return ".mp4"
-        elif msg.video_note:
-            return ".mp4"
-        else:
-            return ".bin"
-    
-    def _get_media_type(self, msg: Message) -> str:
-        """获取媒体类型"""
-        if msg.photo:
-            return "photo"
-        elif msg.video:
-            return "video_file"
-        elif msg.audio:
-            return "audio_file"
-        elif msg.voice:
-            return "voice_message"
-        elif msg.document:
-            return "document"
-        elif msg.sticker:
-            return "sticker"
-        elif msg.animation:
-            return "animation"
-        elif msg.video_note:
-            return "video_message"
-        return "unknown"
-    
-    def _process_thumbnail(self, msg: Message, client: Client) -> Optional[Dict[str, Any]]:
-        """处理缩略图"""
-        media = self._get_media(msg)
-        if not media or not hasattr(media, 'thumbs') or not media.thumbs:
-            return None
-        
-        # 选择最大的缩略图
-        largest_thumb = max(media.thumbs, key=lambda x: getattr(x, 'file_size', 0))
-        
-        # 生成缩略图永久链接
-        thumb_id = self._generate_permanent_id(largest_thumb.file_id)
-        thumb_ext = ".jpg"  # 缩略图通常是 JPEG 格式
-        thumb_url = f"{self.domain_prefix}/{thumb_id}_thumb{thumb_ext}"
-        
-        return {
-            "permanent_url": thumb_url,
-            "permanent_id": thumb_id,
-            "file_id": largest_thumb.file_id,
-            "width": getattr(largest_thumb, 'width', None),
-            "height": getattr(largest_thumb, 'height', None),
-        }
+
+        guessed = client.guess_extension(descriptor.mime_type) if descriptor.mime_type else None
+        return guessed or descriptor.default_ext
@@ -1,100 +1,620 @@
 import asyncio
 import json
-from typing import List, Dict, Any, Set
+import logging
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Tuple, Union
 from pathlib import Path
 from pyrogram import Client
 from pyrogram.types import Message
-from .media_processor import MediaProcessor
-from .utils import save_json, load_json
+from .checkpoint import CheckpointStore
+from .client_pool import ClientPool
+from .executor import CPUExecutor
+from .media_processor import MediaProcessor, build_media_info
+from .metrics import metrics
+from .post_store import JOURNAL_FETCHED, JOURNAL_PERSISTED, PostStore, content_hash
+from .rate_limiter import TokenBucket
+from .utils import load_json
+
+logger = logging.getLogger(__name__)
+
+# 流水线阶段之间的结束标记
+_END = object()
+
+
+def transform_message(message: Dict[str, Any], domain_prefix: str) -> List[Tuple[str, str, str, str]]:
+    """
+    把 MessageProcessor._message_fields 提取的媒体字段替换为媒体信息（原地修改）
+
+    :param message: 消息字段
+    :param domain_prefix: 永久域名前缀
+    :return: 新解析的媒体缓存条目
+    """
+    if 'media' not in message:
+        return []
+    message['media'], resolved = build_media_info(message['media'], domain_prefix)
+    return resolved
+
+
+def transform_batch(
+    messages: List[Dict[str, Any]],
+    domain_prefix: str
+) -> Tuple[List[Dict[str, Any]], str, List[Tuple[str, str, str, str]]]:
+    """
+    转换一个批次的消息字段（只使用普通字典，可以在子进程中执行）
+
+    :param messages: 消息字段，按ID升序
+    :param domain_prefix: 永久域名前缀
+    :return: (消息字典, 写入批次日志的 JSON, 新解析的媒体缓存条目)
+    """
+    resolved = []
+    for message in messages:
+        resolved.extend(transform_message(message, domain_prefix))
+    return messages, json.dumps(messages, ensure_ascii=False), resolved
 
 
 class MessageProcessor:
-    def __init__(self, client: Client, media_processor: MediaProcessor):
+    # 单次 get_messages 最多可请求的消息ID数
+    MAX_IDS_PER_REQUEST = 200
+    # 写入阶段缓存的最近回复预览数
+    REPLY_CACHE_SIZE = 10000
+    
+    def __init__(
+        self,
+        client: Union[Client, ClientPool],
+        media_processor: MediaProcessor,
+        post_store: PostStore,
+        rate_limiter: Optional[TokenBucket] = None,
+        name: str = "",
+        executor: Optional[CPUExecutor] = None
+    ):
         """
         初始化消息处理器
         
-        :param client: Pyrogram 客户端
+        :param client: Pyrogram 客户端或多会话客户端池
         :param media_processor: 媒体处理器
+        :param post_store: 持久化帖子存储，处理结果写入其中
+        :param rate_limiter: 单个客户端时使用的请求限速器（客户端池中每个客户端自带限速器）
+        :param name: 任务名称，多个频道同时导出时作为日志前缀
+        :param executor: 批次转换使用的执行层，为空时在事件循环中直接转换
         """
-        self.client = client
+        if isinstance(client, ClientPool):
+            self.pool = client
+        else:
+            self.pool = ClientPool([client], limiters=[rate_limiter or TokenBucket()])
         self.media_processor = media_processor
-        self.processed_ids_file = "processed_ids.json"
+        self.name = name
+        self.executor = executor or CPUExecutor()
+        # 当前运行的进度，供调度器汇报
+        self.progress = {"posts": 0, "messages": 0, "failed": 0, "current_id": 0, "end_id": None}
+        self.post_store = post_store
+        self.checkpoint_file = "processed_ids.ckpt"
+        self.legacy_processed_ids_file = "processed_ids.json"
+        self.legacy_posts_file = "posts.json"
     
     async def process_messages(
         self, 
         channel_id: int,
         start_id: int,
-        end_id: int,
+        end_id: Union[int, str],
         batch_size: int = 50,
-        output_path: str = "./output"
-    ) -> List[Dict[str, Any]]:
+        output_path: str = "./output",
+        concurrency: int = 3,
+        max_retries: int = 5,
+        queue_size: int = 8
+    ) -> int:
         """
-        处理消息并生成包含永久链接的数据结构
+        以流水线方式处理消息并写入帖子存储
+        
+        获取 → 转换 → 媒体组合并 → 写入 四个阶段并发运行，阶段之间用有界队列连接，
+        内存占用只取决于队列长度和并发数，与频道大小无关。
+        
+        每个批次获取后立即转换并记入帖子存储中的批次日志（已获取），其所有消息写入帖子存储时
+        在同一事务中标记为已写入，之后才记录检查点；生成输出后从日志中删除（已发布）。
+        中途崩溃时，下次运行按ID顺序重放已获取的批次、为已写入的批次补记检查点，不重复获取也不丢失帖子。
         
         :param channel_id: 频道ID
         :param start_id: 起始消息ID
-        :param end_id: 结束消息ID
+        :param end_id: 结束消息ID，"auto" 表示处理到频道最新消息；指定的值超过最新消息ID时收紧到最新消息ID
         :param batch_size: 批处理大小
         :param output_path: 输出路径
-        :return: 处理后的消息列表
+        :param concurrency: 每个客户端并发获取的批次数
+        :param max_retries: 批次失败后的最大重试次数
+        :param queue_size: 阶段之间队列的最大长度
+        :return: 本次写入的帖子数
         """
         output_dir = Path(output_path)
         output_dir.mkdir(parents=True, exist_ok=True)
+        # ID窗口分摊到池中所有能访问该频道的客户端
+        clients = len(self.pool.available(channel_id))
+        concurrency = max(1, concurrency) * clients
         
-        processed_ids = self._load_processed_ids(output_dir)
-        messages_data = []
-        current_id = start_id
+        # 探测到的最新消息ID一定存在，不超过它而返回空的ID都是已删除的消息，不会再出现，可以直接记入检查点；
+        # 指定的 end_id 也收紧到最新消息ID，不再每次运行都扫描一遍尚未使用的ID
+        latest_id = await self.discover_latest_id(channel_id)
+        settle_empty = latest_id is not None
+        if end_id == "auto":
+            if latest_id is None:
+                self._log("无法探测频道的最新消息ID", logging.ERROR)
+                return 0
+            end_id = latest_id
+            self._log(f"探测到频道最新消息ID: {end_id}")
+        elif latest_id is None:
+            self._log(f"无法探测频道的最新消息ID，按指定范围处理到 {end_id}", logging.WARNING)
+        elif latest_id < end_id:
+            self._log(f"频道最新消息ID为 {latest_id}，结束消息ID从 {end_id} 收紧到 {latest_id}")
+            end_id = latest_id
         
-        print(f"开始处理消息，范围: {start_id} - {end_id}")
+        processed_ids = self._open_checkpoint(output_dir)
+        backfill = processed_ids.backfill
+        if backfill:
+            self._import_legacy_posts(output_dir, backfill)
+        if backfill and (backfill[0] < start_id or backfill[-1] > end_id):
+            # 旧版导出过的消息不在帖子存储中，范围扩大到覆盖它们，否则输出会丢失这些帖子
+            start_id, end_id = min(start_id, backfill[0]), max(end_id, backfill[-1])
+            self._log(f"为补回旧版导出的 {len(backfill)} 条消息，处理范围扩大到 {start_id} - {end_id}")
+        replay = deque(self._recover_journal(processed_ids, start_id, end_id))
+        started = time.perf_counter()
+        stats = self.progress
+        stats.update(posts=0, messages=0, failed=0, current_id=start_id, end_id=end_id)
+        # 连续返回空窗口时逐步放大窗口，跨过大段已删除的ID
+        window = {"size": batch_size}
         
-        while current_id <= end_id:
-            # 生成批次ID列表
-            batch_ids = [
-                i for i in range(current_id, min(current_id + batch_size, end_id + 1))
-                if i not in processed_ids
-            ]
-            
-            if not batch_ids:
-                print(f"批次 {current_id}-{min(current_id + batch_size - 1, end_id)} 已全部处理，跳过")
-                current_id += batch_size
-                continue
+        window_queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+        fetched_queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+        message_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        post_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        # 限制已派发但尚未按序交给转换阶段的窗口数，从而限制乱序缓冲区的大小
+        in_flight = asyncio.Semaphore(concurrency * 4)
+        
+        self._log(f"开始处理消息，范围: {start_id} - {end_id}，客户端数: {clients}，并发数: {concurrency}")
+        
+        async def fetch_stage():
+            async def work():
+                while True:
+                    seq, batch_ids = await window_queue.get()
+                    try:
+                        with metrics.timer("fetch_batch_seconds", job=self.name):
+                            messages = await self._fetch_batch(channel_id, batch_ids, max_retries)
+                        if messages is None:
+                            await fetched_queue.put((seq, batch_ids, None, [], None))
+                            continue
+                        
+                        if any(not self._is_empty(msg) for msg in messages):
+                            window["size"] = batch_size
+                        else:
+                            window["size"] = min(window["size"] * 2, max(batch_size, self.MAX_IDS_PER_REQUEST))
+                        message_dicts, serialized = await self._transform_batch(messages)
+                        valid_ids = {msg['id'] for msg in message_dicts}
+                        empty_ids = [i for i in batch_ids if i not in valid_ids] if settle_empty else []
+                        # 转换完成后立即记入日志，之后崩溃也不需要重新获取
+                        journal_id = self.post_store.journal_fetched(batch_ids, serialized, empty_ids, sorted(valid_ids))
+                        await fetched_queue.put((seq, batch_ids, message_dicts, empty_ids, journal_id))
+                    except Exception as e:
+                        # 转换或记录日志出错时只放弃这个批次（不记入检查点，下次运行重新获取），转换阶段照常按顺序跳过它
+                        self._log(f"转换批次 {batch_ids[0]}-{batch_ids[-1]} 失败: {e}", logging.ERROR)
+                        await fetched_queue.put((seq, batch_ids, None, [], None))
+                    finally:
+                        window_queue.task_done()
             
+            workers = [asyncio.create_task(work()) for _ in range(max(1, concurrency))]
             try:
-                # 获取消息
-                print(f"获取消息批次: {batch_ids[0]}-{batch_ids[-1]}")
-                messages = await self.client.get_messages(channel_id, ids=batch_ids)
+                seq = 0
+                current_id = processed_ids.next_unprocessed(start_id)
+                if current_id > start_id:
+                    self._log(f"跳过已处理的消息 {start_id}-{current_id - 1}")
+                
+                while current_id <= end_id:
+                    if replay and replay[0]['first_id'] <= current_id:
+                        # 日志中已获取的批次按原来的位置直接交给转换阶段
+                        entry = replay.popleft()
+                        await in_flight.acquire()
+                        await fetched_queue.put(
+                            (seq, entry['message_ids'], entry['messages'], entry['empty_ids'], entry['id'])
+                        )
+                        seq += 1
+                        current_id = processed_ids.next_unprocessed(entry['last_id'] + 1)
+                        continue
+                    
+                    # 生成批次ID列表，不跨过下一个待重放的批次
+                    stop_id = min(current_id + window["size"], end_id + 1)
+                    if replay:
+                        stop_id = min(stop_id, replay[0]['first_id'])
+                    batch_ids = [i for i in range(current_id, stop_id) if i not in processed_ids]
+                    
+                    if batch_ids:
+                        await in_flight.acquire()
+                        await window_queue.put((seq, batch_ids))
+                        seq += 1
+                    
+                    current_id = processed_ids.next_unprocessed(stop_id)
                 
-                # 处理消息
-                for msg in messages:
-                    if msg is not None:
-                        processed_msg = await self._process_single_message(msg)
-                        if processed_msg:
-                            messages_data.append(processed_msg)
-                            processed_ids.add(msg.id)
+                await window_queue.join()
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+            await fetched_queue.put(_END)
+        
+        async def transform_stage():
+            # 并发获取的批次可能乱序完成，这里按派发顺序重新排列
+            pending = {}
+            next_seq = 0
+            while True:
+                item = await fetched_queue.get()
+                if item is _END:
+                    break
                 
-                # 保存处理记录
-                valid_ids = [msg.id for msg in messages if msg is not None]
-                self._save_processed_ids(valid_ids, output_dir)
+                seq, *batch = item
+                pending[seq] = batch
+                while next_seq in pending:
+                    batch_ids, message_dicts, empty_ids, journal_id = pending.pop(next_seq)
+                    next_seq += 1
+                    in_flight.release()
+                    
+                    if message_dicts is None:
+                        stats["failed"] += 1
+                        metrics.inc("failed_batches", job=self.name)
+                        continue
+                    
+                    metrics.inc("messages", len(message_dicts), job=self.name)
+                    metrics.inc("deleted_ids", len(batch_ids) - len(message_dicts), job=self.name)
+                    stats["messages"] += len(message_dicts)
+                    stats["current_id"] = batch_ids[-1]
+                    self._log(f"已处理消息批次: {batch_ids[0]}-{batch_ids[-1]}, 有效消息: {len(message_dicts)}", logging.DEBUG)
+                    await message_queue.put((message_dicts, empty_ids, journal_id, batch_ids[-1]))
+            
+            await message_queue.put(_END)
+        
+        async def group_stage():
+            # 媒体组成员的ID是连续的，出现不属于当前组的后续消息时即可关闭该组
+            open_group: List[Dict[str, Any]] = []
+            # 还有消息留在未关闭媒体组中的批次：(日志条目ID, 批次最后一个ID)
+            open_batches: List[Tuple[int, int]] = []
+            while True:
+                item = await message_queue.get()
+                if item is _END:
+                    break
                 
-                print(f"已处理消息批次: {batch_ids[0]}-{batch_ids[-1]}, 有效消息: {len(valid_ids)}")
+                message_dicts, empty_ids, journal_id, last_id = item
+                open_batches.append((journal_id, last_id))
+                posts = []
+                stale_ids = []
+                with metrics.timer("group_batch_seconds", job=self.name):
+                    for msg in message_dicts:
+                        media_group_id = msg.get('media_group_id')
+                        if open_group and media_group_id != open_group[0]['media_group_id']:
+                            posts.append(await self._close_media_group(channel_id, open_group, stale_ids))
+                            open_group = []
+                        
+                        if media_group_id:
+                            open_group.append(msg)
+                        else:
+                            posts.append((msg, [msg['id']]))
+                
+                # 批次的消息都已成为帖子（不在未关闭的媒体组中）时，随这些帖子一起标记为已写入
+                boundary = open_group[0]['id'] if open_group else None
+                done = [entry for entry in open_batches if boundary is None or entry[1] < boundary]
+                open_batches = open_batches[len(done):]
+                await post_queue.put((posts, empty_ids, stale_ids, [journal_id for journal_id, _ in done]))
+            
+            if open_group:
+                stale_ids = []
+                post = await self._close_media_group(channel_id, open_group, stale_ids)
+                await post_queue.put(([post], [], stale_ids, [journal_id for journal_id, _ in open_batches]))
+            await post_queue.put(_END)
+        
+        async def write_stage():
+            # 最近帖子的回复预览，用于解析本次运行内的回复关系
+            recent_previews: "OrderedDict[int, Optional[Dict[str, Any]]]" = OrderedDict()
+            while True:
+                item = await post_queue.get()
+                if item is _END:
+                    break
                 
+                posts, empty_ids, stale_ids, journal_ids = item
+                settled_ids = list(empty_ids)
+                for _, member_ids in posts:
+                    settled_ids.extend(member_ids)
+                
+                # 先写入帖子存储（同时更新批次日志），再记录检查点，保证记录过的ID一定已经落盘
+                try:
+                    await self._resolve_replies(channel_id, posts, recent_previews, max_retries)
+                    with metrics.timer("store_write_seconds", job=self.name):
+                        stats["posts"] += self.post_store.write_batch(
+                            [post for post, _ in posts],
+                            {post['id']: member_ids for post, member_ids in posts},
+                            stale_ids,
+                            journal_ids
+                        )
+                except Exception as e:
+                    # 只放弃这组帖子：不记入检查点，批次日志条目保持已获取状态，下次运行重放
+                    stats["failed"] += 1
+                    metrics.inc("failed_batches", job=self.name)
+                    self._log(f"写入 {len(posts)} 条帖子失败: {e}", logging.ERROR)
+                    continue
+                metrics.inc("posts_written", len(posts), job=self.name)
+                with metrics.timer("checkpoint_write_seconds", job=self.name):
+                    processed_ids.add_many(settled_ids)
+        
+        stages = [asyncio.create_task(stage()) for stage in (fetch_stage, transform_stage, group_stage, write_stage)]
+        try:
+            await asyncio.gather(*stages)
+        finally:
+            # 某个阶段出错时取消其余阶段，避免它们阻塞在队列上或继续请求 Telegram
+            for stage in stages:
+                stage.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+            processed_ids.close()
+        
+        if stats["failed"]:
+            self._log(f"有 {stats['failed']} 个批次获取或处理失败，将在下次运行时重新处理", logging.WARNING)
+        
+        elapsed = time.perf_counter() - started
+        metrics.set("process_seconds", elapsed, job=self.name)
+        metrics.set("messages_per_second", stats["messages"] / elapsed if elapsed else 0.0, job=self.name)
+        self._log(f"处理完成，共 {stats['messages']} 条消息，写入 {stats['posts']} 条帖子")
+        return stats["posts"]
+    
+    async def ingest_messages(
+        self,
+        channel_id: int,
+        messages: List[Message],
+        checkpoint: CheckpointStore
+    ) -> int:
+        """
+        处理实时更新收到的新消息和编辑后的消息，写入帖子存储
+        
+        媒体组的成员会分散在多次更新中到达，这里总是重新获取完整的媒体组再合并，
+        合并后的帖子ID与之前写入的不同时删除旧帖子。
+        
+        :param channel_id: 频道ID
+        :param messages: 消息（同一ID只保留最新版本）
+        :param checkpoint: 已处理消息ID的检查点
+        :return: 写入的帖子数
+        """
+        singles = []
+        groups: Dict[str, Message] = {}
+        for msg in sorted(messages, key=lambda m: m.id):
+            if self._is_empty(msg):
+                continue
+            if getattr(msg, 'media_group_id', None):
+                groups.setdefault(msg.media_group_id, msg)
+            else:
+                singles.append(msg)
+        
+        posts = []
+        for msg in singles:
+            message_data = await self._process_single_message(msg)
+            posts.append((message_data, [message_data['id']]))
+        
+        stale_ids = []
+        for media_group_id, msg in groups.items():
+            try:
+                members = await self.pool.get_media_group(channel_id, msg.id)
             except Exception as e:
-                print(f"处理批次 {batch_ids} 时出错: {e}")
+                self._log(f"获取媒体组 {media_group_id} 失败，只合并已收到的消息: {e}", logging.WARNING)
+                members = [m for m in messages if getattr(m, 'media_group_id', None) == media_group_id]
+            
+            group = [await self._process_single_message(m) for m in sorted(members, key=lambda m: m.id)]
+            post, member_ids = self._merge_media_group(group)
+            previous = self.post_store.find_by_media_group(media_group_id)
+            if previous and previous['id'] != post['id']:
+                stale_ids.append(previous['id'])
+            posts.append((post, member_ids))
+        
+        await self._resolve_replies(channel_id, posts, OrderedDict())
+        
+        if stale_ids:
+            self.post_store.delete_posts(stale_ids)
+        if posts:
+            self.post_store.upsert_posts(
+                (post for post, _ in posts),
+                {post['id']: member_ids for post, member_ids in posts}
+            )
+        checkpoint.add_many(member_id for _, member_ids in posts for member_id in member_ids)
+        return len(posts)
+    
+    async def reconcile(self, channel_id: int, days: float, max_retries: int = 5) -> Dict[str, int]:
+        """
+        对账：重新获取最近 days 天内发布的帖子，按内容哈希只重写有变化的帖子，删除已被删除的帖子
+        
+        同一帖子的成员消息放在同一个请求中，每个请求尽量装满 MAX_IDS_PER_REQUEST 个ID，
+        开销只与窗口内的帖子数有关，不随归档增长。
+        
+        :param channel_id: 频道ID
+        :param days: 对账窗口（天）
+        :param max_retries: 批次失败后的最大重试次数
+        :return: 统计（checked、changed、deleted、failed）
+        """
+        since = (datetime.now() - timedelta(days=days)).isoformat(timespec='seconds')
+        rows = self.post_store.posts_since(since)
+        stats = {"checked": 0, "changed": 0, "deleted": 0, "failed": 0}
+        self._log(f"开始对账最近 {days} 天内的 {len(rows)} 条帖子")
+        
+        batches: List[List[Tuple[int, Optional[str], List[int]]]] = []
+        batch, batch_ids = [], 0
+        for row in rows:
+            if batch and batch_ids + len(row[2]) > self.MAX_IDS_PER_REQUEST:
+                batches.append(batch)
+                batch, batch_ids = [], 0
+            batch.append(row)
+            batch_ids += len(row[2])
+        if batch:
+            batches.append(batch)
+        
+        # 窗口内帖子的最新预览，回复窗口内被编辑的帖子时使用新内容
+        previews: "OrderedDict[int, Optional[Dict[str, Any]]]" = OrderedDict()
+        for batch in batches:
+            ids = [message_id for _, _, member_ids in batch for message_id in member_ids]
+            messages = await self._fetch_batch(channel_id, ids, max_retries)
+            if messages is None:
+                stats["failed"] += len(batch)
+                continue
+            
+            by_id = {msg.id: msg for msg in messages if not self._is_empty(msg)}
+            rebuilt, changed, members, removed = [], [], {}, []
+            for post_id, old_hash, member_ids in batch:
+                stats["checked"] += 1
+                current = [by_id[message_id] for message_id in member_ids if message_id in by_id]
+                if not current:
+                    removed.append(post_id)
+                    stats["deleted"] += 1
+                    continue
+                
+                media_group_id = getattr(current[0], 'media_group_id', None)
+                if media_group_id and len(member_ids) == 1:
+                    # 旧数据没有记录媒体组成员，重新获取完整的组
+                    try:
+                        current = await self.pool.get_media_group(channel_id, current[0].id)
+                    except Exception as e:
+                        self._log(f"获取媒体组 {media_group_id} 失败，只对账已知的消息: {e}", logging.WARNING)
+                
+                group = [await self._process_single_message(msg) for msg in current]
+                if media_group_id:
+                    post, new_member_ids = self._merge_media_group(group)
+                else:
+                    post, new_member_ids = group[0], [group[0]['id']]
+                rebuilt.append((post_id, old_hash, post, new_member_ids))
+            
+            await self._resolve_replies(
+                channel_id,
+                [(post, new_member_ids) for _, _, post, new_member_ids in rebuilt],
+                previews,
+                max_retries
+            )
+            for post_id, old_hash, post, new_member_ids in rebuilt:
+                if post['id'] != post_id:
+                    # 媒体组的主消息变了，旧帖子由新帖子取代
+                    removed.append(post_id)
+                elif content_hash(post) == old_hash:
+                    continue
+                changed.append(post)
+                members[post['id']] = new_member_ids
             
-            current_id += batch_size
-            await asyncio.sleep(1)  # 避免频率限制
+            if removed:
+                self.post_store.delete_posts(removed)
+            if changed:
+                self.post_store.upsert_posts(changed, members)
+                stats["changed"] += len(changed)
         
-        # 按ID排序
-        messages_data.sort(key=lambda x: x['id'])
+        self._log(f"对账完成，检查 {stats['checked']} 条帖子，更新 {stats['changed']} 条，删除 {stats['deleted']} 条"
+                  + (f"，{stats['failed']} 条获取失败" if stats["failed"] else ""))
+        return stats
+    
+    async def discover_latest_id(self, channel_id: int) -> Optional[int]:
+        """
+        探测频道的最新消息ID
         
-        # 处理消息分组和回复关系
-        messages_data = self._group_messages(messages_data)
+        优先读取聊天记录中的最新一条；不可用时在ID空间上做指数 + 二分搜索。
+        
+        :param channel_id: 频道ID
+        :return: 最新消息ID，频道为空时返回 None
+        """
+        try:
+            async for msg in self.pool.get_chat_history(channel_id, limit=1):
+                return msg.id
+            return None
+        except Exception as e:
+            self._log(f"读取最新消息失败，改用ID搜索: {e}", logging.WARNING)
         
-        print(f"处理完成，共 {len(messages_data)} 条消息")
-        return messages_data
+        return await self._search_latest_id(channel_id)
+    
+    async def _search_latest_id(self, channel_id: int) -> Optional[int]:
+        """
+        以窗口为单位在ID空间上搜索最新消息ID
+        
+        每次探测请求一个 MAX_IDS_PER_REQUEST 大小的窗口，窗口内有任意存在的消息即视为命中，
+        因此连续删除不超过一个窗口的空洞不会影响结果。
+        """
+        span = self.MAX_IDS_PER_REQUEST
+        
+        async def probe(first_id: int) -> Optional[int]:
+            ids = list(range(first_id, first_id + span))
+            messages = await self._fetch_batch(channel_id, ids, max_retries=3) or []
+            valid_ids = [msg.id for msg in messages if not self._is_empty(msg)]
+            return max(valid_ids) if valid_ids else None
+        
+        latest = await probe(1)
+        if latest is None:
+            return None
+        
+        # 指数扩张找到上界
+        low, high = 1, span
+        while True:
+            found = await probe(high)
+            if found is None:
+                break
+            latest = max(latest, found)
+            low, high = high, high * 2
+        
+        # 二分收缩到最后一个非空窗口
+        while high - low > span:
+            middle = (low + high) // 2
+            found = await probe(middle)
+            if found is None:
+                high = middle
+            else:
+                latest = max(latest, found)
+                low = middle
+        
+        return latest
+    
+    def _log(self, text: str, level: int = logging.INFO):
+        """输出日志，带任务名称前缀"""
+        logger.log(level, f"[{self.name}] {text}" if self.name else text)
+    
+    @staticmethod
+    def _is_empty(msg: Optional[Message]) -> bool:
+        """消息不存在或已被删除"""
+        return msg is None or getattr(msg, 'empty', False)
+    
+    async def _fetch_batch(self, channel_id: int, batch_ids: List[int], max_retries: int) -> Optional[List[Message]]:
+        """
+        通过客户端池获取一个批次，FloodWait 由客户端池换客户端重试，其他错误指数退避重试
+        
+        :return: 消息列表，重试耗尽时返回 None
+        """
+        attempt = 0
+        while True:
+            try:
+                return await self.pool.get_messages(channel_id, batch_ids)
+            except Exception as e:
+                attempt += 1
+                if attempt > max_retries:
+                    self._log(f"获取批次 {batch_ids[0]}-{batch_ids[-1]} 失败，已重试 {max_retries} 次: {e}", logging.ERROR)
+                    return None
+                delay = min(2 ** attempt, 60)
+                metrics.inc("fetch_retries", job=self.name)
+                self._log(f"获取批次 {batch_ids[0]}-{batch_ids[-1]} 出错: {e}，{delay} 秒后第 {attempt} 次重试", logging.WARNING)
+                await asyncio.sleep(delay)
+    
+    async def _transform_batch(self, messages: List[Message]) -> Tuple[List[Dict[str, Any]], str]:
+        """
+        把一个批次中存在的消息转换为消息字典
+        
+        事件循环上只提取消息字段和查询媒体缓存，永久链接计算和 JSON 序列化由 transform_batch 完成，
+        配置了进程池时在子进程中执行，事件循环同时继续获取其他批次。
+        
+        :return: (消息字典, 写入批次日志的 JSON)
+        """
+        with metrics.timer("transform_batch_seconds", job=self.name):
+            fields = [self._message_fields(msg) for msg in messages if not self._is_empty(msg)]
+            message_dicts, serialized, resolved = await self.executor.run(
+                transform_batch, fields, self.media_processor.domain_prefix
+            )
+            self.media_processor.remember(resolved)
+        return message_dicts, serialized
     
     async def _process_single_message(self, msg: Message) -> Dict[str, Any]:
         """处理单条消息"""
+        message_data = self._message_fields(msg)
+        self.media_processor.remember(transform_message(message_data, self.media_processor.domain_prefix))
+        return message_data
+    
+    def _message_fields(self, msg: Message) -> Dict[str, Any]:
+        """提取消息字段，媒体只识别并查询缓存（见 transform_message）"""
         # 基础消息信息
         message_data = {
             "id": msg.id,
@@ -128,88 +648,217 @@ class MessageProcessor:
             }
         
         # 处理媒体文件
-        media_info = self.media_processor.process_media(msg, self.client)
-        if media_info:
-            message_data["media"] = media_info
+        media_fields = self.media_processor.describe_media(msg, self.pool)
+        if media_fields:
+            message_data["media"] = media_fields
         
         return message_data
     
-    def _group_messages(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """处理消息分组和回复关系"""
-        # 创建ID映射
-        id_map = {msg['id']: msg for msg in messages}
+    def _merge_media_group(self, group_msgs: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], List[int]]:
+        """
+        合并同一媒体组的消息
         
-        # 处理媒体组
-        grouped_messages = {}
-        result = []
+        :return: (合并后的帖子, 成员消息ID列表)
+        """
+        # 选择主消息（有文本的第一条，或第一条）
+        main_msg = None
+        for msg in group_msgs:
+            if msg.get('text'):
+                main_msg = msg
+                break
+        if not main_msg:
+            main_msg = group_msgs[0]
         
-        for msg in messages:
-            media_group_id = msg.get('media_group_id')
-            
-            if media_group_id:
-                if media_group_id not in grouped_messages:
-                    grouped_messages[media_group_id] = []
-                grouped_messages[media_group_id].append(msg)
+        # 收集所有媒体
+        all_media = []
+        for msg in group_msgs:
+            if msg.get('media'):
+                all_media.append(msg['media'])
+        
+        # 设置媒体列表
+        if all_media:
+            if all_media[0]['media_type'] == 'photo':
+                main_msg['images'] = all_media
             else:
-                result.append(msg)
-        
-        # 合并媒体组
-        for group_id, group_msgs in grouped_messages.items():
-            # 选择主消息（有文本的第一条，或第一条）
-            main_msg = None
-            for msg in group_msgs:
-                if msg.get('text'):
-                    main_msg = msg
-                    break
-            if not main_msg:
-                main_msg = group_msgs[0]
+                main_msg['files'] = all_media
             
-            # 收集所有媒体
-            all_media = []
-            for msg in group_msgs:
-                if msg.get('media'):
-                    all_media.append(msg['media'])
-            
-            # 设置媒体列表
-            if all_media:
-                if all_media[0]['media_type'] == 'photo':
-                    main_msg['images'] = all_media
+            # 移除单个媒体字段
+            main_msg.pop('media', None)
+        
+        return main_msg, [msg['id'] for msg in group_msgs]
+    
+    def _reply_preview(self, post: Dict[str, Any]) -> Dict[str, Any]:
+        """生成被回复帖子的预览"""
+        text = post.get('text', '')
+        return {
+            'id': post['id'],
+            'text': text[:100] + '...' if len(text) > 100 else text,
+            'thumb': None  # 可以添加缩略图逻辑
+        }
+    
+    async def _resolve_replies(
+        self,
+        channel_id: int,
+        posts: List[Tuple[Dict[str, Any], List[int]]],
+        previews: "OrderedDict[int, Optional[Dict[str, Any]]]",
+        max_retries: int = 5
+    ):
+        """
+        填充回复预览，并把这些帖子的预览加入 previews
+        
+        先查 previews（本次运行最近的帖子），再按消息ID查帖子存储；都找不到的被回复消息
+        （早于导出范围、或在尚未导出的区间中）合并成一次批量请求获取。
+        已删除的消息在 previews 中记为 None，之后不再重复请求。
+        
+        :param channel_id: 频道ID
+        :param posts: [(帖子, 成员消息ID列表)]，按ID升序
+        :param previews: 消息ID → 预览，会被更新并裁剪到 REPLY_CACHE_SIZE
+        :param max_retries: 批次失败后的最大重试次数
+        """
+        unresolved = []
+        for post, member_ids in posts:
+            reply_id = post.pop('reply_to_message_id', None)
+            if reply_id:
+                if reply_id in previews:
+                    preview = previews[reply_id]
                 else:
-                    main_msg['files'] = all_media
-                
-                # 移除单个媒体字段
-                main_msg.pop('media', None)
-            
-            result.append(main_msg)
-        
-        # 处理回复关系
-        for msg in result:
-            reply_id = msg.get('reply_to_message_id')
-            if reply_id and reply_id in id_map:
-                reply_msg = id_map[reply_id]
-                msg['reply'] = {
-                    'id': reply_msg['id'],
-                    'text': reply_msg.get('text', '')[:100] + '...' if len(reply_msg.get('text', '')) > 100 else reply_msg.get('text', ''),
-                    'thumb': None  # 可以添加缩略图逻辑
-                }
+                    reply_post = self.post_store.get_post_by_message(reply_id)
+                    preview = self._reply_preview(reply_post) if reply_post else None
+                    if reply_post is None:
+                        unresolved.append((post, reply_id))
+                if preview is not None:
+                    post['reply'] = preview
             
-            # 清理空字段
-            msg.pop('reply_to_message_id', None)
+            preview = self._reply_preview(post)
+            for member_id in member_ids:
+                previews[member_id] = preview
+        
+        missing = sorted({reply_id for _, reply_id in unresolved})
+        for i in range(0, len(missing), self.MAX_IDS_PER_REQUEST):
+            ids = missing[i:i + self.MAX_IDS_PER_REQUEST]
+            messages = await self._fetch_batch(channel_id, ids, max_retries)
+            if messages is None:
+                # 获取失败时不记为已删除，下次遇到时再试
+                continue
+            found = {msg.id: msg for msg in messages if not self._is_empty(msg)}
+            for reply_id in ids:
+                msg = found.get(reply_id)
+                if msg is None:
+                    previews[reply_id] = None
+                    continue
+                group = [msg]
+                if getattr(msg, 'media_group_id', None):
+                    # 回复的是媒体组成员时，预览与完整导出时一样取合并后的帖子
+                    try:
+                        group = sorted(await self.pool.get_media_group(channel_id, msg.id), key=lambda m: m.id)
+                    except Exception as e:
+                        self._log(f"获取媒体组 {msg.media_group_id} 失败，回复预览只使用被回复的消息: {e}", logging.WARNING)
+                post, _ = self._merge_media_group([{'id': m.id, 'text': m.text or m.caption or ""} for m in group])
+                previews[reply_id] = self._reply_preview(post)
         
-        return sorted(result, key=lambda x: x['id'])
+        for post, reply_id in unresolved:
+            if previews.get(reply_id) is not None:
+                post['reply'] = previews[reply_id]
+        
+        while len(previews) > self.REPLY_CACHE_SIZE:
+            previews.popitem(last=False)
     
-    def _load_processed_ids(self, output_dir: Path) -> Set[int]:
-        """加载已处理的消息ID"""
-        processed_file = output_dir / self.processed_ids_file
+    async def _close_media_group(
+        self,
+        channel_id: int,
+        group: List[Dict[str, Any]],
+        stale_ids: List[int]
+    ) -> Tuple[Dict[str, Any], List[int]]:
+        """
+        合并一个媒体组
+        
+        同一组的部分成员已经在之前的运行中写入（组跨越了运行边界，或之前某个批次获取失败）时，
+        重新获取完整的组再合并；合并后的帖子ID与已写入的不同时，把旧帖子ID加入 stale_ids。
+        
+        :param channel_id: 频道ID
+        :param group: 本次获取到的组成员，按ID升序
+        :param stale_ids: 需要删除的旧帖子ID
+        :return: (合并后的帖子, 成员消息ID列表)
+        """
+        media_group_id = group[0]['media_group_id']
+        existing = self.post_store.media_group_members(media_group_id)
+        if existing and not set(existing[1]) <= {msg['id'] for msg in group}:
+            try:
+                members = await self.pool.get_media_group(channel_id, group[0]['id'])
+                group = [await self._process_single_message(m) for m in sorted(members, key=lambda m: m.id)]
+            except Exception as e:
+                self._log(f"获取媒体组 {media_group_id} 失败，只合并本次获取的消息: {e}", logging.WARNING)
+                return self._merge_media_group(group)
+        
+        post, member_ids = self._merge_media_group(group)
+        if existing and existing[0] != post['id']:
+            stale_ids.append(existing[0])
+        return post, member_ids
+    
+    def _recover_journal(
+        self,
+        processed_ids: CheckpointStore,
+        start_id: int,
+        end_id: int
+    ) -> List[Dict[str, Any]]:
+        """
+        从批次日志恢复上次中断的运行
+
+        已写入帖子存储但检查点还没有记录的批次补记检查点，与正常写入时一样只记录存在的消息和确认已删除的消息；
+        已获取但尚未写入的批次返回给流水线重放，其中这些ID已全部记录在检查点中（例如已由监听模式写入）的条目直接丢弃。
+        不在本次导出范围内的条目留在日志中，等覆盖它们的运行再重放。
+
+        :return: 需要重放的日志条目，按起始消息ID升序
+        """
+        replay, discarded, repaired = [], [], 0
+        for entry in self.post_store.journal_entries():
+            missing = [i for i in entry['settled_ids'] if i not in processed_ids]
+            if entry['state'] == JOURNAL_PERSISTED:
+                if missing:
+                    processed_ids.add_many(missing)
+                    repaired += 1
+            elif entry['state'] == JOURNAL_FETCHED:
+                if not missing:
+                    discarded.append(entry['id'])
+                elif start_id <= entry['first_id'] and entry['last_id'] <= end_id:
+                    replay.append(entry)
+        if discarded:
+            self.post_store.discard_journal(discarded)
+        if replay or repaired:
+            self._log(f"从批次日志恢复: 重放 {len(replay)} 个已获取的批次，为 {repaired} 个已写入的批次补记检查点")
+        metrics.inc("journal_replayed_batches", len(replay), job=self.name)
+        return replay
+    
+    def _import_legacy_posts(self, output_dir: Path, backfill: List[int]) -> int:
+        """
+        把旧版 posts.json 中还不在帖子存储里的帖子导入存储
+        
+        旧版按 file_id 生成永久ID，已发布的页面、订阅源和外部链接都指向这些文件名。导入的帖子随后
+        和其他待补回的消息一起重新获取，写入时存储把旧永久ID记为 legacy_permanent_id，旧链接仍然可以解析；
+        消息在 Telegram 中已被删除时保留导入的帖子，输出不会因升级而缺少帖子。
+        
+        :param output_dir: 输出目录
+        :param backfill: 旧版记录过、但还没有补进帖子存储的消息ID
+        :return: 导入的帖子数
+        """
         try:
-            data = load_json(processed_file)
-            return set(data) if data else set()
+            posts = load_json(output_dir / self.legacy_posts_file)
         except (FileNotFoundError, json.JSONDecodeError):
-            return set()
-    
-    def _save_processed_ids(self, new_ids: List[int], output_dir: Path):
-        """保存新处理的消息ID"""
-        processed_file = output_dir / self.processed_ids_file
-        existing_ids = self._load_processed_ids(output_dir)
-        existing_ids.update(new_ids)
-        save_json(processed_file, list(existing_ids))
+            return 0
+        if not isinstance(posts, list):
+            return 0
+        
+        wanted = set(backfill) - self.post_store.stored_message_ids(backfill)
+        legacy = [post for post in posts if isinstance(post, dict) and post.get('id') in wanted]
+        if legacy:
+            self.post_store.upsert_posts(legacy)
+            self._log(f"从旧版 {self.legacy_posts_file} 导入 {len(legacy)} 条帖子")
+        return len(legacy)
+    
+    def _open_checkpoint(self, output_dir: Path) -> CheckpointStore:
+        """打开已处理消息ID的检查点（首次运行时迁移旧的 JSON 记录，只信任已经在帖子存储中的ID）"""
+        return CheckpointStore(
+            output_dir / self.checkpoint_file,
+            legacy_json=output_dir / self.legacy_processed_ids_file,
+            stored=self.post_store.stored_message_ids
+        )
@@ -0,0 +1,236 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+from .utils import write_if_changed
+
+# 耗时直方图的桶上界（秒）
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PROMETHEUS_PREFIX = "tgblog_"
+
+LabelKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict[str, Any]) -> LabelKey:
+    # 空值标签与没有该标签等价（与 Prometheus 的语义一致）
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items() if value not in (None, "")))
+
+
+class Histogram:
+    """固定桶的直方图，同时记录数量、总和、最小值和最大值"""
+
+    __slots__ = ("buckets", "counts", "count", "sum", "min", "max")
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # 最后一个计数对应 +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "min": round(self.min, 6) if self.count else 0.0,
+            "max": round(self.max, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else 0.0,
+        }
+
+
+class _Timer:
+    __slots__ = ("metrics", "key", "start")
+
+    def __init__(self, metrics: "Metrics", key: LabelKey):
+        self.metrics = metrics
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics._observe(self.key, time.perf_counter() - self.start)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """
+    运行指标：计数器、瞬时值和直方图，均可带标签
+
+    未启用时所有记录方法立即返回，计时器也是共享的空对象，热路径上的开销只有一次属性判断。
+    运行结束时写出 JSON 运行报告，并可选写出 Prometheus textfile collector 格式的文件。
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.report_file: Optional[Path] = None
+        self.prometheus_file: Optional[Path] = None
+        self.started = time.time()
+        self.counters: Dict[LabelKey, float] = {}
+        self.gauges: Dict[LabelKey, float] = {}
+        self.histograms: Dict[LabelKey, Histogram] = {}
+        # 生成输出在线程中运行，与事件循环同时记录
+        self._lock = threading.Lock()
+
+    def configure(self, enabled: bool, report_file: Union[str, Path, None] = None,
+                  prometheus_file: Union[str, Path, None] = None):
+        """
+        启用或关闭指标收集
+
+        :param enabled: 是否收集
+        :param report_file: JSON 运行报告路径
+        :param prometheus_file: Prometheus 文本格式文件路径
+        """
+        self.enabled = enabled
+        self.report_file = Path(report_file) if report_file else None
+        self.prometheus_file = Path(prometheus_file) if prometheus_file else None
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.counters.clear()
+        self.gauges.clear()
+        self.histograms.clear()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """计数器累加"""
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        """设置瞬时值"""
+        if not self.enabled:
+            return
+        self.gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        """向直方图记录一个观测值"""
+        if not self.enabled:
+            return
+        self._observe(_key(name, labels), value)
+
+    def timer(self, name: str, **labels):
+        """
+        计时上下文，退出时把耗时（秒）记入直方图
+
+        用法: with metrics.timer("group_seconds", job="news"): ...
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, _key(name, labels))
+
+    def _observe(self, key: LabelKey, value: float):
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def report(self, extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        汇总为 JSON 运行报告
+
+        :param extra: 附加到报告中的内容（如各任务的结果）
+        """
+        def flatten(items, convert=lambda v: v):
+            result: Dict[str, Any] = {}
+            for (name, labels), value in sorted(items.items()):
+                label = ",".join(f"{key}={value}" for key, value in labels)
+                result.setdefault(name, {})[label or "total"] = convert(value)
+            return result
+
+        report = {
+            "started": self.started,
+            "seconds": round(time.time() - self.started, 3),
+            "counters": flatten(self.counters),
+            "gauges": flatten(self.gauges),
+            "histograms": flatten(self.histograms, Histogram.to_dict),
+        }
+        if extra:
+            report.update(extra)
+        return report
+
+    def prometheus(self) -> str:
+        """以 Prometheus 文本格式输出全部指标"""
+        lines = []
+
+        def series(name: str, labels: Tuple[Tuple[str, str], ...], value: float, suffix: str = "", extra=()):
+            pairs = [*labels, *extra]
+            label_text = "{" + ",".join(f'{key}="{_escape(val)}"' for key, val in pairs) + "}" if pairs else ""
+            lines.append(f"{PROMETHEUS_PREFIX}{name}{suffix}{label_text} {_format(value)}")
+
+        for kind, items in (("counter", self.counters), ("gauge", self.gauges)):
+            declared = set()
+            for (name, labels), value in sorted(items.items()):
+                if name not in declared:
+                    declared.add(name)
+                    lines.append(f"# TYPE {PROMETHEUS_PREFIX}{name} {kind}")
+                series(name, labels, value)
+
+        declared = set()
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {PROMETHEUS_PREFIX}{name} histogram")
+            cumulative = 0
+            for bound, count in zip((*histogram.buckets, float('inf')), histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float('inf') else f"{bound:g}"
+                series(name, labels, cumulative, "_bucket", (("le", le),))
+            series(name, labels, histogram.sum, "_sum")
+            series(name, labels, histogram.count, "_count")
+        return "\n".join(lines) + "\n"
+
+    def flush(self, extra: Optional[Dict[str, Any]] = None):
+        """写出运行报告和 Prometheus 文件（已配置时）"""
+        if not self.enabled:
+            return
+        if self.report_file:
+            self.report_file.parent.mkdir(parents=True, exist_ok=True)
+            report = json.dumps(self.report(extra), ensure_ascii=False, indent=2, default=str)
+            write_if_changed(self.report_file, report)
+        if self.prometheus_file:
+            self.prometheus_file.parent.mkdir(parents=True, exist_ok=True)
+            write_if_changed(self.prometheus_file, self.prometheus())
+
+
+def _format(value: float) -> str:
+    """整数值按整数输出，避免大的计数器丢失精度"""
+    if isinstance(value, int) or (isinstance(value, float) and value.is_integer() and abs(value) < 2 ** 53):
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# 进程内共享的指标实例，默认不收集
+metrics = Metrics()
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from .blog_generator import BlogGenerator
+from .client_pool import ClientPool
+from .config import ExportConfig, RSSConfig
+from .executor import CPUExecutor
+from .media_cache import MediaCache
+from .media_mirror import MediaMirror
+from .media_processor import MediaProcessor
+from .message_processor import MessageProcessor
+from .metrics import metrics
+from .post_store import PostStore
+from .profiler import profiler
+
+logger = logging.getLogger(__name__)
+
+
+def generate_output(
+    job: ExportConfig,
+    rss_config: Optional[RSSConfig] = None,
+    full: bool = True,
+    executor: Optional[CPUExecutor] = None
+) -> Tuple[int, List[str]]:
+    """
+    在独立的数据库连接上生成任务的输出文件（可在线程中调用）
+
+    :param job: 导出任务
+    :param rss_config: 全局 RSS 配置，任务没有自己的 RSS 配置时使用
+    :param full: 是否同时生成搜索索引和 posts.json
+    :param executor: 渲染分片和订阅条目使用的进程池，为空时在当前线程中渲染
+    :return: (归档帖子总数, 实际改动的文件)
+    """
+    post_store = PostStore(Path(job.output_path) / "posts.db")
+    try:
+        generator = BlogGenerator(
+            job.output_path,
+            job.rss or rss_config,
+            shard_size=job.shard_size,
+            full_posts_json=job.full_posts_json,
+            search_index=job.search_index,
+            packed_archive=job.packed_archive,
+            executor=executor
+        )
+        store_rev = post_store.current_rev()
+        with metrics.timer("generate_seconds", job=job.label, full=full), profiler.cprofile(f"generate-{job.label}"):
+            generator.generate_all(post_store, full=full)
+        # 这个修订号之前写入的批次都已反映在输出中
+        post_store.publish_journal(store_rev)
+        return post_store.count(), generator.written
+    finally:
+        post_store.close()
+
+
+class ExportOrchestrator:
+    """
+    多频道导出调度器
+
+    所有任务共享同一个客户端池，因此也共享每个会话的限速预算；令牌桶按先来后到发放令牌，
+    同时运行的频道会交替获得请求配额。每个任务仍然有自己的输出目录、检查点、帖子存储和媒体缓存。
+    """
+
+    def __init__(
+        self,
+        client_pool: ClientPool,
+        jobs: List[ExportConfig],
+        rss_config: Optional[RSSConfig] = None,
+        parallel_jobs: int = 4,
+        progress_interval: float = 30.0,
+        reconcile: bool = False,
+        executor: Optional[CPUExecutor] = None
+    ):
+        """
+        :param client_pool: 共享的客户端池
+        :param jobs: 导出任务
+        :param rss_config: 全局 RSS 配置，任务没有自己的 RSS 配置时使用
+        :param parallel_jobs: 同时导出的频道数
+        :param progress_interval: 汇报进度的间隔（秒），0 表示不汇报
+        :param reconcile: 导出新消息后是否对账最近 reconcile_days 天内的帖子
+        :param executor: 批次转换和输出渲染使用的进程池，所有任务共享
+        """
+        self.client_pool = client_pool
+        self.jobs = jobs
+        self.rss_config = rss_config
+        self.parallel_jobs = max(1, parallel_jobs)
+        self.progress_interval = progress_interval
+        self.reconcile = reconcile
+        self.executor = executor or CPUExecutor()
+        self.processors: Dict[str, MessageProcessor] = {}
+        self.results: Dict[str, Dict[str, Any]] = {}
+
+    async def run(self) -> Dict[str, Dict[str, Any]]:
+        """
+        运行所有任务，单个任务失败不影响其他任务
+
+        :return: 任务名称 → 结果（status、written、total、files、seconds、error）
+        """
+        slots = asyncio.Semaphore(self.parallel_jobs)
+
+        async def guarded(job: ExportConfig):
+            async with slots:
+                await self._run_job(job)
+
+        reporter = asyncio.create_task(self._report_progress()) if self.progress_interval > 0 else None
+        try:
+            await asyncio.gather(*(guarded(job) for job in self.jobs))
+        finally:
+            if reporter:
+                reporter.cancel()
+                await asyncio.gather(reporter, return_exceptions=True)
+        return self.results
+
+    async def _run_job(self, job: ExportConfig):
+        """导出单个频道：抓取 → 写入帖子存储 → 生成输出"""
+        label = job.label
+        start = time.monotonic()
+        self.results[label] = {"status": "running", "written": 0, "total": 0, "output_path": job.output_path}
+        output_dir = Path(job.output_path)
+
+        try:
+            media_cache = MediaCache(
+                max_entries=job.media_cache_size,
+                path=output_dir / "media_cache.json" if job.persist_media_cache else None,
+                domain_prefix=job.domain_prefix.rstrip('/')
+            )
+            post_store = PostStore(output_dir / "posts.db")
+            processor = MessageProcessor(
+                self.client_pool, MediaProcessor(job.domain_prefix, media_cache), post_store, name=label,
+                executor=self.executor
+            )
+            self.processors[label] = processor
+
+            try:
+                written = await processor.process_messages(
+                    channel_id=job.source_channel,
+                    start_id=job.start_id,
+                    end_id=job.end_id,
+                    batch_size=job.batch_size,
+                    output_path=job.output_path,
+                    concurrency=job.concurrency,
+                    max_retries=job.max_retries
+                )
+                if self.reconcile:
+                    self.results[label]["reconcile"] = await processor.reconcile(
+                        job.source_channel, job.reconcile_days, job.max_retries
+                    )
+                if job.mirror_path:
+                    mirror = MediaMirror(
+                        self.client_pool, Path(job.mirror_path), job.domain_prefix,
+                        job.mirror_concurrency, job.max_retries, job.source_channel
+                    )
+                    self.results[label]["mirror"] = await mirror.run(post_store, label)
+            finally:
+                post_store.close()
+                media_cache.save()
+            logger.info(f"[{label}] 媒体缓存: {media_cache.stats()}")
+            metrics.inc("media_cache_hits", media_cache.hits, job=label)
+            metrics.inc("media_cache_misses", media_cache.misses, job=label)
+            metrics.set("media_cache_hit_rate", media_cache.hit_rate, job=label)
+
+            # 生成输出是同步的 CPU 密集工作，放到线程中执行，不阻塞其他频道的抓取
+            loop = asyncio.get_running_loop()
+            total, files = await loop.run_in_executor(
+                None, generate_output, job, self.rss_config, True, self.executor
+            )
+
+            self.results[label].update(status="done", written=written, total=total, files=files)
+        except Exception as e:
+            logger.error(f"[{label}] 导出失败: {e}")
+            self.results[label].update(status="failed", error=str(e))
+        finally:
+            self.results[label]["seconds"] = round(time.monotonic() - start, 1)
+            metrics.set("job_seconds", time.monotonic() - start, job=label)
+            metrics.inc("jobs", status=self.results[label]["status"])
+            self.processors.pop(label, None)
+
+    async def _report_progress(self):
+        """定期汇报各频道进度"""
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            done = sum(1 for result in self.results.values() if result["status"] != "running")
+            lines = [f"进度: {done}/{len(self.jobs)} 个频道已完成"]
+            for label, processor in list(self.processors.items()):
+                progress = processor.progress
+                end_id = progress["end_id"]
+                position = f"{progress['current_id']}/{end_id}" if isinstance(end_id, int) else "探测中"
+                lines.append(
+                    f"  [{label}] 消息ID {position}，"
+                    f"{progress['messages']} 条消息，{progress['posts']} 条帖子，{progress['failed']} 个失败批次"
+                )
+            logger.info("\n".join(lines))
@@ -0,0 +1,292 @@
+import mmap
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from .utils import AtomicWriter
+
+# 文件布局（小端序，各列按 8 字节对齐，可以直接 mmap 后按列访问）：
+#   头部      HEADER
+#   ids       int64 × count，升序，按ID随机访问时二分查找
+#   offsets   uint64 × (count + 1)，每条记录在记录区中的起止位置
+#   dates     int64 × count，发布时间（Unix 秒），没有时为 NULL_INT
+#   views     int64 × count，浏览数，没有时为 NULL_INT
+#   forwards  int64 × count，转发数，没有时为 NULL_INT
+#   dict      字符串字典：varint 个数，然后每项 varint 长度 + UTF-8
+#   records   每条帖子一条记录（带类型标记的二进制编码，重复字符串以字典序号表示）
+MAGIC = b"TGPA"
+VERSION = 1
+HEADER = struct.Struct("<4sHHII8Q")
+NULL_INT = -(2 ** 63)
+COLUMNS = ('dates', 'views', 'forwards')
+
+# 取值种类很少、在每个媒体项上重复出现的字段，值也放进字典
+CATEGORICAL_KEYS = frozenset({
+    'media_type', 'mime_type', 'file_ext', 'author', 'name', 'username',
+})
+
+# 记录中值的类型标记
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _STR, _DICT_STR, _PREFIXED_STR, _LIST, _MAP = range(10)
+_FLOAT64 = struct.Struct("<d")
+
+
+def _write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos: int) -> Tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _epoch(date: Optional[str]) -> int:
+    """ISO 时间 → Unix 秒（没有时区的按 UTC）"""
+    if not date:
+        return NULL_INT
+    parsed = datetime.fromisoformat(date)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+
+class _Encoder:
+    """把帖子编码为记录，同时累积字符串字典"""
+
+    def __init__(self):
+        self.strings: List[str] = []
+        self._index: Dict[str, int] = {}
+
+    def ref(self, text: str) -> int:
+        index = self._index.get(text)
+        if index is None:
+            index = self._index[text] = len(self.strings)
+            self.strings.append(text)
+        return index
+
+    def encode(self, value: Any, out: bytearray, categorical: bool = False):
+        if value is None:
+            out.append(_NONE)
+        elif value is True:
+            out.append(_TRUE)
+        elif value is False:
+            out.append(_FALSE)
+        elif isinstance(value, int):
+            out.append(_INT)
+            # zigzag，负数也用短的 varint 表示
+            _write_varint(out, value << 1 if value >= 0 else ((-value) << 1) - 1)
+        elif isinstance(value, float):
+            out.append(_FLOAT)
+            out += _FLOAT64.pack(value)
+        elif isinstance(value, str):
+            if categorical:
+                out.append(_DICT_STR)
+                _write_varint(out, self.ref(value))
+            elif value.startswith(("http://", "https://")) and '/' in value[8:]:
+                # 永久链接和 t.me 链接共享前缀，前缀放进字典，只内联最后一段
+                prefix, _, tail = value.rpartition('/')
+                data = tail.encode('utf-8')
+                out.append(_PREFIXED_STR)
+                _write_varint(out, self.ref(prefix))
+                _write_varint(out, len(data))
+                out += data
+            else:
+                data = value.encode('utf-8')
+                out.append(_STR)
+                _write_varint(out, len(data))
+                out += data
+        elif isinstance(value, (list, tuple)):
+            out.append(_LIST)
+            _write_varint(out, len(value))
+            for item in value:
+                self.encode(item, out)
+        elif isinstance(value, dict):
+            out.append(_MAP)
+            _write_varint(out, len(value))
+            for key, item in value.items():
+                _write_varint(out, self.ref(key))
+                self.encode(item, out, key in CATEGORICAL_KEYS)
+        else:
+            raise TypeError(f"无法编码的类型: {type(value).__name__}")
+
+
+def write_packed_archive(
+    posts: Iterable[Dict[str, Any]],
+    path: Union[str, Path],
+    previous_hash: Optional[str] = None
+) -> Tuple[str, bool]:
+    """
+    把按ID升序排列的帖子写成紧凑的二进制归档（原子写入，内容不变时不替换）
+
+    :param posts: 帖子
+    :param path: 输出路径
+    :param previous_hash: 上次写出时的内容哈希
+    :return: (内容哈希, 是否写入)
+    """
+    encoder = _Encoder()
+    ids, dates, views, forwards = array('q'), array('q'), array('q'), array('q')
+    offsets = array('Q', [0])
+    records = bytearray()
+    for post in posts:
+        ids.append(post['id'])
+        dates.append(_epoch(post.get('date')))
+        views.append(post['views'] if post.get('views') is not None else NULL_INT)
+        forwards.append(post['forwards'] if post.get('forwards') is not None else NULL_INT)
+        encoder.encode(post, records)
+        offsets.append(len(records))
+
+    dictionary = bytearray()
+    _write_varint(dictionary, len(encoder.strings))
+    for text in encoder.strings:
+        data = text.encode('utf-8')
+        _write_varint(dictionary, len(data))
+        dictionary += data
+    # 记录区从 8 字节边界开始
+    dictionary += b"\0" * (-len(dictionary) % 8)
+
+    sections = [ids, offsets, dates, views, forwards, dictionary, records]
+    positions = [HEADER.size]
+    for section in sections:
+        size = section.itemsize * len(section) if isinstance(section, array) else len(section)
+        positions.append(positions[-1] + size)
+
+    with AtomicWriter(path, previous_hash) as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(ids), 0, *positions))
+        for section in sections:
+            f.write(section.tobytes() if isinstance(section, array) else bytes(section))
+        return f.commit()
+
+
+class PackedArchive:
+    """
+    以 mmap 方式读取二进制归档
+
+    ids 和数值列直接映射为 memoryview，不需要解析；按ID读取时二分查找后只解码一条记录，
+    按ID区间扫描时只解码区间内的记录。
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, count, _, *positions = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path} 不是版本 {VERSION} 的帖子归档")
+
+        view = memoryview(self._map)
+        self.count = count
+        self.ids = view[positions[0]:positions[1]].cast('q')
+        self._offsets = view[positions[1]:positions[2]].cast('Q')
+        self._columns = {
+            name: view[positions[i]:positions[i + 1]].cast('q') for i, name in enumerate(COLUMNS, start=2)
+        }
+        self._records_start = positions[6]
+
+        strings, pos = [], positions[5]
+        total, pos = _read_varint(self._map, pos)
+        for _ in range(total):
+            length, pos = _read_varint(self._map, pos)
+            strings.append(self._map[pos:pos + length].decode('utf-8'))
+            pos += length
+        self._strings = strings
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __enter__(self) -> "PackedArchive":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """释放映射（之前返回的列视图随之失效）"""
+        for name in ('ids', '_offsets'):
+            if hasattr(self, name):
+                getattr(self, name).release()
+        for column in getattr(self, '_columns', {}).values():
+            column.release()
+        self._map.close()
+        self._file.close()
+
+    def column(self, name: str) -> memoryview:
+        """
+        数值列（dates、views、forwards），与 ids 按位置对应，缺失值为 NULL_INT
+
+        :param name: 列名
+        """
+        return self._columns[name]
+
+    def get(self, post_id: int) -> Optional[Dict[str, Any]]:
+        """按ID读取帖子"""
+        index = bisect_left(self.ids, post_id)
+        if index < self.count and self.ids[index] == post_id:
+            return self._decode_record(index)
+        return None
+
+    def iter_range(self, from_id: Optional[int] = None, to_id: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        按ID升序读取 [from_id, to_id] 区间内的帖子
+
+        :param from_id: 起始ID（包含），为空时从头开始
+        :param to_id: 结束ID（包含），为空时到末尾
+        """
+        start = bisect_left(self.ids, from_id) if from_id is not None else 0
+        stop = bisect_right(self.ids, to_id) if to_id is not None else self.count
+        for index in range(start, stop):
+            yield self._decode_record(index)
+
+    def _decode_record(self, index: int) -> Dict[str, Any]:
+        value, _ = self._decode(self._records_start + self._offsets[index])
+        return value
+
+    def _decode(self, pos: int) -> Tuple[Any, int]:
+        data = self._map
+        tag = data[pos]
+        pos += 1
+        if tag == _NONE:
+            return None, pos
+        if tag == _TRUE:
+            return True, pos
+        if tag == _FALSE:
+            return False, pos
+        if tag == _INT:
+            value, pos = _read_varint(data, pos)
+            return (value >> 1) ^ -(value & 1), pos
+        if tag == _FLOAT:
+            return _FLOAT64.unpack_from(data, pos)[0], pos + 8
+        if tag == _STR:
+            length, pos = _read_varint(data, pos)
+            return data[pos:pos + length].decode('utf-8'), pos + length
+        if tag == _DICT_STR:
+            index, pos = _read_varint(data, pos)
+            return self._strings[index], pos
+        if tag == _PREFIXED_STR:
+            index, pos = _read_varint(data, pos)
+            length, pos = _read_varint(data, pos)
+            return f"{self._strings[index]}/{data[pos:pos + length].decode('utf-8')}", pos + length
+        if tag == _LIST:
+            length, pos = _read_varint(data, pos)
+            items = []
+            for _ in range(length):
+                item, pos = self._decode(pos)
+                items.append(item)
+            return items, pos
+        if tag == _MAP:
+            length, pos = _read_varint(data, pos)
+            result = {}
+            for _ in range(length):
+                key, pos = _read_varint(data, pos)
+                result[self._strings[key]], pos = self._decode(pos)
+            return result, pos
+        raise ValueError(f"未知的类型标记 {tag}（位置 {pos - 1}）")
@@ -0,0 +1,659 @@
+import hashlib
+import json
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+# 随会话变化、不代表内容变化的字段，不参与内容哈希（旧永久ID由存储在重写帖子时补上，重新获取的帖子没有）
+VOLATILE_KEYS = frozenset({'file_id', 'legacy_permanent_id', 'legacy_permanent_url'})
+
+# 批次日志的状态：已获取（日志中保存转换后的消息）→ 已写入帖子存储 → 已发布（从日志中删除）
+JOURNAL_FETCHED = "fetched"
+JOURNAL_PERSISTED = "persisted"
+
+
+def _strip_volatile(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: _strip_volatile(item) for key, item in value.items() if key not in VOLATILE_KEYS}
+    if isinstance(value, list):
+        return [_strip_volatile(item) for item in value]
+    return value
+
+
+def _media_list(post: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return post.get('images') or post.get('files') or ([post['media']] if post.get('media') else [])
+
+
+def media_entries(post: Dict[str, Any], legacy: bool = False) -> List[Tuple[str, Dict[str, Any], bool]]:
+    """
+    帖子中可以通过永久链接访问的文件
+
+    :param legacy: 是否同时列出旧版本的永久链接（见 _keep_legacy_ids）
+    :return: [(永久链接中的文件名, 媒体信息, 是否为缩略图)]，缩略图对应的媒体信息是它所属的媒体
+    """
+    entries = []
+    for media in _media_list(post):
+        for info, thumb in ((media, False), (media.get('thumb'), True)):
+            if not info:
+                continue
+            entries.append((info['permanent_url'].rsplit('/', 1)[-1], media, thumb))
+            if legacy and info.get('legacy_permanent_url'):
+                entries.append((info['legacy_permanent_url'].rsplit('/', 1)[-1], media, thumb))
+    return entries
+
+
+def _keep_legacy_ids(post: Dict[str, Any], previous: Dict[str, Any]):
+    """
+    保留帖子重写前的永久ID
+
+    早期版本按 file_id 生成永久ID，同一帖子重新获取（对账、编辑、媒体组补全）后会得到按 file_unique_id
+    生成的新ID。已发布的页面、订阅源和外部链接仍指向旧ID，因此把旧ID和链接记在媒体信息的
+    legacy_permanent_id / legacy_permanent_url 中，媒体索引同时收录新旧文件名，解析服务两者都接受。
+    旧数据没有 file_unique_id，按媒体在帖子中的位置和类型对应。
+    """
+    for media, old in zip(_media_list(post), _media_list(previous)):
+        if old.get('media_type') != media.get('media_type') or \
+                old.get('file_unique_id') not in (None, media.get('file_unique_id')):
+            continue
+        for info, old_info in ((media, old), (media.get('thumb'), old.get('thumb'))):
+            if not info or not old_info:
+                continue
+            if old_info.get('legacy_permanent_id'):
+                info['legacy_permanent_id'] = old_info['legacy_permanent_id']
+                info['legacy_permanent_url'] = old_info['legacy_permanent_url']
+            elif old_info['permanent_id'] != info['permanent_id']:
+                info['legacy_permanent_id'] = old_info['permanent_id']
+                info['legacy_permanent_url'] = old_info['permanent_url']
+
+
+def content_hash(post: Dict[str, Any]) -> str:
+    """
+    帖子内容哈希，用于对账时判断帖子是否变化
+
+    :param post: 帖子
+    :return: 32 位十六进制哈希
+    """
+    data = json.dumps(_strip_volatile(post), ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.blake2b(data.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class PostStore:
+    """
+    以消息ID为主键的持久化帖子存储（SQLite）
+
+    每次运行只把新处理的帖子 upsert 进来，生成输出时从这里读取完整归档，
+    因此增量运行不会丢失之前的帖子。每次写入都会分配一个递增的修订号（rev），
+    生成器据此判断哪些输出需要重写。
+    同一个数据库中还保存导出流水线的批次日志（batch_journal），与帖子在同一事务中更新，用于中断后恢复。
+    """
+
+    def __init__(self, path: Path, readonly: bool = False):
+        """
+        打开（或创建）帖子存储
+
+        :param path: 数据库文件路径
+        :param readonly: 只读打开已有的存储（例如在渲染分片的子进程中），不检查表结构
+        """
+        self.path = Path(path)
+        if readonly:
+            self.conn = sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True)
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._init_schema()
+
+    def _init_schema(self):
+        has_media_index = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'media_files'"
+        ).fetchone()
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS posts (
+                id INTEGER PRIMARY KEY,
+                media_group_id TEXT,
+                date TEXT,
+                data TEXT NOT NULL,
+                rev INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS post_members (
+                message_id INTEGER PRIMARY KEY,
+                post_id INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS deleted_posts (
+                id INTEGER PRIMARY KEY,
+                rev INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS rendered_html (
+                id INTEGER PRIMARY KEY,
+                hash TEXT NOT NULL,
+                html TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS media_files (
+                name TEXT PRIMARY KEY,
+                post_id INTEGER NOT NULL,
+                file_unique_id TEXT,
+                thumb INTEGER NOT NULL DEFAULT 0,
+                file_id TEXT NOT NULL,
+                mime_type TEXT,
+                size INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS batch_journal (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                first_id INTEGER NOT NULL,
+                last_id INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                message_ids TEXT NOT NULL,
+                empty_ids TEXT NOT NULL,
+                settled_ids TEXT,
+                messages TEXT,
+                rev INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_posts_media_group ON posts(media_group_id);
+            CREATE INDEX IF NOT EXISTS idx_posts_date ON posts(date);
+            CREATE INDEX IF NOT EXISTS idx_post_members_post ON post_members(post_id);
+        """)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(posts)")}
+        if 'rev' not in columns:
+            self.conn.execute("ALTER TABLE posts ADD COLUMN rev INTEGER NOT NULL DEFAULT 0")
+        if 'hash' not in columns:
+            # 旧数据没有哈希，首次对账时会被视为有变化并重写一次
+            self.conn.execute("ALTER TABLE posts ADD COLUMN hash TEXT")
+        if 'settled_ids' not in {row[1] for row in self.conn.execute("PRAGMA table_info(batch_journal)")}:
+            self.conn.execute("ALTER TABLE batch_journal ADD COLUMN settled_ids TEXT")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_rev ON posts(rev)")
+        # 覆盖按年份汇总的查询，不需要读取帖子数据
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_date_rev ON posts(date, rev)")
+        self.conn.commit()
+        if not has_media_index:
+            # 旧数据库没有媒体索引，从已有帖子补建一次
+            with self.conn:
+                self._index_media(json.loads(row[0]) for row in self.conn.execute("SELECT data FROM posts"))
+
+    def upsert_posts(
+        self,
+        posts: Iterable[Dict[str, Any]],
+        members: Optional[Dict[int, List[int]]] = None
+    ) -> int:
+        """
+        插入或更新帖子
+
+        :param posts: 帖子列表
+        :param members: 帖子ID → 组成该帖子的消息ID（媒体组），未列出的帖子只包含自身
+        :return: 写入的帖子数
+        """
+        with self.conn:
+            return self._upsert_posts(posts, members or {})
+
+    def _upsert_posts(self, posts: Iterable[Dict[str, Any]], members: Dict[int, List[int]]) -> int:
+        rev = self._next_rev()
+        rows = []
+        member_rows = []
+        written = list(posts)
+        previous = self._stored_posts([post['id'] for post in written if _media_list(post)])
+        for post in written:
+            if post['id'] in previous:
+                _keep_legacy_ids(post, previous[post['id']])
+            rows.append((
+                post['id'],
+                post.get('media_group_id'),
+                post.get('date'),
+                json.dumps(post, ensure_ascii=False),
+                rev,
+                content_hash(post)
+            ))
+            member_rows.extend((message_id, post['id']) for message_id in members.get(post['id'], [post['id']]))
+        self.conn.executemany(
+            "INSERT INTO posts (id, media_group_id, date, data, rev, hash) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET "
+            "media_group_id = excluded.media_group_id, date = excluded.date, "
+            "data = excluded.data, rev = excluded.rev, hash = excluded.hash",
+            rows
+        )
+        self.conn.executemany(
+            "INSERT INTO post_members (message_id, post_id) VALUES (?, ?) "
+            "ON CONFLICT(message_id) DO UPDATE SET post_id = excluded.post_id",
+            member_rows
+        )
+        self._index_media(written)
+        return len(rows)
+
+    def _stored_posts(self, post_ids: List[int], chunk_size: int = 500) -> Dict[int, Dict[str, Any]]:
+        """读取已存储的帖子（不存在的ID不返回）"""
+        result = {}
+        for i in range(0, len(post_ids), chunk_size):
+            chunk = post_ids[i:i + chunk_size]
+            rows = self.conn.execute(
+                f"SELECT id, data FROM posts WHERE id IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            result.update((post_id, json.loads(data)) for post_id, data in rows)
+        return result
+
+    def _index_media(self, posts: Iterable[Dict[str, Any]]):
+        """
+        把帖子中的文件写入媒体索引（永久链接文件名 → file_id 等），file_id 总是更新为最新获取的
+
+        旧版本的永久链接（legacy_permanent_url）也作为文件名收录，指向同一个文件。
+        """
+        rows = []
+        for post in posts:
+            for name, media, thumb in media_entries(post, legacy=True):
+                source = media['thumb'] if thumb else media
+                rows.append((
+                    name,
+                    post['id'],
+                    media.get('file_unique_id'),
+                    int(thumb),
+                    source['file_id'],
+                    "image/jpeg" if thumb else media.get('mime_type'),
+                    None if thumb else media.get('file_size')
+                ))
+        self.conn.executemany(
+            "INSERT INTO media_files (name, post_id, file_unique_id, thumb, file_id, mime_type, size) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET post_id = excluded.post_id, file_unique_id = excluded.file_unique_id, "
+            "thumb = excluded.thumb, file_id = excluded.file_id, mime_type = excluded.mime_type, size = excluded.size",
+            rows
+        )
+
+    def lookup_media(self, name: str) -> Optional[Dict[str, Any]]:
+        """
+        按永久链接中的文件名查找文件
+
+        :return: name、post_id、file_unique_id、thumb、file_id、mime_type、size，没有时返回 None
+        """
+        row = self.conn.execute(
+            "SELECT name, post_id, file_unique_id, thumb, file_id, mime_type, size FROM media_files WHERE name = ?",
+            (name,)
+        ).fetchone()
+        if not row:
+            return None
+        keys = ('name', 'post_id', 'file_unique_id', 'thumb', 'file_id', 'mime_type', 'size')
+        return dict(zip(keys, row))
+
+    def update_media_file_id(self, name: str, file_id: str):
+        """文件引用过期后重新获取到 file_id 时更新媒体索引"""
+        with self.conn:
+            self.conn.execute("UPDATE media_files SET file_id = ? WHERE name = ?", (file_id, name))
+
+    def member_ids(self, post_id: int) -> List[int]:
+        """组成帖子的消息ID（旧数据没有成员记录时只有帖子自身）"""
+        rows = self.conn.execute(
+            "SELECT message_id FROM post_members WHERE post_id = ? ORDER BY message_id", (post_id,)
+        ).fetchall()
+        return [row[0] for row in rows] or [post_id]
+
+    def stored_message_ids(self, message_ids: List[int], chunk_size: int = 500) -> Set[int]:
+        """给定ID中已写入帖子存储的消息（帖子本身或媒体组成员）"""
+        result = set()
+        for i in range(0, len(message_ids), chunk_size):
+            chunk = message_ids[i:i + chunk_size]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT message_id FROM post_members WHERE message_id IN ({placeholders}) "
+                f"UNION SELECT id FROM posts WHERE id IN ({placeholders})",
+                chunk + chunk
+            ).fetchall()
+            result.update(row[0] for row in rows)
+        return result
+
+    def delete_posts(self, post_ids: Iterable[int]) -> int:
+        """
+        删除帖子，并记录删除时的修订号，生成器据此重写受影响的分片
+
+        :param post_ids: 帖子ID
+        :return: 实际删除的帖子数
+        """
+        ids = [(post_id,) for post_id in post_ids]
+        if not ids:
+            return 0
+        with self.conn:
+            return self._delete_posts(ids)
+
+    def _delete_posts(self, ids: List[Tuple[int]]) -> int:
+        rev = self._next_rev()
+        names = [
+            row[0] for post_id, in ids
+            for row in self.conn.execute("SELECT name FROM media_files WHERE post_id = ?", (post_id,))
+        ]
+        deleted = self.conn.executemany("DELETE FROM posts WHERE id = ?", ids).rowcount
+        self.conn.executemany("DELETE FROM post_members WHERE post_id = ?", ids)
+        self.conn.executemany("DELETE FROM rendered_html WHERE id = ?", ids)
+        # 已删除帖子的文件不再通过解析服务和镜像提供
+        self.conn.executemany("DELETE FROM media_files WHERE post_id = ?", ids)
+        if names:
+            self._reindex_shared_media(names)
+        self.conn.executemany(
+            "INSERT INTO deleted_posts (id, rev) VALUES (?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET rev = excluded.rev",
+            [(post_id, rev) for post_id, in ids]
+        )
+        return deleted
+
+    def _reindex_shared_media(self, names: List[str], chunk_size: int = 200):
+        """
+        同一文件可能出现在多个帖子中（例如重复使用的贴纸），媒体索引只记录其中一个帖子。
+        删除帖子后，把仍被其他帖子引用的文件重新收录
+        """
+        for i in range(0, len(names), chunk_size):
+            chunk = names[i:i + chunk_size]
+            rows = self.conn.execute(
+                f"SELECT data FROM posts WHERE {' OR '.join(['instr(data, ?) > 0'] * len(chunk))}", chunk
+            ).fetchall()
+            self._index_media(json.loads(row[0]) for row in rows)
+
+    def journal_fetched(
+        self,
+        message_ids: List[int],
+        messages: str,
+        empty_ids: List[int],
+        valid_ids: List[int]
+    ) -> int:
+        """
+        在批次日志中记录一个已获取的批次，崩溃后从日志恢复，不需要重新获取
+
+        批次写入后可以记入检查点的ID（settled_ids）是存在的消息和确认已删除的消息，
+        不包括请求了但尚不能确认的ID（例如固定 end_id 时频道最新消息之后的ID）。
+
+        :param message_ids: 批次请求的消息ID，按升序
+        :param messages: 转换后的消息（JSON）
+        :param empty_ids: 确认已删除的消息ID
+        :param valid_ids: 批次中存在的消息ID
+        :return: 日志条目ID
+        """
+        settled_ids = sorted(set(valid_ids).union(empty_ids))
+        with self.conn:
+            return self.conn.execute(
+                "INSERT INTO batch_journal (first_id, last_id, state, message_ids, empty_ids, settled_ids, messages) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    message_ids[0], message_ids[-1], JOURNAL_FETCHED,
+                    json.dumps(message_ids), json.dumps(empty_ids), json.dumps(settled_ids), messages
+                )
+            ).lastrowid
+
+    def journal_entries(self) -> List[Dict[str, Any]]:
+        """
+        批次日志中尚未发布的条目，按起始消息ID升序
+
+        :return: [{id, first_id, last_id, state, message_ids, empty_ids, settled_ids, messages}]，
+                 已写入的条目没有 messages
+        """
+        rows = self.conn.execute(
+            "SELECT id, first_id, last_id, state, message_ids, empty_ids, settled_ids, messages FROM batch_journal "
+            "ORDER BY first_id, id"
+        ).fetchall()
+        entries = []
+        for journal_id, first_id, last_id, state, message_ids, empty_ids, settled_ids, messages in rows:
+            message_ids, empty_ids = json.loads(message_ids), json.loads(empty_ids)
+            if settled_ids is None:
+                # 旧条目没有记录，用确认已删除的ID和已写入帖子存储的成员消息代替
+                written = {
+                    row[0] for row in self.conn.execute(
+                        "SELECT message_id FROM post_members WHERE message_id BETWEEN ? AND ?", (first_id, last_id)
+                    )
+                }
+                settled_ids = json.dumps(sorted(written.intersection(message_ids).union(empty_ids)))
+            entries.append({
+                "id": journal_id,
+                "first_id": first_id,
+                "last_id": last_id,
+                "state": state,
+                "message_ids": message_ids,
+                "empty_ids": empty_ids,
+                "settled_ids": json.loads(settled_ids),
+                "messages": json.loads(messages) if messages else None,
+            })
+        return entries
+
+    def discard_journal(self, journal_ids: Iterable[int]):
+        """删除批次日志条目"""
+        with self.conn:
+            self.conn.executemany("DELETE FROM batch_journal WHERE id = ?", [(journal_id,) for journal_id in journal_ids])
+
+    def write_batch(
+        self,
+        posts: List[Dict[str, Any]],
+        members: Dict[int, List[int]],
+        stale_ids: List[int],
+        journal_ids: List[int]
+    ) -> int:
+        """
+        写入流水线的一组帖子，并在同一事务中把已完整写入的批次标记为已写入
+
+        :param posts: 帖子
+        :param members: 帖子ID → 成员消息ID
+        :param stale_ids: 需要删除的旧帖子ID
+        :param journal_ids: 所有消息都已写入的批次日志条目
+        :return: 写入的帖子数
+        """
+        with self.conn:
+            if stale_ids:
+                self._delete_posts([(post_id,) for post_id in stale_ids])
+            written = self._upsert_posts(posts, members) if posts else 0
+            if journal_ids:
+                self.conn.executemany(
+                    "UPDATE batch_journal SET state = ?, messages = NULL, rev = ? WHERE id = ?",
+                    [(JOURNAL_PERSISTED, self.current_rev(), journal_id) for journal_id in journal_ids]
+                )
+        return written
+
+    def publish_journal(self, rev: int) -> int:
+        """
+        输出已经按修订号 rev 生成，删除在此之前写入的批次日志条目
+
+        :param rev: 生成输出时帖子存储的修订号
+        :return: 删除的条目数
+        """
+        with self.conn:
+            return self.conn.execute(
+                "DELETE FROM batch_journal WHERE state = ? AND rev <= ?", (JOURNAL_PERSISTED, rev)
+            ).rowcount
+
+    def posts_since(self, date: str) -> List[Tuple[int, Optional[str], List[int]]]:
+        """
+        列出发布时间不早于 date 的帖子，用于对账
+
+        :param date: ISO 格式的时间
+        :return: [(帖子ID, 内容哈希, 成员消息ID列表)]，按ID升序
+        """
+        rows = self.conn.execute(
+            "SELECT p.id, p.hash, GROUP_CONCAT(m.message_id) FROM posts p "
+            "LEFT JOIN post_members m ON m.post_id = p.id "
+            "WHERE p.date >= ? GROUP BY p.id ORDER BY p.id",
+            (date,)
+        ).fetchall()
+        return [
+            (post_id, post_hash, sorted(int(i) for i in member_ids.split(',')) if member_ids else [post_id])
+            for post_id, post_hash, member_ids in rows
+        ]
+
+    def get_post(self, post_id: int) -> Optional[Dict[str, Any]]:
+        """按ID读取帖子"""
+        row = self.conn.execute("SELECT data FROM posts WHERE id = ?", (post_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_post_by_message(self, message_id: int) -> Optional[Dict[str, Any]]:
+        """读取包含某条消息的帖子（媒体组的任一成员都能找到合并后的帖子）"""
+        row = self.conn.execute(
+            "SELECT p.data FROM post_members m JOIN posts p ON p.id = m.post_id WHERE m.message_id = ?",
+            (message_id,)
+        ).fetchone()
+        if row:
+            return json.loads(row[0])
+        # 旧数据没有成员记录
+        return self.get_post(message_id)
+
+    def find_by_media_group(self, media_group_id: str) -> Optional[Dict[str, Any]]:
+        """按媒体组ID读取帖子"""
+        row = self.conn.execute(
+            "SELECT data FROM posts WHERE media_group_id = ? ORDER BY id LIMIT 1",
+            (media_group_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def media_group_members(self, media_group_id: str) -> Optional[Tuple[int, List[int]]]:
+        """
+        按媒体组ID查找已写入的帖子及其成员消息（走索引，不解析帖子数据）
+
+        :return: (帖子ID, 成员消息ID列表)，没有时返回 None
+        """
+        row = self.conn.execute(
+            "SELECT p.id, GROUP_CONCAT(m.message_id) FROM posts p "
+            "LEFT JOIN post_members m ON m.post_id = p.id "
+            "WHERE p.media_group_id = ? GROUP BY p.id ORDER BY p.id LIMIT 1",
+            (media_group_id,)
+        ).fetchone()
+        if not row:
+            return None
+        post_id, member_ids = row
+        return post_id, sorted(int(i) for i in member_ids.split(',')) if member_ids else [post_id]
+
+    def iter_posts(self, from_id: Optional[int] = None, batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """
+        按ID升序逐条读取帖子
+
+        :param from_id: 起始ID（包含），为空时从头读取
+        :param batch_size: 每次从数据库读取的行数
+        """
+        cursor = self.conn.execute(
+            "SELECT data FROM posts WHERE id >= ? ORDER BY id",
+            (from_id if from_id is not None else -(2 ** 63),)
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield json.loads(row[0])
+
+    def ids_every(self, step: int, from_id: Optional[int] = None) -> List[int]:
+        """
+        按ID升序每 step 个帖子取一个ID（每段的第一个ID），只读主键，不解析帖子数据
+
+        :param step: 每段的帖子数
+        :param from_id: 起始ID（包含），为空时从头开始
+        """
+        cursor = self.conn.execute(
+            "SELECT id FROM posts WHERE id >= ? ORDER BY id",
+            (from_id if from_id is not None else -(2 ** 63),)
+        )
+        return [row[0] for i, row in enumerate(cursor) if i % step == 0]
+
+    def posts_between(self, first_id: int, end_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """读取 first_id（包含）到 end_id（不包含，为空时到末尾）之间的帖子，按ID升序返回"""
+        rows = self.conn.execute(
+            "SELECT data FROM posts WHERE id >= ? AND id < ? ORDER BY id",
+            (first_id, end_id if end_id is not None else 2 ** 63 - 1)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def posts_changed_since(self, rev: int, batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """按ID升序读取修订号大于 rev 的帖子（走修订号索引）"""
+        cursor = self.conn.execute("SELECT data FROM posts WHERE rev > ? ORDER BY id", (rev,))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield json.loads(row[0])
+
+    def latest_posts(self, limit: int) -> List[Dict[str, Any]]:
+        """读取最新的若干帖子，按ID升序返回"""
+        rows = self.conn.execute("SELECT data FROM posts ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [json.loads(row[0]) for row in reversed(rows)]
+
+    def latest_post_hashes(self, limit: int) -> List[Tuple[int, Optional[str]]]:
+        """最新的若干帖子的ID和内容哈希，按ID升序返回（只读索引列，不解析帖子数据）"""
+        rows = self.conn.execute("SELECT id, hash FROM posts ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return list(reversed(rows))
+
+    def year_summaries(self) -> Dict[str, Tuple[int, int]]:
+        """
+        按发布年份汇总帖子，用于判断年度归档是否需要重新生成
+
+        任何写入都会提高所在年份的最大修订号，删除会减少帖子数，两者都不变说明该年份没有变化。
+
+        :return: 年份 → (最大修订号, 帖子数)
+        """
+        rows = self.conn.execute(
+            "SELECT substr(date, 1, 4) AS year, MAX(rev), COUNT(*) FROM posts "
+            "WHERE date IS NOT NULL GROUP BY year"
+        ).fetchall()
+        return {year: (rev, count) for year, rev, count in rows}
+
+    def posts_in_year(self, year: str) -> List[Dict[str, Any]]:
+        """读取某一年发布的帖子，按ID升序返回"""
+        rows = self.conn.execute(
+            "SELECT data FROM posts WHERE date >= ? AND date < ? ORDER BY id",
+            (year, str(int(year) + 1))
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def rendered_html(self, post_ids: List[int], chunk_size: int = 500) -> Dict[int, str]:
+        """
+        读取缓存的帖子 HTML，只返回渲染后帖子内容没有变化的条目
+
+        :param post_ids: 帖子ID
+        :param chunk_size: 每次查询的ID数（SQLite 限制了参数个数）
+        :return: 帖子ID → HTML
+        """
+        result = {}
+        for i in range(0, len(post_ids), chunk_size):
+            chunk = post_ids[i:i + chunk_size]
+            rows = self.conn.execute(
+                "SELECT r.id, r.html FROM rendered_html r JOIN posts p ON p.id = r.id AND p.hash = r.hash "
+                f"WHERE r.id IN ({','.join('?' * len(chunk))})",
+                chunk
+            ).fetchall()
+            result.update(rows)
+        return result
+
+    def save_rendered_html(self, items: Dict[int, str]):
+        """
+        缓存帖子 HTML，与帖子当前的内容哈希一起保存
+
+        :param items: 帖子ID → HTML
+        """
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO rendered_html (id, hash, html) "
+                "SELECT id, hash, ? FROM posts WHERE id = ? AND hash IS NOT NULL "
+                "ON CONFLICT(id) DO UPDATE SET hash = excluded.hash, html = excluded.html",
+                [(html, post_id) for post_id, html in items.items()]
+            )
+
+    def count(self) -> int:
+        """帖子总数"""
+        return self.conn.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+
+    def current_rev(self) -> int:
+        """当前修订号"""
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'rev'").fetchone()
+        return row[0] if row else 0
+
+    def min_id_changed_since(self, rev: int) -> Optional[int]:
+        """修订号大于 rev 的帖子（包括被删除的帖子）中最小的ID，没有变化时返回 None"""
+        return self.conn.execute(
+            "SELECT MIN(id) FROM ("
+            "SELECT id FROM posts WHERE rev > ? UNION ALL SELECT id FROM deleted_posts WHERE rev > ?"
+            ")",
+            (rev, rev)
+        ).fetchone()[0]
+
+    def close(self):
+        """关闭数据库连接"""
+        self.conn.close()
+
+    def _next_rev(self) -> int:
+        rev = self.current_rev() + 1
+        self.conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('rev', ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (rev,)
+        )
+        return rev
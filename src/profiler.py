@@ -0,0 +1,293 @@
+import asyncio
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# 栈帧（函数限定名中的一段）→ 阶段名称；采样时取栈中最内层匹配的阶段
+STAGES = {
+    "fetch_stage": "fetch",
+    "transform_stage": "transform",
+    "_transform_batch": "transform",
+    "group_stage": "group",
+    "write_stage": "write",
+    "ingest_messages": "ingest",
+    "reconcile": "reconcile",
+    "discover_latest_id": "discover",
+    "MediaMirror": "mirror",
+    "MediaResolver": "resolver",
+    "generate_output": "generate",
+    "generate_all": "generate",
+}
+# 事件循环线程停在这些函数里时视为空闲（等待计时器或网络）
+IDLE_FRAMES = ("select", "poll", "epoll", "kqueue", "control")
+# 单次运行超过这个时长（秒）的任务步骤单独记入时间线，更短的只计入汇总
+TIMELINE_MIN_STEP = 0.001
+
+
+def _frame_label(code) -> str:
+    name = getattr(code, 'co_qualname', code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _stage_of(codes: List) -> Optional[str]:
+    """栈（从外到内）中最内层的阶段"""
+    for code in reversed(codes):
+        for part in getattr(code, 'co_qualname', code.co_name).split('.'):
+            stage = STAGES.get(part)
+            if stage:
+                return stage
+    return None
+
+
+class RunProfiler:
+    """
+    剖析一次运行（--profile）
+
+    - 采样线程定期记录所有线程的调用栈，按所在的流水线阶段（fetch、transform、group、write、generate 等）
+      归类，写出 flamegraph.pl / speedscope 可以直接读取的折叠栈文件（每个阶段一个，另有合并文件）；
+    - 事件循环线程和每次输出生成分别用 cProfile 记录，写出 .pstats（snakeviz、gprof2dot 可读）；
+    - 记录 asyncio 任务每一步的运行时间和事件循环在 select 中的等待时间，写出 Chrome trace 格式的时间线
+      （chrome://tracing 或 Perfetto 打开），等待按「计时器到期」（sleep、限速）和「网络就绪」区分。
+
+    未启用时 cprofile() 返回空上下文，不影响正常运行。
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.output_dir: Optional[Path] = None
+        self.interval = 0.005
+        self._lock = threading.Lock()
+        self._stacks: Counter = Counter()
+        self._stats: Dict[str, pstats.Stats] = {}
+        self._profiled_threads: set = set()
+        self._events: List[dict] = []
+        self._tasks: Dict[str, List[float]] = {}
+        self._idle = {"timer": 0.0, "io": 0.0}
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._main_profile: Optional[cProfile.Profile] = None
+        self._origin = 0.0
+        self._loop_thread: Optional[int] = None
+        self._restore: List[Tuple[object, str, object]] = []
+
+    def start(self, output_dir: Path, interval: float = 0.005):
+        """
+        开始剖析（在事件循环线程中、事件循环运行后调用）
+
+        :param output_dir: 输出目录
+        :param interval: 采样间隔（秒）
+        """
+        self.enabled = True
+        self.output_dir = Path(output_dir)
+        self.interval = interval
+        self._origin = time.perf_counter()
+        self._install_loop_hooks(asyncio.get_running_loop())
+
+        self._loop_thread = threading.get_ident()
+        self._main_profile = cProfile.Profile()
+        self._profiled_threads.add(self._loop_thread)
+        self._main_profile.enable()
+
+        self._stop.clear()
+        self._sampler = threading.Thread(target=self._sample, name="profiler-sampler", daemon=True)
+        self._sampler.start()
+
+    def stop(self) -> Optional[Path]:
+        """
+        停止剖析并写出结果
+
+        :return: 输出目录
+        """
+        if not self.enabled:
+            return None
+        self.enabled = False
+        self._stop.set()
+        if self._sampler:
+            self._sampler.join()
+        if self._main_profile:
+            self._main_profile.disable()
+            self._profiled_threads.discard(threading.get_ident())
+            self._add_stats("loop", self._main_profile)
+        for target, name, original in reversed(self._restore):
+            setattr(target, name, original)
+        self._restore.clear()
+        self._write()
+        return self.output_dir
+
+    @contextmanager
+    def cprofile(self, name: str):
+        """
+        用 cProfile 记录当前线程中的一段代码，同名的多次记录合并
+
+        线程上已有 cProfile 在运行（例如事件循环线程）时不再嵌套。
+
+        :param name: 输出文件名（{name}.pstats）
+        """
+        thread = threading.get_ident()
+        if not self.enabled or thread in self._profiled_threads:
+            yield
+            return
+        profile = cProfile.Profile()
+        self._profiled_threads.add(thread)
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self._profiled_threads.discard(thread)
+            self._add_stats(name, profile)
+
+    def _add_stats(self, name: str, profile: cProfile.Profile):
+        with self._lock:
+            if name in self._stats:
+                self._stats[name].add(profile)
+            else:
+                self._stats[name] = pstats.Stats(profile)
+
+    def _sample(self):
+        """采样线程：记录所有线程的调用栈"""
+        own = threading.get_ident()
+        loop_thread = self._loop_thread
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                codes = []
+                while frame is not None:
+                    # 剖析器自身的包装函数不出现在栈中
+                    if frame.f_code.co_filename != __file__:
+                        codes.append(frame.f_code)
+                    frame = frame.f_back
+                codes.reverse()
+                stage = _stage_of(codes)
+                if stage is None:
+                    if ident == loop_thread and codes and codes[-1].co_name in IDLE_FRAMES:
+                        stage = "idle"
+                    elif ident not in names:
+                        names = {thread.ident: thread.name for thread in threading.enumerate()}
+                if stage is None:
+                    stage = "main" if ident == loop_thread else names.get(ident, "thread").split('_')[0]
+                self._stacks[(stage, tuple(_frame_label(code) for code in codes))] += 1
+
+    def _install_loop_hooks(self, loop: asyncio.AbstractEventLoop):
+        """记录任务步骤的运行时间和事件循环的等待时间"""
+        profiler = self
+        run = asyncio.events.Handle._run
+
+        def timed_run(handle):
+            start = time.perf_counter()
+            try:
+                return run(handle)
+            finally:
+                profiler._record_step(handle, start, time.perf_counter())
+
+        self._restore.append((asyncio.events.Handle, '_run', run))
+        asyncio.events.Handle._run = timed_run
+
+        # uvloop 等没有 Python 层 selector 的事件循环不记录等待时间
+        selector = getattr(loop, '_selector', None)
+        if selector is None:
+            return
+        select = selector.select
+
+        def timed_select(timeout=None):
+            start = time.perf_counter()
+            events = select(timeout)
+            profiler._record_idle(start, time.perf_counter(), timeout, len(events))
+            return events
+
+        self._restore.append((selector, 'select', select))
+        selector.select = timed_select
+
+    def _record_step(self, handle, start: float, end: float):
+        if not self.enabled:
+            return
+        callback = getattr(handle, '_callback', None)
+        task = getattr(callback, '__self__', None)
+        if isinstance(task, asyncio.Task):
+            coro = task.get_coro()
+            name = getattr(coro, '__qualname__', None) or task.get_name()
+            lane = task.get_name()
+        else:
+            name = getattr(callback, '__qualname__', None) or repr(callback)
+            lane = "callbacks"
+        duration = end - start
+        totals = self._tasks.setdefault(name, [0, 0.0])
+        totals[0] += 1
+        totals[1] += duration
+        if duration >= TIMELINE_MIN_STEP:
+            self._events.append({
+                "name": name, "cat": "task", "ph": "X", "pid": 1, "tid": lane,
+                "ts": (start - self._origin) * 1e6, "dur": duration * 1e6,
+            })
+
+    def _record_idle(self, start: float, end: float, timeout: Optional[float], ready: int):
+        if not self.enabled:
+            return
+        duration = end - start
+        # 没有就绪的 I/O 说明是被最近的计时器（sleep、限速、退避）唤醒的
+        reason = "io" if ready else "timer"
+        self._idle[reason] += duration
+        if duration >= TIMELINE_MIN_STEP:
+            self._events.append({
+                "name": f"idle ({reason})", "cat": "idle", "ph": "X", "pid": 1, "tid": "event loop",
+                "ts": (start - self._origin) * 1e6, "dur": duration * 1e6,
+                "args": {"timeout": timeout, "ready": ready},
+            })
+
+    def _write(self):
+        """写出折叠栈、pstats、时间线和汇总"""
+        output_dir = self.output_dir
+        output_dir.mkdir(parents=True, exist_ok=True)
+        elapsed = time.perf_counter() - self._origin
+
+        by_stage: Dict[str, List[str]] = {}
+        combined = []
+        stage_samples: Counter = Counter()
+        for (stage, frames), count in sorted(self._stacks.items()):
+            line = f"{';'.join(frames)} {count}"
+            by_stage.setdefault(stage, []).append(line)
+            combined.append(f"{stage};{line}")
+            stage_samples[stage] += count
+        (output_dir / "stacks.folded").write_text("\n".join(combined) + "\n", encoding='utf-8')
+        for stage, lines in by_stage.items():
+            (output_dir / f"stacks-{stage}.folded").write_text("\n".join(lines) + "\n", encoding='utf-8')
+
+        for name, stats in self._stats.items():
+            stats.dump_stats(str(output_dir / f"{name}.pstats"))
+
+        trace = {"traceEvents": self._events, "displayTimeUnit": "ms"}
+        (output_dir / "timeline.json").write_text(json.dumps(trace), encoding='utf-8')
+
+        total_samples = sum(stage_samples.values()) or 1
+        lines = [
+            f"运行时间 {elapsed:.2f} 秒，采样间隔 {self.interval * 1000:.0f} ms，共 {total_samples} 个样本",
+            "",
+            "各阶段样本（所有线程）：",
+        ]
+        for stage, count in stage_samples.most_common():
+            lines.append(f"  {stage:<12}{count:>8}  {count / total_samples:>6.1%}")
+        idle = self._idle["timer"] + self._idle["io"]
+        lines += [
+            "",
+            f"事件循环空闲 {idle:.2f} 秒（{idle / elapsed:.1%}）："
+            f"等待计时器 {self._idle['timer']:.2f} 秒，等待网络 {self._idle['io']:.2f} 秒",
+            "",
+            "事件循环上耗时最多的任务（步数、总耗时）：",
+        ]
+        for name, (steps, seconds) in sorted(self._tasks.items(), key=lambda item: -item[1][1])[:20]:
+            lines.append(f"  {seconds:>8.3f} 秒 {steps:>8} 步  {name}")
+        (output_dir / "summary.txt").write_text("\n".join(lines) + "\n", encoding='utf-8')
+
+
+# 进程内共享的剖析器，默认不启用
+profiler = RunProfiler()
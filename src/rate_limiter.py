@@ -0,0 +1,99 @@
+import asyncio
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    自适应令牌桶限速器
+
+    正常情况下以 rate 的速率发放令牌；遇到 FloodWait 时按服务器给出的
+    等待秒数暂停所有请求，并将速率减半，之后每次成功请求再缓慢恢复到上限。
+    """
+
+    def __init__(
+        self,
+        rate: float = 3.0,
+        burst: int = 5,
+        min_rate: float = 0.2,
+        recovery_step: float = 0.05
+    ):
+        """
+        初始化令牌桶
+
+        :param rate: 每秒请求数上限
+        :param burst: 桶容量（允许的突发请求数）
+        :param min_rate: FloodWait 降速后的最低速率
+        :param recovery_step: 每次成功请求后恢复的速率
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.min_rate = min(min_rate, rate)
+        self.recovery_step = recovery_step
+        self.flood_wait_total = 0.0
+
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self, tokens: float = 1.0):
+        """
+        获取令牌，不足时等待（等待者按先来后到排队）
+
+        :param tokens: 需要的令牌数
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+    def delay(self, tokens: float = 1.0) -> float:
+        """
+        估算现在获取令牌需要等待的秒数（不消耗令牌）
+
+        :param tokens: 需要的令牌数
+        """
+        now = time.monotonic()
+        blocked = max(0.0, self._blocked_until - now)
+        available = self._tokens + max(0.0, now - self._updated) * self.rate
+        available = min(float(self.burst), available)
+        return blocked + max(0.0, tokens - available) / self.rate
+
+    def on_success(self):
+        """请求成功后逐步恢复速率"""
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.recovery_step)
+
+    def on_flood_wait(self, seconds: float):
+        """
+        根据 FloodWait 提示暂停并降速
+
+        :param seconds: 服务器要求等待的秒数
+        """
+        now = time.monotonic()
+        self._refill(now)
+        self._blocked_until = max(self._blocked_until, now + seconds)
+        self._tokens = 0.0
+        self._updated = self._blocked_until
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.flood_wait_total += seconds
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(float(self.burst), self._tokens + elapsed * self.rate)
+            self._updated = now
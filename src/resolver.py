@@ -0,0 +1,356 @@
+import asyncio
+import logging
+import mimetypes
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from pyrogram.errors import FileReferenceExpired, FileReferenceInvalid
+from .client_pool import ClientPool
+from .config import ExportConfig, ResolverConfig
+from .media_mirror import CHUNK_SIZE, download_file, find_file_id, refetcher
+from .metrics import metrics
+from .post_store import PostStore
+
+logger = logging.getLogger(__name__)
+
+# 读取缓存文件、写出响应时的块大小
+_SEND_SIZE = 64 * 1024
+_STATUS_TEXT = {
+    200: "OK", 206: "Partial Content", 400: "Bad Request", 404: "Not Found",
+    405: "Method Not Allowed", 416: "Range Not Satisfiable", 502: "Bad Gateway",
+}
+
+
+class DiskCache:
+    """
+    按总字节数限制的磁盘 LRU 缓存
+
+    访问顺序用文件修改时间持久化，重启后按修改时间恢复；超出容量时删除最久未访问的文件。
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int):
+        """
+        :param cache_dir: 缓存目录
+        :param max_bytes: 缓存总大小上限（字节）
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.total = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+
+        files = []
+        for path in self.cache_dir.iterdir():
+            if path.name.endswith(".part"):
+                # 上次退出时没有下载完的文件
+                path.unlink()
+            elif path.is_file():
+                files.append((path.stat().st_mtime, path.name, path.stat().st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self.total += size
+
+    def get(self, name: str) -> Optional[Path]:
+        """命中时返回缓存文件路径，并标记为最近访问；文件已在进程外被删除时视为未命中"""
+        if name not in self._entries:
+            return None
+        path = self.cache_dir / name
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.total -= self._entries.pop(name)
+            return None
+        self._entries.move_to_end(name)
+        return path
+
+    def part_path(self, name: str) -> Path:
+        """下载中的临时文件路径"""
+        return self.cache_dir / f"{name}.part"
+
+    def add(self, name: str) -> Path:
+        """把下载完成的临时文件放入缓存，必要时淘汰旧文件"""
+        path = self.cache_dir / name
+        os.replace(self.part_path(name), path)
+        size = path.stat().st_size
+        self.total += size - self._entries.get(name, 0)
+        self._entries[name] = size
+        self._entries.move_to_end(name)
+
+        # 正在发送的文件被删除后仍可读完（POSIX），新加入的文件本身不淘汰
+        while self.total > self.max_bytes and len(self._entries) > 1:
+            old_name, old_size = self._entries.popitem(last=False)
+            (self.cache_dir / old_name).unlink(missing_ok=True)
+            self.total -= old_size
+        return path
+
+
+class MediaResolver:
+    """
+    永久链接解析服务
+
+    把 /{永久ID}{扩展名} 形式的请求映射到导出时记录在 posts.db 媒体索引中的 file_id
+    （早期版本按 file_id 生成的旧永久ID在帖子重写后仍收录在索引中，新旧链接都能解析），
+    从 Telegram 分块下载后返回，支持 Range 请求。不超过 max_cached_file 的文件缓存在本地磁盘，
+    热点文件之后直接从磁盘发送；同一文件的并发请求只触发一次下载。
+    文件引用过期时重新获取所属帖子的消息，更新媒体索引中的 file_id 后重试。
+    """
+
+    def __init__(self, pool: ClientPool, jobs: List[ExportConfig], config: Optional[ResolverConfig] = None):
+        """
+        :param pool: 客户端池
+        :param jobs: 导出任务，按顺序在各任务的媒体索引中查找文件
+        :param config: 监听地址和缓存设置
+        """
+        self.pool = pool
+        self.config = config or ResolverConfig()
+        self.sources: List[Tuple[ExportConfig, PostStore]] = [
+            (job, PostStore(Path(job.output_path) / "posts.db")) for job in jobs
+        ]
+        self.cache = DiskCache(Path(self.config.cache_dir), self.config.cache_size_mb * 1024 * 1024)
+        self.max_cached_file = self.config.max_cached_file_mb * 1024 * 1024
+        self.stats = {"requests": 0, "hits": 0, "misses": 0, "coalesced": 0, "streamed": 0, "errors": 0}
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def serve(self):
+        """监听直到被取消"""
+        server = await asyncio.start_server(self._handle, self.config.host, self.config.port)
+        logger.info(f"永久链接解析服务已启动: http://{self.config.host}:{self.config.port}/"
+                    f"（缓存 {self.config.cache_dir}，上限 {self.config.cache_size_mb} MB）")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            logger.info(f"解析服务统计: {self.stats}")
+            for _, post_store in self.sources:
+                post_store.close()
+
+    def _count(self, name: str):
+        """累加统计，同时计入运行指标"""
+        self.stats[name] += 1
+        metrics.inc(f"resolver_{name}")
+
+    def lookup(self, name: str) -> Optional[Tuple[ExportConfig, PostStore, Dict[str, Any]]]:
+        """在各任务的媒体索引中查找文件"""
+        for job, post_store in self.sources:
+            entry = post_store.lookup_media(name)
+            if entry:
+                return job, post_store, entry
+        return None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """处理一个 HTTP 请求（每个连接一个请求）"""
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=30)
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=30)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                key, _, value = line.decode('latin-1').partition(':')
+                headers[key.strip().lower()] = value.strip()
+
+            parts = request_line.decode('latin-1').split()
+            if len(parts) != 3:
+                await self._send_error(writer, 400)
+                return
+            method, target, _ = parts
+            if method not in ("GET", "HEAD"):
+                await self._send_error(writer, 405)
+                return
+
+            self._count("requests")
+            name = target.split('?', 1)[0].lstrip('/')
+            found = self.lookup(name) if name and '/' not in name else None
+            if found is None:
+                await self._send_error(writer, 404)
+                return
+            await self._respond(writer, method, headers.get('range'), name, *found)
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception as e:
+            self._count("errors")
+            logger.error(f"解析服务处理请求失败: {e}")
+            try:
+                await self._send_error(writer, 502)
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    async def _respond(
+        self,
+        writer: asyncio.StreamWriter,
+        method: str,
+        range_header: Optional[str],
+        name: str,
+        job: ExportConfig,
+        post_store: PostStore,
+        entry: Dict[str, Any]
+    ):
+        content_type = entry['mime_type'] or mimetypes.guess_type(name)[0] or "application/octet-stream"
+        size = entry['size']
+
+        # 已知大小且超过缓存上限的大文件直接从 Telegram 转发，不占用缓存
+        if size and size > self.max_cached_file and self.cache.get(name) is None:
+            byte_range = self._parse_range(range_header, size)
+            if byte_range == "invalid":
+                await self._send_head(writer, 416, {"Content-Range": f"bytes */{size}", "Content-Length": "0"})
+                return
+            start, end = byte_range or (0, size - 1)
+            await self._send_head(writer, 206 if byte_range else 200, self._content_headers(
+                content_type, start, end, size, partial=byte_range is not None
+            ))
+            if method == "GET":
+                self._count("streamed")
+                await self._stream(writer, job, post_store, entry, start, end)
+            return
+
+        path = await self._cached(name, job, post_store, entry)
+        # 立即打开文件，之后即使被其他下载挤出缓存也能读完
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            byte_range = self._parse_range(range_header, size)
+            if byte_range == "invalid":
+                await self._send_head(writer, 416, {"Content-Range": f"bytes */{size}", "Content-Length": "0"})
+                return
+            start, end = byte_range or (0, size - 1)
+            await self._send_head(writer, 206 if byte_range else 200, self._content_headers(
+                content_type, start, end, size, partial=byte_range is not None
+            ))
+            if method != "GET":
+                return
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = f.read(min(_SEND_SIZE, remaining))
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+                remaining -= len(data)
+
+    async def _cached(self, name: str, job: ExportConfig, post_store: PostStore, entry: Dict[str, Any]) -> Path:
+        """返回缓存中的文件，未命中时下载；同一文件的并发请求共享一次下载"""
+        path = self.cache.get(name)
+        if path is not None:
+            self._count("hits")
+            return path
+
+        future = self._inflight.get(name)
+        if future is None:
+            self._count("misses")
+            future = asyncio.ensure_future(self._download(name, job, post_store, entry))
+            self._inflight[name] = future
+            future.add_done_callback(lambda _: self._inflight.pop(name, None))
+        else:
+            self._count("coalesced")
+        # 某个请求断开不应取消其他请求共享的下载
+        return await asyncio.shield(future)
+
+    async def _download(self, name: str, job: ExportConfig, post_store: PostStore, entry: Dict[str, Any]) -> Path:
+        part_path = self.cache.part_path(name)
+        chat_id = job.source_channel
+        refetch = refetcher(chat_id, post_store, entry)
+        try:
+            try:
+                await download_file(self.pool, entry['file_id'], part_path, job.max_retries, chat_id, refetch)
+            except (FileReferenceExpired, FileReferenceInvalid):
+                file_id = await self._refresh(job, post_store, entry)
+                part_path.unlink(missing_ok=True)
+                await download_file(self.pool, file_id, part_path, job.max_retries, chat_id, refetch)
+        except BaseException:
+            part_path.unlink(missing_ok=True)
+            raise
+        return self.cache.add(name)
+
+    async def _stream(
+        self,
+        writer: asyncio.StreamWriter,
+        job: ExportConfig,
+        post_store: PostStore,
+        entry: Dict[str, Any],
+        start: int,
+        end: int
+    ):
+        """按块从 Telegram 读取 [start, end] 区间并写出"""
+        offset = start // CHUNK_SIZE
+        position = offset * CHUNK_SIZE
+        file_id = entry['file_id']
+        refetch = refetcher(job.source_channel, post_store, entry)
+        for attempt in range(2):
+            stream = self.pool.stream_media(file_id, offset=offset, chat_id=job.source_channel, refetch=refetch)
+            try:
+                async for chunk in stream:
+                    chunk_end = position + len(chunk)
+                    if chunk_end > start:
+                        writer.write(chunk[max(0, start - position):end + 1 - position])
+                        await writer.drain()
+                    position = chunk_end
+                    if position > end:
+                        break
+                return
+            except (FileReferenceExpired, FileReferenceInvalid):
+                # 还没有写出任何数据，可以换新的 file_id 重来
+                if attempt or position > offset * CHUNK_SIZE:
+                    raise
+                file_id = await self._refresh(job, post_store, entry)
+            finally:
+                await stream.aclose()
+
+    async def _refresh(self, job: ExportConfig, post_store: PostStore, entry: Dict[str, Any]) -> str:
+        """重新获取文件所属帖子的消息，更新媒体索引中的 file_id"""
+        messages = await self.pool.get_messages(job.source_channel, post_store.member_ids(entry['post_id']))
+        file_id = find_file_id(messages, entry)
+        if file_id is not None:
+            post_store.update_media_file_id(entry['name'], file_id)
+            entry['file_id'] = file_id
+            return file_id
+        raise FileNotFoundError(f"帖子 {entry['post_id']} 中已找不到文件 {entry['name']}")
+
+    @staticmethod
+    def _parse_range(header: Optional[str], size: int):
+        """
+        解析单个字节区间（bytes=a-b、bytes=a-、bytes=-n）
+
+        :return: (start, end)；没有或不支持的 Range 返回 None（按完整文件响应）；无法满足时返回 "invalid"
+        """
+        if not header or not header.startswith("bytes=") or ',' in header:
+            return None
+        first, _, last = header[len("bytes="):].strip().partition('-')
+        try:
+            if not first:
+                length = int(last)
+                if length <= 0:
+                    return "invalid"
+                return max(0, size - length), size - 1
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        except ValueError:
+            return None
+        if start >= size or start > end:
+            return "invalid"
+        return start, end
+
+    @staticmethod
+    def _content_headers(content_type: str, start: int, end: int, size: int, partial: bool) -> Dict[str, str]:
+        headers = {
+            "Content-Type": content_type,
+            "Content-Length": str(max(0, end - start + 1)),
+            "Accept-Ranges": "bytes",
+            # 永久链接对应的内容不会变化
+            "Cache-Control": "public, max-age=31536000, immutable",
+        }
+        if partial:
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        return headers
+
+    @staticmethod
+    async def _send_head(writer: asyncio.StreamWriter, status: int, headers: Dict[str, str]):
+        lines = [f"HTTP/1.1 {status} {_STATUS_TEXT[status]}", "Connection: close"]
+        lines.extend(f"{key}: {value}" for key, value in headers.items())
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+        await writer.drain()
+
+    async def _send_error(self, writer: asyncio.StreamWriter, status: int):
+        await self._send_head(writer, status, {"Content-Length": "0"})
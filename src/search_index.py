@@ -0,0 +1,148 @@
+import json
+import re
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+from .utils import load_json, save_json, write_if_changed
+
+# 中日韩文字没有空格分词，按单字和相邻双字（bigram）建立索引
+CJK_RANGES = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+# 其他文字按连续的字母和数字切词：[^\W_] 正是 Unicode 字母和数字（类别 L、N），
+# 即 tg-blog.html 中的 [\p{L}\p{N}]，两边再同样排除中日韩文字
+TOKEN_PATTERN = re.compile(f"([{CJK_RANGES}]+)|([^\\W_{CJK_RANGES}]+)")
+# 非中日韩词语的最小长度（按码位计算，页面中同样按码位而不是 UTF-16 单元计算）
+MIN_WORD_LENGTH = 2
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    将文本切分为索引词（与 tg-blog.html 中的 queryTokens 保持一致）
+
+    :param text: 原始文本
+    :return: 去重前的词列表
+    """
+    tokens = []
+    for cjk, word in TOKEN_PATTERN.findall(text.lower()):
+        if cjk:
+            tokens.extend(cjk)
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+        elif len(word) >= MIN_WORD_LENGTH:
+            tokens.append(word)
+    return tokens
+
+
+def bucket_of(token: str, buckets: int) -> int:
+    """FNV-1a 32 位哈希分桶（与 tg-blog.html 中的 bucketOf 保持一致）"""
+    h = 0x811c9dc5
+    for byte in token.encode('utf-8'):
+        h = ((h ^ byte) * 0x01000193) & 0xffffffff
+    return h % buckets
+
+
+class SearchIndexBuilder:
+    """
+    生成客户端搜索使用的倒排索引
+
+    索引按词的哈希分成若干桶文件，每个桶是 {词: 差分编码的帖子ID列表}，
+    页面搜索时只需加载查询词所在的桶。
+    """
+
+    MANIFEST_FILE = "manifest.json"
+    # 每个桶期望包含的帖子ID数量，用于自动确定桶数
+    POSTINGS_PER_BUCKET = 20000
+    MIN_BUCKETS = 16
+    MAX_BUCKETS = 4096
+
+    def __init__(self, index_dir: Path):
+        """
+        :param index_dir: 索引输出目录
+        """
+        self.index_dir = Path(index_dir)
+        # 上次 build 实际重写的桶文件和各桶的内容哈希
+        self.written: List[str] = []
+        self.hashes: List[str] = []
+
+    def build(self, posts: Iterable[Dict[str, Any]], store_rev: int) -> int:
+        """
+        从按ID升序排列的帖子构建索引并写出
+
+        每个桶文件记录内容哈希，内容没有变化的桶不重写，客户端也按桶的哈希做缓存失效。
+
+        :param posts: 帖子
+        :param store_rev: 帖子存储修订号
+        :return: 桶数
+        """
+        postings: Dict[str, List[int]] = defaultdict(list)
+        total_postings = 0
+        for post in posts:
+            # 按首次出现的顺序去重：集合的遍历顺序随进程的字符串哈希种子变化，会让桶文件的内容每次都不同
+            tokens = dict.fromkeys(tokenize(self._searchable_text(post)))
+            for token in tokens:
+                postings[token].append(post['id'])
+            total_postings += len(tokens)
+
+        buckets = self._bucket_count(total_postings)
+
+        bucket_terms: List[Dict[str, List[int]]] = [{} for _ in range(buckets)]
+        for token, ids in postings.items():
+            bucket_terms[bucket_of(token, buckets)][token] = self._delta_encode(ids)
+
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        previous_hashes = self._previous_hashes(buckets)
+        hashes = self.hashes = []
+        self.written = []
+        for i, terms in enumerate(bucket_terms):
+            file_name = f"terms-{i:04d}.json"
+            digest, changed = write_if_changed(
+                self.index_dir / file_name,
+                json.dumps(terms, ensure_ascii=False, separators=(',', ':')),
+                previous_hashes[i]
+            )
+            hashes.append(digest)
+            if changed:
+                self.written.append(file_name)
+
+        # 桶数变少时删除多余的旧桶
+        for old_file in self.index_dir.glob("terms-*.json"):
+            if int(old_file.stem.split('-')[1]) >= buckets:
+                old_file.unlink()
+
+        save_json(self.index_dir / self.MANIFEST_FILE, {
+            "version": 1,
+            "buckets": buckets,
+            "terms": len(postings),
+            "rev": store_rev,
+            "min_word_length": MIN_WORD_LENGTH,
+            "hashes": hashes,
+        })
+        return buckets
+
+    def _previous_hashes(self, buckets: int) -> List[Optional[str]]:
+        """上次生成的各桶内容哈希，桶数变化时全部作废"""
+        try:
+            manifest = load_json(self.index_dir / self.MANIFEST_FILE)
+        except (FileNotFoundError, json.JSONDecodeError):
+            manifest = None
+        if manifest and manifest.get('buckets') == buckets and len(manifest.get('hashes', [])) == buckets:
+            return manifest['hashes']
+        return [None] * buckets
+
+    @staticmethod
+    def _searchable_text(post: Dict[str, Any]) -> str:
+        """帖子中参与搜索的文本"""
+        parts = [post.get('text') or ""]
+        forwarded = post.get('forwarded_from')
+        if forwarded and forwarded.get('name'):
+            parts.append(forwarded['name'])
+        return "\n".join(parts)
+
+    def _bucket_count(self, total_postings: int) -> int:
+        buckets = self.MIN_BUCKETS
+        while buckets < self.MAX_BUCKETS and buckets * self.POSTINGS_PER_BUCKET < total_postings:
+            buckets *= 2
+        return buckets
+
+    @staticmethod
+    def _delta_encode(ids: List[int]) -> List[int]:
+        """升序ID差分编码，减小桶文件体积"""
+        return [ids[0]] + [b - a for a, b in zip(ids, ids[1:])]
@@ -1,7 +1,52 @@
 import asyncio
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
 from pyrogram import Client
-from pyrogram.session import StringSession
+from .client_pool import ClientPool
 from .config import TelegramConfig
+from .utils import load_json, save_json
+
+logger = logging.getLogger(__name__)
+
+
+class ChannelCache:
+    """
+    频道信息的磁盘缓存
+
+    记录频道的基本信息，以及每个账号访问该频道所需的 access_hash。会话字符串的客户端使用内存存储，
+    每次启动时对等方缓存都是空的；有效期内把 access_hash 直接写回客户端存储，就不需要再用 get_chat 解析频道。
+    """
+
+    def __init__(self, path: Optional[Path], ttl: float):
+        """
+        :param path: 缓存文件路径，为空时不缓存
+        :param ttl: 有效期（秒），0 表示每次都重新获取
+        """
+        self.path = path
+        self.ttl = ttl
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        if path and ttl > 0:
+            try:
+                self.entries = load_json(path)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self.entries = {}
+
+    def get(self, channel_id: int) -> Optional[Dict[str, Any]]:
+        """有效期内的缓存条目（info、peer_type、access_hashes）"""
+        entry = self.entries.get(str(channel_id))
+        if entry and time.time() - entry.get('fetched', 0) < self.ttl:
+            return entry
+        return None
+
+    def put(self, channel_id: int, entry: Dict[str, Any]):
+        self.entries[str(channel_id)] = entry
+
+    def save(self):
+        if self.path and self.ttl > 0:
+            save_json(self.path, self.entries)
 
 
 class TelegramClientManager:
@@ -13,72 +58,150 @@ class TelegramClientManager:
         """
         self.config = config
         self.client = None
+        self.clients: List[Client] = []
+        self.channel_cache = ChannelCache(
+            Path(config.channel_cache) if config.channel_cache else None, config.channel_cache_ttl
+        )
+        # 本次运行已打开的频道：频道ID → 频道信息
+        self.channels: Dict[int, Dict[str, Any]] = {}
+        # 频道ID → 可以访问该频道的客户端
+        self.access: Dict[int, List[Client]] = {}
     
-    async def initialize(self) -> Client:
+    async def initialize(self, updates: bool = False) -> Client:
         """
-        初始化并启动客户端
+        初始化并启动所有会话的客户端
         
-        :return: Pyrogram 客户端
+        会话字符串已经授权，不接收更新时只建立连接，跳过 start() 中获取更新状态和当前用户的两次请求。
+
+        :param updates: 是否接收更新（监听模式需要）
+        :return: 主客户端（第一个会话）
         """
-        self.client = Client(
-            "telegram_backup",
-            api_id=self.config.api_id,
-            api_hash=self.config.api_hash,
-            session_string=self.config.session_string
-        )
-        
-        await self.client.start()
-        
-        # 获取当前用户信息
-        me = await self.client.get_me()
-        print(f"已登录: {me.first_name} (@{me.username})")
-        
+        for i, session_string in enumerate(self.config.all_sessions()):
+            client = Client(
+                "telegram_backup" if i == 0 else f"telegram_backup_{i}",
+                api_id=self.config.api_id,
+                api_hash=self.config.api_hash,
+                session_string=session_string,
+                in_memory=True,
+                no_updates=not updates
+            )
+
+            if updates:
+                await client.start()
+                logger.info(f"已登录: {client.me.first_name} (@{client.me.username})")
+            else:
+                if not await client.connect():
+                    await client.disconnect()
+                    raise ConnectionError(f"会话 #{i + 1} 未授权，请重新生成 session_string")
+                await client.initialize()
+                logger.info(f"会话 #{i + 1} 已连接（用户ID {await client.storage.user_id()}）")
+            self.clients.append(client)
+
+        self.client = self.clients[0]
         return self.client
+
+    def create_pool(self, rate: float, burst: int) -> ClientPool:
+        """
+        用所有已启动的客户端创建客户端池，对每个已打开频道的请求只派发给能访问它的客户端
+
+        :param rate: 每个客户端每秒请求数上限
+        :param burst: 每个客户端允许的突发请求数
+        :return: 客户端池
+        """
+        return ClientPool(self.clients, rate=rate, burst=burst, access=self.access)
     
     async def disconnect(self):
         """断开连接"""
-        if self.client:
-            await self.client.stop()
-            print("已断开连接")
+        for client in self.clients:
+            await client.stop()
+        if self.clients:
+            logger.info("已断开连接")
+    
+    async def open_channel(self, channel_id: int) -> Optional[Dict[str, Any]]:
+        """
+        让每个会话都能访问指定频道，返回频道信息
+
+        每个会话都需要先解析一次频道才能按ID获取消息。缓存中有该账号的 access_hash 时直接写入客户端存储，
+        否则调用一次 get_chat（同时得到频道信息）。客户端池由所有任务共享，这里只记录哪些会话能访问该频道，
+        不停用其他会话（它们可能能访问别的频道，见 close_unused）；所有会话都无法访问时由调用方跳过该频道。
+
+        :param channel_id: 频道ID
+        :return: 频道信息，无法访问时返回 None
+        """
+        if channel_id in self.channels:
+            return self.channels[channel_id]
+
+        cached = self.channel_cache.get(channel_id)
+        entry = cached or {"fetched": time.time(), "info": None, "peer_type": None, "access_hashes": {}}
+        accessible = []
+        for i, client in enumerate(self.clients):
+            user_id = str(await client.storage.user_id())
+            access_hash = entry['access_hashes'].get(user_id)
+            if cached and access_hash is not None:
+                info = entry['info']
+                await client.storage.update_peers(
+                    [(info['id'], access_hash, entry['peer_type'], info.get('username'), None)]
+                )
+                accessible.append(client)
+                continue
+
+            try:
+                chat = await client.get_chat(channel_id)
+                peer = await client.storage.get_peer_by_id(chat.id)
+            except Exception as e:
+                logger.warning(f"会话 #{i + 1} 无法访问频道 {channel_id}: {e}")
+                continue
+            logger.info(f"会话 #{i + 1} 成功访问频道: {chat.title} (ID: {channel_id})")
+            entry['info'] = entry['info'] or {
+                "id": chat.id,
+                "title": chat.title,
+                "username": chat.username,
+                "description": chat.description,
+                "members_count": chat.members_count,
+                "type": str(chat.type)
+            }
+            entry['peer_type'] = chat.type.value
+            entry['access_hashes'][user_id] = getattr(peer, 'access_hash', 0)
+            accessible.append(client)
+
+        if not accessible:
+            return None
+
+        self.channel_cache.put(channel_id, entry)
+        self.channel_cache.save()
+
+        self.access[channel_id] = accessible
+        self.channels[channel_id] = entry['info']
+        return entry['info']
+
+    async def close_unused(self):
+        """停用无法访问任何已打开频道的会话（在打开所有频道之后、创建客户端池之前调用）"""
+        used = [client for client in self.clients if any(client in clients for clients in self.access.values())]
+        if not used:
+            return
+        for i, client in enumerate(self.clients):
+            if client not in used:
+                logger.warning(f"会话 #{i + 1} 无法访问任何频道，停用该会话")
+                await client.stop()
+        self.clients = used
+        self.client = used[0]
     
     async def test_channel_access(self, channel_id: int) -> bool:
         """
-        测试是否可以访问指定频道
+        测试是否可以访问指定频道（见 open_channel）
         
         :param channel_id: 频道ID
         :return: 是否可以访问
         """
-        if not self.client:
-            return False
-        
-        try:
-            chat = await self.client.get_chat(channel_id)
-            print(f"成功访问频道: {chat.title} (ID: {channel_id})")
-            return True
-        except Exception as e:
-            print(f"无法访问频道 {channel_id}: {e}")
-            return False
+        return await self.open_channel(channel_id) is not None
     
     async def get_channel_info(self, channel_id: int) -> dict:
         """
-        获取频道信息
+        获取频道信息（同一频道在一次运行中只解析一次）
         
         :param channel_id: 频道ID
         :return: 频道信息
         """
         if not self.client:
             return {}
-        
-        try:
-            chat = await self.client.get_chat(channel_id)
-            return {
-                "id": chat.id,
-                "title": chat.title,
-                "username": chat.username,
-                "description": chat.description,
-                "members_count": chat.members_count,
-                "type": str(chat.type)
-            }
-        except Exception as e:
-            print(f"获取频道信息失败: {e}")
-            return {}
+        return await self.open_channel(channel_id) or {}
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+from pyrogram import Client, filters
+from pyrogram.handlers import EditedMessageHandler, MessageHandler
+from pyrogram.types import Message
+from .checkpoint import CheckpointStore
+from .client_pool import ClientPool
+from .config import ExportConfig, RSSConfig, WatchConfig
+from .executor import CPUExecutor
+from .media_cache import MediaCache
+from .media_mirror import MediaMirror
+from .media_processor import MediaProcessor
+from .message_processor import MessageProcessor
+from .metrics import metrics
+from .orchestrator import generate_output
+from .post_store import PostStore
+
+logger = logging.getLogger(__name__)
+
+
+class WatchedChannel:
+    """监听中的一个导出任务及其长期打开的存储"""
+
+    def __init__(self, job: ExportConfig, client_pool: ClientPool):
+        output_dir = Path(job.output_path)
+        self.job = job
+        self.media_cache = MediaCache(
+            max_entries=job.media_cache_size,
+            path=output_dir / "media_cache.json" if job.persist_media_cache else None,
+            domain_prefix=job.domain_prefix.rstrip('/')
+        )
+        self.post_store = PostStore(output_dir / "posts.db")
+        self.processor = MessageProcessor(
+            client_pool, MediaProcessor(job.domain_prefix, self.media_cache), self.post_store, name=job.label
+        )
+        self.checkpoint: CheckpointStore = self.processor._open_checkpoint(output_dir)
+        self.mirror = MediaMirror(
+            client_pool, Path(job.mirror_path), job.domain_prefix, job.mirror_concurrency, job.max_retries,
+            job.source_channel
+        ) if job.mirror_path else None
+        # 同一消息ID只保留最新收到的版本（编辑覆盖新消息）
+        self.pending: Dict[int, Message] = {}
+        self.last_full = time.monotonic()
+        self.needs_full = False
+
+    def close(self):
+        self.checkpoint.close()
+        self.post_store.close()
+        self.media_cache.save()
+
+
+class ChannelWatcher:
+    """
+    监听模式：订阅频道的新消息和编辑消息，按防抖窗口合并成小批次写入帖子存储，
+    随后只更新受影响的分片和订阅源。搜索索引和 posts.json 需要读取完整归档，
+    按 full_interval 的间隔补做完整生成，退出时也会补做一次。
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        client_pool: ClientPool,
+        jobs: List[ExportConfig],
+        rss_config: Optional[RSSConfig] = None,
+        watch_config: Optional[WatchConfig] = None,
+        executor: Optional[CPUExecutor] = None
+    ):
+        """
+        :param client: 接收更新的客户端（每个频道只在一个会话上订阅，避免重复收到同一条更新；
+                       该会话无法访问的频道改在客户端池中第一个能访问它的会话上订阅）
+        :param client_pool: 获取媒体组等补充请求使用的客户端池
+        :param jobs: 要监听的导出任务
+        :param rss_config: 全局 RSS 配置
+        :param watch_config: 防抖和完整生成间隔设置
+        :param executor: 生成输出时渲染分片和订阅条目使用的进程池
+        """
+        self.client = client
+        self.client_pool = client_pool
+        self.jobs = jobs
+        self.rss_config = rss_config
+        self.config = watch_config or WatchConfig()
+        self.executor = executor
+        self.channels: Dict[int, WatchedChannel] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._last_update = 0.0
+        self._handlers = []
+
+    async def run(self):
+        """持续监听直到被取消（Ctrl+C）"""
+        self._wakeup = asyncio.Event()
+        self.channels = {job.source_channel: WatchedChannel(job, self.client_pool) for job in self.jobs}
+        subscriptions: Dict[Client, List[int]] = {}
+        for channel_id in self.channels:
+            members = self.client_pool.available(channel_id)
+            client = self.client if any(member.client is self.client for member in members) else members[0].client
+            subscriptions.setdefault(client, []).append(channel_id)
+        for client, chat_ids in subscriptions.items():
+            for handler_class in (MessageHandler, EditedMessageHandler):
+                handler = handler_class(self._on_update, filters.chat(chat_ids))
+                client.add_handler(handler)
+                self._handlers.append((client, handler))
+
+        logger.info(f"开始监听 {len(self.channels)} 个频道的更新（防抖 {self.config.debounce} 秒）")
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.config.full_interval)
+                except asyncio.TimeoutError:
+                    # 一段时间没有更新，补做之前跳过的完整生成
+                    await self._regenerate_full()
+                    continue
+                await self._debounce()
+                await self._flush()
+        finally:
+            for client, handler in self._handlers:
+                client.remove_handler(handler)
+            self._handlers = []
+            await self._shutdown()
+
+    async def _on_update(self, client: Client, message: Message):
+        channel = self.channels.get(message.chat.id)
+        if channel is None:
+            return
+        channel.pending[message.id] = message
+        self._last_update = time.monotonic()
+        self._wakeup.set()
+
+    async def _debounce(self):
+        """等到更新静默 debounce 秒，或距第一条更新已过 max_delay 秒"""
+        first = time.monotonic()
+        while True:
+            now = time.monotonic()
+            wait = min(self.config.debounce - (now - self._last_update), self.config.max_delay - (now - first))
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    async def _flush(self):
+        """写入积攒的更新，并快速更新受影响的输出"""
+        self._wakeup.clear()
+        loop = asyncio.get_running_loop()
+        for channel_id, channel in self.channels.items():
+            if not channel.pending:
+                continue
+            messages = list(channel.pending.values())
+            channel.pending = {}
+
+            start = time.monotonic()
+            try:
+                written = await channel.processor.ingest_messages(channel_id, messages, channel.checkpoint)
+            except Exception as e:
+                logger.error(f"[{channel.job.label}] 写入 {len(messages)} 条更新失败: {e}")
+                continue
+            if not written:
+                continue
+            if channel.mirror:
+                # 先把新图片放到源站，再发布引用它们的页面
+                await channel.mirror.run(channel.post_store, channel.job.label)
+
+            full = time.monotonic() - channel.last_full >= self.config.full_interval
+            await loop.run_in_executor(None, generate_output, channel.job, self.rss_config, full, self.executor)
+            if full:
+                channel.last_full = time.monotonic()
+            channel.needs_full = not full
+            elapsed = time.monotonic() - start
+            logger.info(f"[{channel.job.label}] 已发布 {len(messages)} 条更新（{written} 条帖子），耗时 {elapsed:.2f} 秒")
+            metrics.observe("publish_seconds", elapsed, job=channel.job.label)
+            metrics.inc("updates", len(messages), job=channel.job.label)
+            # 监听模式不会结束，每次发布后刷新 Prometheus 文件和运行报告
+            metrics.flush()
+
+    async def _regenerate_full(self):
+        """为只做过快速更新的频道补做完整生成"""
+        loop = asyncio.get_running_loop()
+        for channel in self.channels.values():
+            if channel.needs_full:
+                await loop.run_in_executor(None, generate_output, channel.job, self.rss_config, True, self.executor)
+                channel.needs_full = False
+                channel.last_full = time.monotonic()
+
+    async def _shutdown(self):
+        """写入剩余的更新，补做完整生成并关闭存储"""
+        loop = asyncio.get_running_loop()
+        for channel_id, channel in self.channels.items():
+            try:
+                if channel.pending:
+                    await channel.processor.ingest_messages(
+                        channel_id, list(channel.pending.values()), channel.checkpoint
+                    )
+                    channel.needs_full = True
+                if channel.needs_full:
+                    await loop.run_in_executor(None, generate_output, channel.job, self.rss_config, True, self.executor)
+            except Exception as e:
+                logger.error(f"[{channel.job.label}] 退出前写入失败: {e}")
+            finally:
+                channel.close()
+        self.channels = {}